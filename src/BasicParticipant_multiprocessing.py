@@ -19,6 +19,8 @@ from EMDAT_core.Recording import *
 from EMDAT_core.AOI import AOI
 from EMDAT_core.Scene import Scene
 from EMDAT_core.utils import *
+from EMDAT_core.feature_planning import plan_reading
+from EMDAT_core.compressed_input import find_data_file
 
 from EMDAT_eyetracker.TobiiV2Recording import TobiiV2Recording
 from EMDAT_eyetracker.TobiiV3Recording import TobiiV3Recording
@@ -31,7 +33,8 @@ class BasicParticipant(Participant):
     placeholder methods in the Participant class for a basic project
     """
     def __init__(self, pid, eventfile, datafile, fixfile, saccfile, segfile, log_time_offset = None, aoifile = None, prune_length= None,
-                 require_valid_segs = True, auto_partition_low_quality_segments = False, rpsdata = None, export_pupilinfo = False):
+                 require_valid_segs = True, auto_partition_low_quality_segments = False, rpsdata = None, export_pupilinfo = False,
+                 read_plan = None):
         """Inits BasicParticipant class
         Args:
             pid: Participant id
@@ -64,6 +67,9 @@ class BasicParticipant(Participant):
 
             rpsdata: rest pupil sizes for all scenes if available
 
+            read_plan: If not None, a ReadPlan of the data needed by the exported features
+                (see EMDAT_core.feature_planning.plan_reading). All the data is read if None.
+
         Yields:
             a BasicParticipant object
         """
@@ -85,11 +91,11 @@ class BasicParticipant(Participant):
 
         self.features={}
         if params.EYETRACKERTYPE == "TobiiV2":
-            rec = TobiiV2Recording(datafile, fixfile, event_file=eventfile, media_offset=params.MEDIA_OFFSET)
+            rec = TobiiV2Recording(datafile, fixfile, event_file=eventfile, media_offset=params.MEDIA_OFFSET, streaming=params.STREAMING, read_plan=read_plan)
         elif params.EYETRACKERTYPE == "TobiiV3":
-            rec = TobiiV3Recording(datafile, fixfile, saccade_file=saccfile, event_file=eventfile, media_offset=params.MEDIA_OFFSET)
+            rec = TobiiV3Recording(datafile, fixfile, saccade_file=saccfile, event_file=eventfile, media_offset=params.MEDIA_OFFSET, streaming=params.STREAMING, read_plan=read_plan)
         elif params.EYETRACKERTYPE == "SMI":
-            rec = SMIRecording(datafile, fixfile, saccade_file=saccfile, event_file=eventfile, media_offset=params.MEDIA_OFFSET)
+            rec = SMIRecording(datafile, fixfile, saccade_file=saccfile, event_file=eventfile, media_offset=params.MEDIA_OFFSET, streaming=params.STREAMING, read_plan=read_plan)
         else:
             raise Exception("Unknown eye tracker type.")
 
@@ -110,8 +116,9 @@ class BasicParticipant(Participant):
         if params.VERBOSE != "QUIET":
             print "Generating features..."
 
-        self.segments, self.scenes = rec.process_rec(scenelist = scenelist,aoilist = aois,prune_length = prune_length, require_valid_segs = require_valid_segs,
-                                                     auto_partition_low_quality_segments = auto_partition_low_quality_segments, rpsdata = rpsdata, export_pupilinfo=export_pupilinfo)
+        process_rec = rec.process_rec_streaming if params.STREAMING else rec.process_rec
+        self.segments, self.scenes = process_rec(scenelist = scenelist,aoilist = aois,prune_length = prune_length, require_valid_segs = require_valid_segs,
+                                                 auto_partition_low_quality_segments = auto_partition_low_quality_segments, rpsdata = rpsdata, export_pupilinfo=export_pupilinfo)
 
         all_segs = sorted(self.segments, key=lambda x: x.start)
         self.whole_scene = Scene(str(pid)+'_allsc',[],rec.all_data,rec.fix_data, saccade_data = rec.sac_data, event_data = rec.event_data, Segments = all_segs, aoilist = aois,prune_length = prune_length, require_valid = require_valid_segs, export_pupilinfo=export_pupilinfo )
@@ -127,7 +134,8 @@ class BasicParticipant(Participant):
 
 
 def read_participants_Basic(q, datadir, user_list, pids, prune_length = None, aoifile = None, log_time_offsets=None,
-                          require_valid_segs = True, auto_partition_low_quality_segments = False, rpsfile = None, export_pupilinfo = False):
+                          require_valid_segs = True, auto_partition_low_quality_segments = False, rpsfile = None, export_pupilinfo = False,
+                          featurelist = None, aoifeaturelist = None, parsing_processes = 1):
     """Generates list of Participant objects. Relevant information is read from input files
 
     Args:
@@ -164,9 +172,19 @@ def read_participants_Basic(q, datadir, user_list, pids, prune_length = None, ao
         rpsfile: If not None, a string containing the name of the '.tsv' file
             with rest pupil sizes for all scenes and for each user.
 
+        featurelist: If not None, the list of the features that will be exported (e.g., params.featurelist).
+            Only the data needed to compute them is read from the eye tracker files, so the other features are unavailable.
+
+        aoifeaturelist: If not None, the list of the AOI features that will be exported, as feature names or
+            as AOI feature labels (e.g., params.aoifeaturelist). Ignored if featurelist is None.
+
+        parsing_processes: the number of processes used to parse each eye tracker file in this process
+            (see params.PARSINGPROCESSES). 1 by default, since the participants are already read in parallel.
+
     Returns:
         a list Participant objects (in queue)
     """
+    params.PARSINGPROCESSES = parsing_processes
     participants = []
     if log_time_offsets == None:    #setting the default offset which is 1 sec
         log_time_offsets = [0]*len(pids)
@@ -174,6 +192,9 @@ def read_participants_Basic(q, datadir, user_list, pids, prune_length = None, ao
     # read rest pupil sizes (rpsvalues) from rpsfile
     rpsdata = read_rest_pupil_sizes(rpsfile)
 
+    # only read the data needed by the exported features
+    read_plan = plan_reading(featurelist, aoifeaturelist, export_pupilinfo) if featurelist is not None else None
+
     for rec,pid,offset in zip(user_list,pids,log_time_offsets):
         #extract pupil sizes for the current user. Set to None if not available
         if rpsdata != None:
@@ -201,10 +222,14 @@ def read_participants_Basic(q, datadir, user_list, pids, prune_length = None, ao
             evefile = "{dir}/SMI/SMI_Sample_{rec}_Events.txt".format(dir=datadir, rec=rec)
             segfile = "{dir}/SMI/SMI_Sample_{rec}.seg".format(dir=datadir, rec=rec)
 
+        # the exports can be compressed (e.g., P1_Data_Export.tsv.gz)
+        allfile, fixfile, sacfile, evefile = [find_data_file(f) for f in (allfile, fixfile, sacfile, evefile)]
+
         if os.path.exists(allfile):
             p = BasicParticipant(rec, evefile, allfile, fixfile, sacfile, segfile, log_time_offset = offset,
                                 aoifile=aoifile, prune_length = prune_length, require_valid_segs = require_valid_segs,
-                                auto_partition_low_quality_segments = auto_partition_low_quality_segments, rpsdata = currpsdata)
+                                auto_partition_low_quality_segments = auto_partition_low_quality_segments, rpsdata = currpsdata,
+                                read_plan = read_plan)
             participants.append(p)
         else:
             print "Error reading participant files for: "+str(pid)
@@ -212,7 +237,8 @@ def read_participants_Basic(q, datadir, user_list, pids, prune_length = None, ao
     return
 
 def read_participants_Basic_multiprocessing(nbprocesses, datadir, user_list, pids, prune_length = None, aoifile = None, log_time_offsets = None,
-                          require_valid_segs = True, auto_partition_low_quality_segments = False, rpsfile = None, export_pupilinfo = False):
+                          require_valid_segs = True, auto_partition_low_quality_segments = False, rpsfile = None, export_pupilinfo = False,
+                          featurelist = None, aoifeaturelist = None):
     """Generates list of Participant objects in parallel computing. Relevant information is read from input files
 
     Args:
@@ -249,6 +275,12 @@ def read_participants_Basic_multiprocessing(nbprocesses, datadir, user_list, pid
         rpsfile: If not None, a string containing the name of the '.tsv' file
             with rest pupil sizes for all scenes and for each user.
 
+        featurelist: If not None, the list of the features that will be exported (e.g., params.featurelist).
+            Only the data needed to compute them is read from the eye tracker files, so the other features are unavailable.
+
+        aoifeaturelist: If not None, the list of the AOI features that will be exported, as feature names or
+            as AOI feature labels (e.g., params.aoifeaturelist). Ignored if featurelist is None.
+
     Returns:
         a list Participant objects
     """
@@ -272,10 +304,12 @@ def read_participants_Basic_multiprocessing(nbprocesses, datadir, user_list, pid
         for i in range(0, nbprocesses):
             if log_time_offsets is None:
 			    p = Process(target=read_participants_Basic, args=(q, datadir, user_listsplit[i], pidssplit[i], prune_length, aoifile, log_time_offsets,
-                          require_valid_segs, auto_partition_low_quality_segments, rpsfile, export_pupilinfo))
+                          require_valid_segs, auto_partition_low_quality_segments, rpsfile, export_pupilinfo,
+                          featurelist, aoifeaturelist, 1))
             else:
 			    p = Process(target=read_participants_Basic, args=(q, datadir, user_listsplit[i], pidssplit[i], prune_length, aoifile, log_time_offsets_list[i],
-                          require_valid_segs, auto_partition_low_quality_segments, rpsfile, export_pupilinfo))
+                          require_valid_segs, auto_partition_low_quality_segments, rpsfile, export_pupilinfo,
+                          featurelist, aoifeaturelist, 1))
 
             listprocess.append(p)
             p.start() # start the process
@@ -16,7 +16,10 @@ Institution: The University of British Columbia.
 """
 
 from EMDAT_core.utils import *
+from EMDAT_core.data_structures import GazeSampleTable, RecordingView
 from warnings import warn
+import math
+import numpy as np
 
 
 class AOI():
@@ -71,18 +74,31 @@ class AOI():
         if start == -1:
             return False
 
-        if self.timeseq == [[]]:
-            return True #global AOI
+        activity = self.get_activity()
+        if activity.is_global:
+            return True #global AOI, or one shape at least is global
 
-        for seq in self.timeseq:
-            if seq == []:
-                return True #one shape at least is global
-            for intr in seq:
-                if (start>=intr[0] and start<intr[1])or(end>intr[0] and end<=intr[1]):
-                    return True
-                elif (start<intr[0] and start<intr[1])and(end>intr[0] and end>intr[1]):
-                    warn("Incorrect definition of Dynamic AOI and Segments, AOI info not calculated for AOI:"+self.aid)
-        return False #not active
+        if activity.has_interval_within(start, end):
+            warn("Incorrect definition of Dynamic AOI and Segments, AOI info not calculated for AOI:"+self.aid)
+        return activity.is_active(start, end)
+
+    def get_active_mask(self, timestamps):
+        """Determines at which of the given times the AOI is active, as is_active(t, t) for each time t
+
+        Args:
+            timestamps: a numpy array of times
+
+        Returns:
+            a numpy boolean array indicating whether the AOI is active at each time
+        """
+        timestamps = np.asarray(timestamps)
+        activity = self.get_activity()
+        if activity.is_global:
+            active = np.ones(len(timestamps), dtype=np.bool_) #global AOI, or one shape at least is global
+        else:
+            active = activity.get_active_mask(timestamps)
+        active &= timestamps != -1
+        return active
 
     def is_active_partition(self,start,end):
         """Determines if an AOI is partially active during a given time interval
@@ -105,25 +121,22 @@ class AOI():
         if params.DEBUG or params.VERBOSE == "VERBOSE":
             print("in:",self.aid)
 
-        if self.timeseq == [[]]:
-            return True, [] #global AOI
+        activity = self.get_activity()
+        if activity.is_global:
+            return True, [] #global AOI, or one shape at least is global
+
+        if activity.has_interval_containing(start, end):
+            return True, [] #active during the whole interval
 
         ovelap_part = []
         is_active = False
-        for seq in self.timeseq:
-            if seq == []:
-                return True, [] #one shape at least is global
-            for intr in seq:
-                if (start>=intr[0] and end<=intr[1]):
-                    return True, [] #active during the whole interval
-                else:
-                    if start<=intr[1] and end>=intr[0]:
-                        if params.DEBUG or params.VERBOSE == "VERBOSE":
-                            print("partial:",start,end,":",intr[0],intr[1])
-                        ovstart = max(start,intr[0])
-                        ovend  = min(end,intr[1])
-                        ovelap_part.append( (ovstart,ovend) )
-                        is_active = True
+        for intr in activity.get_overlapping_intervals(start, end):
+            if params.DEBUG or params.VERBOSE == "VERBOSE":
+                print("partial:",start,end,":",intr[0],intr[1])
+            ovstart = max(start,intr[0])
+            ovend  = min(end,intr[1])
+            ovelap_part.append( (ovstart,ovend) )
+            is_active = True
 
         # optimization of ovelap_part (no intervals intersecting each others)
         ovelap_part_opt = []
@@ -138,21 +151,463 @@ class AOI():
                 ovelap_part_opt.append([nseq[0],nseq[1]])
         return is_active, ovelap_part_opt #partially or not active
 
+    def get_active_shapes(self, start, end):
+        """Returns the shapes of the AOI which are active at some point of the given time interval
+
+        Args:
+            start: time interval start
+            end: time interval end (equal to start for the shapes active at a given time)
+
+        Returns:
+            a sorted list of the indices of the active shapes in polyin (and polyout, timeseq)
+        """
+        if start == -1:
+            return []
+        return self.get_activity().get_active_shapes(start, end)
+
+    def get_activity(self):
+        """Returns the AOIActivity of the time intervals of this AOI, which is only built the first time
+        (and again when shapes are added to the AOI)
+        """
+        activity = getattr(self, 'activity', None)
+        if activity is None or activity.num_shapes != len(self.timeseq):
+            activity = self.activity = AOIActivity(self.timeseq)
+        return activity
+
+
+class AOIActivity():
+    """The time intervals during which the shapes of an AOI are active, sorted by start time so that the intervals
+    active at a given time or during a given time interval are found by binary search
+
+    Attributes:
+        num_shapes: the number of shapes of the AOI
+        is_global: True if one shape at least is always active
+        global_shapes: the list of the indices of the shapes which are always active
+        intervals: the list of the (start, end) intervals, in the order of the AOI's timeseq
+        starts, ends: numpy arrays with the starts and ends of the intervals, sorted by start
+        shapes: a numpy array with the index of the shape of each interval (in the same order)
+        order: a numpy array with the index in intervals of each interval (in the same order)
+        max_ends: a numpy array with max_ends[i] the latest end of the first i intervals (-inf for i = 0)
+        min_ends: a numpy array with min_ends[i] the earliest end of the intervals from the i-th one (inf at the end)
+        max_length: the duration of the longest interval
+    """
+
+    def __init__(self, timeseq):
+        """Inits AOIActivity class
+
+        Args:
+            timeseq: the time sequences of the shapes of an AOI (see AOI)
+        """
+        self.num_shapes = len(timeseq)
+        self.is_global = timeseq == [[]] or [] in timeseq
+        self.global_shapes = [shape for shape, seq in enumerate(timeseq) if seq == []]
+        self.intervals = []
+        shapes = []
+        for shape, seq in enumerate(timeseq):
+            for intr in seq:
+                self.intervals.append((intr[0], intr[1]))
+                shapes.append(shape)
+        self.order = np.array(sorted(range(len(self.intervals)), key=lambda i: self.intervals[i][0]), dtype=np.intp)
+        self.starts = np.array([self.intervals[i][0] for i in self.order.tolist()])
+        self.ends = np.array([self.intervals[i][1] for i in self.order.tolist()])
+        self.shapes = np.array(shapes, dtype=np.intp)[self.order]
+        self.max_ends = np.concatenate(([-np.inf], np.maximum.accumulate(self.ends)))
+        self.min_ends = np.concatenate((np.minimum.accumulate(self.ends[::-1])[::-1], [np.inf]))
+        self.max_length = max(np.max(self.ends - self.starts), 0) if len(self.intervals) > 0 else 0
+
+    def is_active(self, start, end):
+        """Returns True if start is in an interval [s, e), or end in an interval (s, e] (see AOI.is_active)
+        """
+        return bool(self.max_ends[np.searchsorted(self.starts, start, 'right')] > start or
+                    self.max_ends[np.searchsorted(self.starts, end, 'left')] >= end)
+
+    def get_active_mask(self, timestamps):
+        """Same as is_active(t, t) for each time t of a numpy array
+        """
+        return ((self.max_ends[np.searchsorted(self.starts, timestamps, 'right')] > timestamps) |
+                (self.max_ends[np.searchsorted(self.starts, timestamps, 'left')] >= timestamps))
+
+    def has_interval_within(self, start, end):
+        """Returns True if an interval starts after start and ends before end
+        """
+        return bool(self.min_ends[np.searchsorted(self.starts, start, 'right')] < end)
+
+    def has_interval_containing(self, start, end):
+        """Returns True if an interval starts before (or at) start and ends after (or at) end
+        """
+        return bool(self.max_ends[np.searchsorted(self.starts, start, 'right')] >= end)
+
+    def _get_overlapping(self, start, end):
+        """Returns a numpy array with the positions (in starts and ends) of the intervals [s, e] overlapping [start, end]
+        """
+        # the intervals ending after start start after start - max_length
+        first = np.searchsorted(self.starts, start - self.max_length, 'left')
+        last = np.searchsorted(self.starts, end, 'right')
+        return first + np.flatnonzero(self.ends[first:last] >= start)
+
+    def get_overlapping_intervals(self, start, end):
+        """Returns the list of the intervals [s, e] overlapping [start, end], in the order of the AOI's timeseq
+        """
+        return [self.intervals[i] for i in sorted(self.order[self._get_overlapping(start, end)].tolist())]
+
+    def get_active_shapes(self, start, end):
+        """Returns a sorted list of the indices of the shapes which are global or have an interval overlapping [start, end]
+        """
+        shapes = set(self.shapes[self._get_overlapping(start, end)].tolist())
+        shapes.update(self.global_shapes)
+        return sorted(shapes)
+
+
+class AOIRaster():
+    """A label bitmap of "AOI"s whose shape never changes, with a cell per pixel: each cell holds a bitset of the
+    "AOI"s it is inside, so that a point is classified with one lookup in the bitmap
+
+    A cell covers the points (x, y) with column < x <= column + 1 and row < y <= row + 1, i.e., the points whose
+    coordinates are rounded up to (column + 1, row + 1). The cells touched by an edge of a polygon (boundary cells)
+    are flagged, and the points in them have to be tested against the polygons.
+
+    Attributes:
+        aois: the list of "AOI"s
+        min_x, min_y: the coordinates of the first cell
+        width, height: the number of cells in each dimension
+        labels: a numpy uint8 array of shape (number of bytes of the bitsets, height, width) with the bit i of a cell
+            set if the cell is inside the i-th AOI (bits in the order of np.packbits)
+        boundary: a numpy boolean array of shape (height, width) indicating the boundary cells
+    """
+
+    # the distance to the cells under which an edge makes them boundary cells, to absorb the rounding errors
+    EPSILON = 1e-6
+
+    def __init__(self, aois, bbox):
+        """Inits AOIRaster class
+
+        Args:
+            aois: a list of "AOI"s whose shape never changes (see is_static_aoi)
+            bbox: the bounding box (min_x, min_y, max_x, max_y) of the polygons of the "AOI"s
+        """
+        self.aois = list(aois)
+        # one cell of margin around the polygons, outside of which the points are outside all the polygons
+        self.min_x = int(math.floor(bbox[0])) - 1
+        self.min_y = int(math.floor(bbox[1])) - 1
+        self.width = int(math.ceil(bbox[2])) + 1 - self.min_x
+        self.height = int(math.ceil(bbox[3])) + 1 - self.min_y
+        self.labels = np.zeros(((len(self.aois) + 7) // 8, self.height, self.width), dtype=np.uint8)
+        self.boundary = np.zeros((self.height, self.width), dtype=np.bool_)
+
+        for i, aoi in enumerate(self.aois):
+            polygons = [poly for poly in aoi.polyin + aoi.polyout if poly]
+            for poly in polygons:
+                for p1, p2 in zip(poly, poly[1:] + poly[:1]):
+                    self._mark_edge(p1, p2)
+            # the cells inside the AOI are found by testing their centers
+            compiled = [compile_polygon(poly) for poly in aoi.polyin if poly]
+            if not compiled:
+                continue
+            column0, column1 = self._cells(min(c.min_x for c in compiled), max(c.max_x for c in compiled), self.min_x, self.width)
+            row0, row1 = self._cells(min(c.min_y for c in compiled), max(c.max_y for c in compiled), self.min_y, self.height)
+            centers_x, centers_y = np.meshgrid(np.arange(column0, column1 + 1) + (self.min_x + 0.5),
+                                               np.arange(row0, row1 + 1) + (self.min_y + 0.5))
+            inside = _points_inside_aoi(centers_x.ravel(), centers_y.ravel(), aoi.polyin, aoi.polyout)
+            cells = self.labels[i // 8, row0:row1 + 1, column0:column1 + 1]
+            cells[inside.reshape(cells.shape)] |= 128 >> (i % 8)
+
+    def _cells(self, low, high, origin, size):
+        """Returns the first and last indices of the cells (in one dimension) whose closure is within EPSILON
+        of the interval [low, high]
+        """
+        first = int(math.ceil(low - self.EPSILON)) - 1 - origin
+        last = int(math.floor(high + self.EPSILON)) - origin
+        return max(first, 0), min(last, size - 1)
+
+    @staticmethod
+    def get_size(num_aois, bbox):
+        """Returns the size in bytes of the AOIRaster of num_aois "AOI"s whose polygons have the given bounding box
+        """
+        width = int(math.ceil(bbox[2])) - int(math.floor(bbox[0])) + 2
+        height = int(math.ceil(bbox[3])) - int(math.floor(bbox[1])) + 2
+        return width * height * ((num_aois + 7) // 8 + 1)
+
+    def _mark_edge(self, p1, p2):
+        """Flags the cells touched by the edge from p1 to p2 as boundary cells
+        """
+        (p1x, p1y), (p2x, p2y) = sorted([(float(p1[0]), float(p1[1])), (float(p2[0]), float(p2[1]))])
+        column0, column1 = self._cells(p1x, p2x, self.min_x, self.width)
+        if p1y == p2y: # horizontal edge
+            row0, row1 = self._cells(p1y, p2y, self.min_y, self.height)
+            self.boundary[row0:row1 + 1, column0:column1 + 1] = True
+            return
+        for column in range(column0, column1 + 1):
+            if p1x == p2x:
+                low, high = min(p1y, p2y), max(p1y, p2y)
+            else:
+                # the part of the edge over the column
+                x0 = min(max(self.min_x + column - self.EPSILON, p1x), p2x)
+                x1 = min(max(self.min_x + column + 1 + self.EPSILON, p1x), p2x)
+                y0 = p1y + (x0 - p1x) * (p2y - p1y) / (p2x - p1x)
+                y1 = p1y + (x1 - p1x) * (p2y - p1y) / (p2x - p1x)
+                low, high = min(y0, y1), max(y0, y1)
+            row0, row1 = self._cells(low, high, self.min_y, self.height)
+            self.boundary[row0:row1 + 1, column] = True
+
+    def lookup(self, xs, ys):
+        """Looks up points in the bitmap
+
+        Args:
+            xs, ys: numpy arrays with the coordinates of the points
+
+        Returns:
+            a numpy boolean array with a row per AOI indicating whether each point is inside the AOI, and a numpy boolean
+            array indicating the points in boundary cells, which have to be tested against the polygons (and are
+            not inside any AOI in the first array)
+        """
+        labels = np.zeros((self.labels.shape[0], len(xs)), dtype=np.uint8)
+        boundary = np.zeros(len(xs), dtype=np.bool_)
+        with np.errstate(invalid='ignore'): # missing coordinates are NaN, and outside
+            columns = np.ceil(xs) - 1 - self.min_x
+            rows = np.ceil(ys) - 1 - self.min_y
+            in_bitmap = np.flatnonzero((columns >= 0) & (columns < self.width) & (rows >= 0) & (rows < self.height))
+        cells = rows[in_bitmap].astype(np.intp) * self.width + columns[in_bitmap].astype(np.intp)
+        boundary[in_bitmap] = self.boundary.ravel().take(cells)
+        labels[:, in_bitmap] = self.labels.reshape(self.labels.shape[0], -1).take(cells, axis=1)
+        labels[:, boundary] = 0
+        return np.unpackbits(labels, axis=0)[:len(self.aois)].view(np.bool_), boundary
+
+
+def is_static_aoi(aoi):
+    """Returns True if all the polygons of an AOI are always active, so that its shape never changes
+    """
+    return aoi.timeseq == [[]] or all(seq == [] for seq in aoi.timeseq)
+
+
+class AOIIndex():
+    """A uniform grid over the bounding boxes of the polygons of a list of "AOI"s, with which each point is only
+    tested against the few "AOI"s whose polygons overlap its cell of the grid
+
+    Attributes:
+        aois: the list of "AOI"s
+        min_x, min_y: the origin of the grid (corner of the bounding box of all the polygons)
+        cell_width, cell_height: the size of the cells
+        size: the number of cells in each dimension
+        aoi_cells: a list with, for each AOI, a sorted numpy array of the ids of the cells its polygons overlap
+        raster: the AOIRaster of the "AOI"s whose shape never changes, or None if they are not rasterized
+            (see params.AOIRASTERMAXSIZE)
+        raster_ids: a list with, for each AOI, its index in raster.aois (None if it is not rasterized)
+    """
+
+    def __init__(self, aois):
+        """Inits AOIIndex class
+
+        Args:
+            aois: a list of "AOI"s, as returned by read_aois
+        """
+        self.aois = list(aois)
+        bboxes = [[compile_polygon(poly) for poly in aoi.polyin if poly] for aoi in self.aois]
+        all_bboxes = [bbox for aoi_bboxes in bboxes for bbox in aoi_bboxes]
+        self.size = min(max(2 * int(math.ceil(math.sqrt(len(all_bboxes)))), 1), 256)
+        if all_bboxes:
+            self.min_x = float(min(bbox.min_x for bbox in all_bboxes))
+            self.min_y = float(min(bbox.min_y for bbox in all_bboxes))
+            self.max_x = float(max(bbox.max_x for bbox in all_bboxes))
+            self.max_y = float(max(bbox.max_y for bbox in all_bboxes))
+        else:
+            self.min_x = self.min_y = self.max_x = self.max_y = 0.0
+        self.cell_width = (self.max_x - self.min_x) / self.size or 1.0
+        self.cell_height = (self.max_y - self.min_y) / self.size or 1.0
+
+        self.aoi_cells = []
+        for aoi_bboxes in bboxes:
+            cells = set()
+            for bbox in aoi_bboxes:
+                (x0, x1), (y0, y1) = self._columns([bbox.min_x, bbox.max_x]).tolist(), self._rows([bbox.min_y, bbox.max_y]).tolist()
+                cells.update(row * self.size + column for row in range(y0, y1 + 1) for column in range(x0, x1 + 1))
+            self.aoi_cells.append(np.array(sorted(cells), dtype=np.intp))
+
+        self.raster = None
+        self.raster_ids = [None] * len(self.aois)
+        static = [i for i, aoi in enumerate(self.aois) if bboxes[i] and is_static_aoi(aoi)]
+        if static:
+            static_bboxes = [bbox for i in static for bbox in bboxes[i]]
+            bbox = (min(b.min_x for b in static_bboxes), min(b.min_y for b in static_bboxes),
+                    max(b.max_x for b in static_bboxes), max(b.max_y for b in static_bboxes))
+            if AOIRaster.get_size(len(static), bbox) <= getattr(params, 'AOIRASTERMAXSIZE', 0):
+                self.raster = AOIRaster([self.aois[i] for i in static], bbox)
+                for j, i in enumerate(static):
+                    self.raster_ids[i] = j
+                # the cells of the grid where the points have to be tested against the "AOI"s which are not rasterized
+                self.unrasterized_cells = np.zeros(self.size * self.size, dtype=np.bool_)
+                for i in range(len(self.aois)):
+                    if self.raster_ids[i] is None:
+                        self.unrasterized_cells[self.aoi_cells[i]] = True
+
+    def _columns(self, xs):
+        return np.minimum(np.floor((np.asarray(xs, dtype=np.float64) - self.min_x) / self.cell_width).astype(np.intp),
+                          self.size - 1)
+
+    def _rows(self, ys):
+        return np.minimum(np.floor((np.asarray(ys, dtype=np.float64) - self.min_y) / self.cell_height).astype(np.intp),
+                          self.size - 1)
+
+    def inside_masks(self, xs, ys):
+        """Determines which points are inside each AOI, testing each point only against the "AOI"s of its cell
+
+        Args:
+            xs, ys: numpy arrays with the coordinates of the points
+
+        Returns:
+            a list with, for each AOI of the index, a numpy boolean array indicating whether each point is inside the AOI
+        """
+        with np.errstate(invalid='ignore'): # missing coordinates are NaN, and outside
+            in_grid = np.flatnonzero((xs >= self.min_x) & (xs <= self.max_x) & (ys >= self.min_y) & (ys <= self.max_y))
+        cells = self._rows(ys[in_grid]) * self.size + self._columns(xs[in_grid])
+        if self.raster is not None:
+            raster_inside, boundary = self.raster.lookup(xs, ys)
+            # only the points in boundary cells of the raster, or near the other "AOI"s, are tested against the polygons
+            tested = boundary[in_grid] | self.unrasterized_cells[cells]
+            in_grid = in_grid[tested]
+            cells = cells[tested]
+        order = np.argsort(cells, kind='mergesort')
+        sorted_cells = cells[order]
+        sorted_points = in_grid[order]
+
+        masks = []
+        for aoi, aoi_cells, raster_id in zip(self.aois, self.aoi_cells, self.raster_ids):
+            if raster_id is None:
+                mask = np.zeros(len(xs), dtype=np.bool_)
+            else:
+                mask = raster_inside[raster_id]
+            starts = np.searchsorted(sorted_cells, aoi_cells, 'left').tolist()
+            ends = np.searchsorted(sorted_cells, aoi_cells, 'right').tolist()
+            parts = [sorted_points[start:end] for start, end in zip(starts, ends) if end > start]
+            if parts:
+                candidates = np.concatenate(parts)
+                if raster_id is not None:
+                    candidates = candidates[boundary[candidates]]
+                mask[candidates] = _points_inside_aoi(xs[candidates], ys[candidates], aoi.polyin, aoi.polyout)
+            masks.append(mask)
+        return masks
+
+    def events_inside_masks(self, events):
+        """Same as inside_masks for the mouse clics of a list of "Event"s (the other events are never inside an AOI)
+        """
+        clics = np.array([i for i, event in enumerate(events) if event.event == "LeftMouseClick" or event.event == "RightMouseClick"],
+                         dtype=np.intp)
+        clic_masks = self.inside_masks(np.array([events[i].data1 for i in clics.tolist()]),
+                                       np.array([events[i].data2 for i in clics.tolist()]))
+        masks = []
+        for clic_mask in clic_masks:
+            mask = np.zeros(len(events), dtype=np.bool_)
+            mask[clics] = clic_mask
+            masks.append(mask)
+        return masks
+
+
+_aoi_indices = {}
+
+
+def get_aoi_index(aois):
+    """Returns the AOIIndex of a list of "AOI"s, which is only built the first time
+    """
+    key = tuple((id(aoi), len(aoi.polyin)) for aoi in aois)
+    if key not in _aoi_indices:
+        _aoi_indices[key] = AOIIndex(aois)
+    return _aoi_indices[key]
+
+
+class FixationAOIs():
+    """Which "AOI"s the "Fixation"s of a Segment are in, computed once for the AOI features, the transitions
+    between "AOI"s and the AOI sequence of the Segment
+
+    Attributes:
+        fixations: the list of "Fixation"s
+        aois: the list of "AOI"s
+        inside: a numpy boolean array with a row per Fixation and a column per AOI, indicating whether
+            the Fixation is inside the polygons of the AOI
+        active: a numpy boolean array of the same shape, indicating whether the AOI is active at the start
+            of the Fixation (see AOI.get_active_mask), used for the AOI sequence
+    """
+
+    def __init__(self, fixations, aois):
+        """Inits FixationAOIs class
+
+        Args:
+            fixations: a list of "Fixation"s
+            aois: a list of "AOI"s
+        """
+        self.fixations = fixations
+        self.aois = list(aois)
+        xs, ys = _fixation_points(fixations)
+        timestamps = np.array([fix.timestamp for fix in fixations])
+        self.inside = np.zeros((len(fixations), len(self.aois)), dtype=np.bool_)
+        self.active = np.zeros((len(fixations), len(self.aois)), dtype=np.bool_)
+        for j, mask in enumerate(get_aoi_index(self.aois).inside_masks(xs, ys)):
+            self.inside[:, j] = mask
+            self.active[:, j] = self.aois[j].get_active_mask(timestamps)
+
+    def get_transition_counts(self, start, end):
+        """Returns the numbers of transitions between the "AOI"s during a Segment, as a numpy integer array whose
+        element [i, j] is the number of "Fixation"s in the j-th AOI whose previous Fixation is in the i-th AOI
+        (whether or not the i-th AOI is active). As in AOI_Stat, only the "Fixation"s in the active intervals of the
+        j-th AOI are considered (see AOI.is_active_partition), and the previous Fixation is the one before in these
+        intervals.
+
+        Args:
+            start: the start of the Segment
+            end: the end of the Segment
+        """
+        counts = np.zeros((len(self.aois), len(self.aois)), dtype=np.int64)
+        whole = []  # the AOIs active during the whole Segment
+        for j, aoi in enumerate(self.aois):
+            is_active, partition = aoi.is_active_partition(start, end)
+            if not is_active:
+                continue
+            if not partition:
+                whole.append(j)
+                continue
+            indices = []
+            for intr in partition:
+                if start <= intr[1] and end >= intr[0]:
+                    _, st, en = get_chunk(self.fixations, 0, intr[0], intr[1])
+                    indices.append(np.arange(st, en, dtype=np.intp))
+            inside = self.inside[np.concatenate(indices)] if indices else self.inside[:0]
+            counts[:, j] = np.count_nonzero(inside[:-1][inside[1:, j]], axis=0)
+        if whole:  # the transitions to these AOIs are counted at once
+            sources = self.inside[:-1].astype(np.float64)
+            targets = self.inside[1:, whole].astype(np.float64)
+            counts[:, whole] = np.dot(sources.T, targets).astype(np.int64)
+        return counts
+
+    def get_sequence(self):
+        """Returns the list of the ids of the active "AOI"s in which the "Fixation"s are, in the order of the
+        "Fixation"s (and in the order of the "AOI"s for a Fixation in several "AOI"s)
+        """
+        _, columns = np.nonzero(self.inside & self.active)
+        return [self.aois[j].aid for j in columns.tolist()]
+
 
 class AOI_Stat():
     """Methods of AOI_Stat calculate and store all features related to the given AOI object
+
+    Attributes:
+        moments: a dict with the Moments of the quantities measured in the AOI ('fixationduration', 'pupilsize',
+            'pupilvelocity' and 'distance'), with which the AOI_Stat objects of the "Segment"s of a Scene are merged
     """
 
-    def __init__(self,aoi, seg_all_data, seg_fixation_data, starttime, endtime, sum_discarded, active_aois, seg_event_data=None, rest_pupil_size = 0, export_pupilinfo = False):
+    def __init__(self,aoi, seg_all_data, seg_fixation_data, starttime, endtime, sum_discarded, active_aois, seg_event_data=None, rest_pupil_size = 0, export_pupilinfo = False,
+                 inside = None, transitions_from = None):
         """Inits AOI_Stat class
 
         Args:
             aoi: the aoi object for which the statistics are calculated
-            seg_all_data: datapoints for this segment
+            seg_all_data: the GazeSampleTable of datapoints for this segment
             seg_fixation_data: fixations for current segment
             starttime:
             endtime:
             active_aois:list of the AOI objects that will be used for calculating the transitions between this AOI and other AOIs
+            inside: a tuple of numpy boolean arrays indicating which samples of seg_all_data and which events of seg_event_data
+                (None if no events) are inside the AOI, as computed by AOIIndex, and which fixations of seg_fixation_data are
+                inside each AOI of active_aois (FixationAOIs.inside). If None, they are tested against the "AOI"s
+            transitions_from: a numpy array with the number of transitions from each AOI of active_aois to this AOI, as
+                counted by FixationAOIs.get_transition_counts. If None, they are counted in the fixations of this AOI
 
         Yields:
             an AOI_Stat object
@@ -213,18 +668,24 @@ class AOI_Stat():
 
         self.numdistancedata = 0
 
-        self.total_trans_from = 0
-        self.variance = 0
-        for aoi in active_aois:
-            aid = aoi.aid
-            self.features['numtransfrom_%s'%(aid)] = 0
-            self.features['proptransfrom_%s'%(aid)] = 0
+        self.moments = {'fixationduration': Moments(), 'pupilsize': Moments(), 'pupilvelocity': Moments(), 'distance': Moments()}
+        self.set_transition_features([aoi.aid for aoi in active_aois], np.zeros(len(active_aois), dtype=np.int64))
 
         if not(self.isActive):
             return
+        if not isinstance(seg_all_data, GazeSampleTable):
+            seg_all_data = GazeSampleTable.from_datapoints(seg_all_data)
+        if inside is None:
+            inside = (_samples_inside_aoi(seg_all_data, self.aoi.polyin, self.aoi.polyout),
+                      FixationAOIs(seg_fixation_data, active_aois).inside,
+                      _events_inside_aoi(seg_event_data, self.aoi.polyin, self.aoi.polyout) if seg_event_data != None else None)
+        seg_samples_inside, seg_fixation_aois, seg_events_inside = inside
         all_data = []
         fixation_data = []
         event_data = []
+        samples_inside = []
+        fixation_aois = []
+        events_inside = []
 
         if partition:
             if params.DEBUG or params.VERBOSE == "VERBOSE":
@@ -232,97 +693,100 @@ class AOI_Stat():
             for intr in partition:
                 if starttime <= intr[1] and endtime >= intr[0]:
                     _,st,en = get_chunk(seg_all_data, 0, intr[0], intr[1])
-                    all_data += seg_all_data[st:en]
+                    all_data.append(seg_all_data[st:en])
+                    samples_inside.append(seg_samples_inside[st:en])
                     _,st,en = get_chunk(seg_fixation_data, 0, intr[0],intr[1])
-                    fixation_data += seg_fixation_data[st:en]
+                    fixation_data.append(RecordingView(seg_fixation_data, st, en))
+                    fixation_aois.append(seg_fixation_aois[st:en])
                     if seg_event_data != None:
                         _,st,en = get_chunk(seg_event_data, 0, intr[0],intr[1])
-                        event_data += seg_event_data[st:en]
+                        event_data.append(RecordingView(seg_event_data, st, en))
+                        events_inside.append(seg_events_inside[st:en])
             if params.DEBUG or params.VERBOSE == "VERBOSE":
                 print("len(seg_all_data)",seg_all_data)
                 print("len(seg_fixation_data)",seg_fixation_data)
                 print("len(fixation_data)",fixation_data)
+            all_data = GazeSampleTable.concatenate(all_data)
+            # the items of a single active interval are not copied
+            fixation_data = fixation_data[0] if len(fixation_data) == 1 else [f for part in fixation_data for f in part]
+            event_data = event_data[0] if len(event_data) == 1 else [e for part in event_data for e in part]
+            samples_inside = np.concatenate(samples_inside) if samples_inside else np.zeros(0, dtype=np.bool_)
+            fixation_aois = np.concatenate(fixation_aois) if fixation_aois else np.zeros((0, len(active_aois)), dtype=np.bool_)
+            events_inside = np.concatenate(events_inside) if events_inside else np.zeros(0, dtype=np.bool_)
         else:  #global AOI (always active)
             all_data = seg_all_data
             fixation_data = seg_fixation_data
+            samples_inside = seg_samples_inside
+            fixation_aois = seg_fixation_aois
             if seg_event_data != None:
                 event_data = seg_event_data
+                events_inside = seg_events_inside
 
-        ## Remove datapoints with invalid gaze coordinates
-        datapoints = filter(lambda datapoint: datapoint.gazepointx != -1 and datapoint.gazepointy != -1, all_data)
-        # Only keep samples inside AOI
-        datapoints = filter(lambda datapoint: _datapoint_inside_aoi(datapoint, self.aoi.polyin, self.aoi.polyout), datapoints)
+        ## Only keep the samples inside AOI, removing the datapoints with invalid gaze coordinates
+        datapoints = all_data[samples_inside & (all_data.gazepointx != -1) & (all_data.gazepointy != -1)]
 
         self.generate_pupil_features(datapoints, rest_pupil_size, export_pupilinfo)
 
         self.generate_distance_features(datapoints)
 
-        fixation_indices = self.generate_fixation_features(datapoints, fixation_data, sum_discarded)
+        columns = [j for j, aoi in enumerate(active_aois) if aoi is self.aoi]
+        fixations_inside = fixation_aois[:, columns[0]] if columns else None
+        fixation_indices = self.generate_fixation_features(datapoints, fixation_data, sum_discarded, fixations_inside)
 
-        self.generate_event_features(seg_event_data, event_data, sum_discarded)
+        self.generate_event_features(seg_event_data, event_data, sum_discarded, events_inside)
 
-        self.generate_transition_features(active_aois, fixation_data, fixation_indices)
+        if transitions_from is not None:
+            self.set_transition_features([aoi.aid for aoi in active_aois], transitions_from)
+        else:
+            self.generate_transition_features(active_aois, fixation_data, fixation_indices, fixation_aois)
 
 
     def generate_pupil_features(self, datapoints, rest_pupil_size, export_pupilinfo):
         #get all datapoints where pupil size is available
-        valid_pupil_data = filter(lambda x: x.pupilsize > 0, datapoints)
-        valid_pupil_velocity = filter(lambda x: x.pupilvelocity != -1, datapoints)
+        valid_pupil_data = datapoints[datapoints.pupilsize > 0]
+        pupilsizes = self.moments['pupilsize'] = Moments.from_array(adjust_pupil_size_array(valid_pupil_data.pupilsize, rest_pupil_size))
+        pupilvelocities = self.moments['pupilvelocity'] = Moments.from_array(datapoints.pupilvelocity[datapoints.pupilvelocity != -1])
         #number of valid pupil sizes
-        self.numpupilsizes = len(valid_pupil_data)
-        self.numpupilvelocity = len(valid_pupil_velocity)
+        self.numpupilsizes = pupilsizes.count
+        self.numpupilvelocity = pupilvelocities.count
 
         if self.numpupilsizes > 0: #check if the current segment has pupil data available
-            if params.PUPIL_ADJUSTMENT == "rpscenter":
-                adjvalidpupilsizes = map(lambda x: x.pupilsize - rest_pupil_size, valid_pupil_data)
-            elif params.PUPIL_ADJUSTMENT == "PCPS":
-                adjvalidpupilsizes = map(lambda x: (x.pupilsize - rest_pupil_size) / (1.0 * rest_pupil_size), valid_pupil_data)
-            else:
-                adjvalidpupilsizes = map(lambda x: x.pupilsize, valid_pupil_data)#valid_pupil_data
-
-            valid_pupil_velocity = map(lambda x: x.pupilvelocity, valid_pupil_velocity)#valid_pupil_data
-
             if export_pupilinfo:
-                self.pupilinfo_for_export = map(lambda x: [x.timestamp, x.pupilsize, rest_pupil_size], valid_pupil_data)
+                self.pupilinfo_for_export = map(lambda t, p: [t, p, rest_pupil_size], valid_pupil_data.timestamp.tolist(), valid_pupil_data.pupilsize.tolist())
 
-            self.features['meanpupilsize'] = mean(adjvalidpupilsizes)
-            self.features['stddevpupilsize'] = stddev(adjvalidpupilsizes)
-            self.features['maxpupilsize'] = max(adjvalidpupilsizes)
-            self.features['minpupilsize'] = min(adjvalidpupilsizes)
-            self.features['startpupilsize'] = adjvalidpupilsizes[0]
-            self.features['endpupilsize'] = adjvalidpupilsizes[-1]
+            self.features['meanpupilsize'] = pupilsizes.mean
+            self.features['stddevpupilsize'] = pupilsizes.get_stddev()
+            self.features['maxpupilsize'] = pupilsizes.max
+            self.features['minpupilsize'] = pupilsizes.min
+            self.features['startpupilsize'] = pupilsizes.first
+            self.features['endpupilsize'] = pupilsizes.last
 
-            if len(valid_pupil_velocity) > 0:
-                self.features['meanpupilvelocity'] = mean(valid_pupil_velocity)
-                self.features['stddevpupilvelocity'] = stddev(valid_pupil_velocity)
-                self.features['maxpupilvelocity'] = max(valid_pupil_velocity)
-                self.features['minpupilvelocity'] = min(valid_pupil_velocity)
+            if pupilvelocities.count > 0:
+                self.features['meanpupilvelocity'] = pupilvelocities.mean
+                self.features['stddevpupilvelocity'] = pupilvelocities.get_stddev()
+                self.features['maxpupilvelocity'] = pupilvelocities.max
+                self.features['minpupilvelocity'] = pupilvelocities.min
 
 
     def generate_distance_features(self, datapoints):
-        # check if pupil sizes are available for all missing points
-        invalid_distance_data = filter(lambda x: x.distance <= 0 and x.gazepointx >= 0, datapoints)
-#        if len(invalid_distance_data) > 0:
-#            warn("Distance from screen is unavailable for a valid data sample. Number of missing points: " + str(len(invalid_distance_data)))
-
-        #get all datapoints where distance is available
-        valid_distance_data = filter(lambda x: x.distance > 0, datapoints)
+        #get all distances where distance is available
+        distances = self.moments['distance'] = Moments.from_array(datapoints.distance[datapoints.distance > 0])
         #number of valid pupil sizes
-        self.numdistancedata = len(valid_distance_data)
+        self.numdistancedata = distances.count
         if self.numdistancedata > 0: #check if the current segment has pupil data available
-            distances_from_screen = map(lambda x: x.distance, valid_distance_data)
-            self.features['meandistance'] = mean(distances_from_screen)
-            self.features['stddevdistance'] = stddev(distances_from_screen)
-            self.features['maxdistance'] = max(distances_from_screen)
-            self.features['mindistance'] = min(distances_from_screen)
-            self.features['startdistance'] = distances_from_screen[0]
-            self.features['enddistance'] = distances_from_screen[-1]
+            self.features['meandistance'] = distances.mean
+            self.features['stddevdistance'] = distances.get_stddev()
+            self.features['maxdistance'] = distances.max
+            self.features['mindistance'] = distances.min
+            self.features['startdistance'] = distances.first
+            self.features['enddistance'] = distances.last
 
 
-    def generate_fixation_features(self, datapoints, fixation_data, sum_discarded):
+    def generate_fixation_features(self, datapoints, fixation_data, sum_discarded, fixations_inside = None):
 
-        fixation_indices = []
-        fixation_indices = filter(lambda i: _fixation_inside_aoi(fixation_data[i], self.aoi.polyin, self.aoi.polyout), range(len(fixation_data)))
+        if fixations_inside is None:
+            fixations_inside = _fixations_inside_aoi(fixation_data, self.aoi.polyin, self.aoi.polyout)
+        fixation_indices = np.flatnonzero(fixations_inside).tolist()
         fixations = map(lambda i: fixation_data[i], fixation_indices)
         numfixations = len(fixations)
         self.features['numfixations'] = numfixations
@@ -330,25 +794,27 @@ class AOI_Stat():
         self.features['timetofirstfixation'] = -1
         self.features['timetolastfixation'] = -1
         self.features['proportionnum'] = 0
-        totaltimespent = sum(map(lambda x: x.fixationduration, fixations))
+        durations = self.moments['fixationduration'] = Moments.from_array(np.array([fix.fixationduration for fix in fixations]))
+        totaltimespent = durations.sum
         self.features['totaltimespent'] = totaltimespent
 
         self.features['proportiontime'] = float(totaltimespent)/(self.length - sum_discarded)
         if numfixations > 0:
-            self.features['longestfixation'] = max(map(lambda x: x.fixationduration, fixations))
-            self.features['meanfixationduration'] = mean(map(lambda x: float(x.fixationduration), fixations))
-            self.features['stddevfixationduration'] = stddev(map(lambda x: float(x.fixationduration), fixations))
+            self.features['longestfixation'] = durations.max
+            self.features['meanfixationduration'] = durations.mean
+            self.features['stddevfixationduration'] = durations.get_stddev()
             self.features['timetofirstfixation'] = fixations[0].timestamp - self.starttime
             self.features['timetolastfixation'] = fixations[-1].timestamp - self.starttime
             self.features['proportionnum'] = float(numfixations)/len(fixation_data)
             self.features['fixationrate'] = numfixations / float(totaltimespent)
-            self.variance = self.features['stddevfixationduration'] ** 2
         return fixation_indices
 
-    def generate_event_features(self, seg_event_data, event_data, sum_discarded):
+    def generate_event_features(self, seg_event_data, event_data, sum_discarded, events_inside = None):
 
         if seg_event_data != None:
-            events = filter(lambda event: _event_inside_aoi(event,self.aoi.polyin, self.aoi.polyout), event_data)
+            if events_inside is None:
+                events_inside = _events_inside_aoi(event_data, self.aoi.polyin, self.aoi.polyout)
+            events = [event_data[i] for i in np.flatnonzero(events_inside).tolist()]
             leftc, rightc, doublec, _ = generate_event_lists(events)
         if seg_event_data != None:
             self.features['numevents'] = len(events)
@@ -366,32 +832,33 @@ class AOI_Stat():
             self.features['timetolastdoubleclic'] = doublec[-1].timestamp - self.starttime if len(doublec) > 0 else -1
 
 
-    def generate_transition_features(self, active_aois, fixation_data, fixation_indices):
+    def generate_transition_features(self, active_aois, fixation_data, fixation_indices, fixation_aois = None):
         #calculating the transitions to and from this AOI and other active AOIs at the moment
-        for aoi in active_aois:
-            aid = aoi.aid
-            self.features['numtransfrom_%s'%(aid)] = 0
-
-        sumtransfrom = 0
-        for i in fixation_indices:
-            if i > 0:
-                for aoi in active_aois:
-                    aid = aoi.aid
-                    polyin = aoi.polyin
-                    polyout = aoi.polyout
-                    key = 'numtransfrom_%s'%(aid)
-
-                    if _fixation_inside_aoi(fixation_data[i-1], polyin, polyout):
-                        self.features[key] += 1
-                        sumtransfrom += 1
-        for aoi in active_aois:
-            aid = aoi.aid
-
-            if sumtransfrom > 0:
-                val = self.features['numtransfrom_%s'%(aid)]
-                self.features['proptransfrom_%s'%(aid)] = float(val) / sumtransfrom
-            else:
-                self.features['proptransfrom_%s'%(aid)] = 0
+        # the fixations preceding the fixations in this AOI
+        previous_indices = np.array(fixation_indices, dtype=np.intp) - 1
+        previous_indices = previous_indices[previous_indices >= 0]
+        if len(previous_indices) > 0:
+            if fixation_aois is None:
+                fixation_aois = FixationAOIs(fixation_data, active_aois).inside
+            counts = np.count_nonzero(fixation_aois[previous_indices], axis=0)
+        else:
+            counts = np.zeros(len(active_aois), dtype=np.int64)
+        self.set_transition_features([aoi.aid for aoi in active_aois], counts)
+
+    def set_transition_features(self, aids, transitions_from):
+        """Sets the transition features of this AOI from the numbers of transitions from each AOI
+
+        Args:
+            aids: the list of the ids of the "AOI"s
+            transitions_from: a numpy array with the number of transitions from each AOI of aids to this AOI
+        """
+        self.transition_aids = aids
+        self.transitions_from = np.array(transitions_from, dtype=np.int64)
+        counts = self.transitions_from.tolist()
+        sumtransfrom = sum(counts)
+        for aid, num in zip(aids, counts):
+            self.features['numtransfrom_%s'%(aid)] = num
+            self.features['proptransfrom_%s'%(aid)] = float(num) / sumtransfrom if sumtransfrom > 0 else 0
         self.total_trans_from = sumtransfrom
 
 
@@ -467,6 +934,75 @@ def _datapoint_inside_aoi(datapoint, polyin, polyout):
     return inside
 
 
+def _samples_inside_aoi(samples, polyin, polyout):
+    """Helper function that checks which samples of a GazeSampleTable are inside the AOI described by external polygon polyin and the internal polygon polyout.
+
+    A sample is inside AOI if it is inside polyin but outside polyout
+
+    Args:
+        samples: A GazeSampleTable
+        polyin: the external polygon in form of a list of (x,y) tuples
+        polyout: the internal polygon in form of a list of (x,y) tuples
+
+    Returns:
+        A numpy array of booleans for whether each sample is inside the AOI or not
+    """
+    return _points_inside_aoi(samples.gazepointx, samples.gazepointy, polyin, polyout)
+
+
+def _points_inside_aoi(xs, ys, polyin, polyout):
+    """Helper function that checks which points are inside the AOI described by external polygon polyin and the internal polygon polyout.
+
+    A point is inside AOI if it is inside one of the polygons of polyin but outside the corresponding polygon of polyout
+
+    Args:
+        xs, ys: numpy arrays with the coordinates of the points
+        polyin: the external polygon in form of a list of (x,y) tuples
+        polyout: the internal polygon in form of a list of (x,y) tuples
+
+    Returns:
+        A numpy array of booleans for whether each point is inside the AOI or not
+    """
+    inside = np.zeros(len(xs), dtype=np.bool_)
+    for i, polyin_i in enumerate(polyin):
+        inside_i = points_inside_polygon(xs, ys, polyin_i)
+        if polyout[i]:
+            inside_i &= ~points_inside_polygon(xs, ys, polyout[i])
+        inside |= inside_i
+    return inside
+
+
+def _fixation_points(fixations):
+    """Returns two numpy arrays with the x and y coordinates (mapped to the media) of a list of "Fixation"s
+    """
+    return (np.array([fix.mappedfixationpointx for fix in fixations]),
+            np.array([fix.mappedfixationpointy for fix in fixations]))
+
+
+def _fixations_inside_aoi(fixations, polyin, polyout):
+    """Helper function that checks which "Fixation"s of a list are inside the AOI described by external polygon polyin and the internal polygon polyout.
+
+    Returns:
+        A numpy array of booleans for whether each Fixation is inside the AOI or not
+    """
+    xs, ys = _fixation_points(fixations)
+    return _points_inside_aoi(xs, ys, polyin, polyout)
+
+
+def _events_inside_aoi(events, polyin, polyout):
+    """Helper function that checks which "Event"s of a list are mouse clics inside the AOI described by external polygon polyin and the internal polygon polyout.
+
+    Returns:
+        A numpy array of booleans for whether each Event is a mouse clic inside the AOI or not
+    """
+    clics = np.array([i for i, event in enumerate(events) if event.event == "LeftMouseClick" or event.event == "RightMouseClick"],
+                     dtype=np.intp)
+    inside = np.zeros(len(events), dtype=np.bool_)
+    inside[clics] = _points_inside_aoi(np.array([events[i].data1 for i in clics.tolist()]),
+                                       np.array([events[i].data2 for i in clics.tolist()]), polyin, polyout)
+    return inside
+
+
 def _fixation_inside_aoi(fixation, polyin, polyout):
     """Helper function that checks if a fixation object is inside the AOI described by external polygon polyin and the internal polygon polyout.
 
@@ -14,31 +14,59 @@ from EMDAT_core.data_structures import *
 from EMDAT_core.Scene import *
 from EMDAT_core.AOI import *
 from EMDAT_core.utils import *
+from EMDAT_core.cache import get_parsed_data_cache
+from EMDAT_core.feature_planning import ReadPlan
 
 
 class Recording:
     __metaclass__ = ABCMeta
 
-    def __init__(self, all_file, fixation_file, saccade_file=None, event_file=None, media_offset=(0, 0)):
+    def __init__(self, all_file, fixation_file, saccade_file=None, event_file=None, media_offset=(0, 0), streaming=False,
+                 read_plan=None):
         """
         :param all_file: path to file that contains all gaze points
         :param fixation_file :path to file that contains all gaze points
         :param event_file :path to file that contains all events
         :param media_offset: the coordinates of the top left corner of the window showing the interface under study.
         (0,0) if the interface was in full screen (default value).
+        :param streaming: True to not read the files now, in which case the recording can only be processed
+        with process_rec_streaming
+        :param read_plan: a ReadPlan of the data needed by the exported features (see EMDAT_core.feature_planning.plan_reading),
+        None to read everything. The saccades and events are not read if the plan does not need them.
         """
         self.media_offset = media_offset
-
-        self.all_data = self.read_all_data(all_file)
+        self.read_plan = read_plan if read_plan is not None else ReadPlan()
+        if not self.read_plan.saccades:
+            saccade_file = None
+        if not self.read_plan.events:
+            event_file = None
+        self.all_file = all_file
+        self.fixation_file = fixation_file
+        self.saccade_file = saccade_file
+        self.event_file = event_file
+
+        if streaming:
+            self.all_data = None
+            self.fix_data = None
+            self.sac_data = [] if saccade_file is not None else None
+            self.event_data = [] if event_file is not None else None
+            return
+
+        if self.single_pass_export and all_file == fixation_file and saccade_file in (None, all_file) \
+                and event_file in (None, all_file):
+            self.read_combined(all_file, saccade_file is not None, event_file is not None)
+            return
+
+        self.all_data = self.read_cached('all', all_file, self.read_all_data)
         if len(self.all_data) == 0:
             raise Exception("The file '" + all_file + "' has no samples!")
 
-        self.fix_data = self.read_fixation_data(fixation_file)
+        self.fix_data = self.read_cached('fixation', fixation_file, self.read_fixation_data)
         if len(self.fix_data) == 0:
             raise Exception("The file '" + fixation_file + "' has no fixations!")
 
         if saccade_file is not None:
-            self.sac_data = self.read_saccade_data(saccade_file)
+            self.sac_data = self.read_cached('saccade', saccade_file, self.read_saccade_data)
             if len(self.sac_data) == 0:
                 raise Exception("The file '" + saccade_file + "' has no saccades!")
 
@@ -46,19 +74,92 @@ class Recording:
             self.sac_data = None
 
         if event_file is not None:
-            self.event_data = self.read_event_data(event_file)
+            self.event_data = self.read_cached('event', event_file, self.read_event_data)
             if len(self.event_data) == 0:
                 raise Exception("The file '" + event_file + "' has no events!")
         else:
             self.event_data = None
 
+    # True if the eye tracker exports samples, fixations, saccades and events in the same file,
+    # in which case the file is scanned only once (see read_combined_data)
+    single_pass_export = False
+
+    def read_combined(self, data_file, read_saccades, read_events):
+        """Reads all the data streams from a single export file in one pass.
+
+        Args:
+            data_file: path to the file that contains gaze points, fixations, saccades and events
+            read_saccades: True if the saccades should be read
+            read_events: True if the events should be read
+        """
+        streams = ['all', 'fixation', 'saccade', 'event']
+        cache = get_parsed_data_cache()
+        if cache is not None:
+            keys = [cache.get_key(self, stream, data_file) for stream in streams]
+            cached = [cache.load(key) if read else (True, None)
+                      for key, read in zip(keys, [True, True, read_saccades, read_events])]
+        if cache is not None and all(hit for hit, _ in cached):
+            self.all_data, self.fix_data, self.sac_data, self.event_data = [data for _, data in cached]
+        else:
+            self.all_data, self.fix_data, self.sac_data, self.event_data = \
+                self.read_combined_data(data_file, read_saccades, read_events)
+            if cache is not None:
+                for key, data, read in zip(keys, [self.all_data, self.fix_data, self.sac_data, self.event_data],
+                                           [True, True, read_saccades, read_events]):
+                    if read:
+                        cache.store(key, data)
+
+        if len(self.all_data) == 0:
+            raise Exception("The file '" + data_file + "' has no samples!")
+        if len(self.fix_data) == 0:
+            raise Exception("The file '" + data_file + "' has no fixations!")
+        if read_saccades and len(self.sac_data) == 0:
+            raise Exception("The file '" + data_file + "' has no saccades!")
+        if read_events and len(self.event_data) == 0:
+            raise Exception("The file '" + data_file + "' has no events!")
+
+    def read_cached(self, stream, data_file, read):
+        """Returns the data stream read from a file, using the parsed data cache (see params.PARSEDDATACACHEFOLDER)
+        to avoid parsing the same file again
+
+        Args:
+            stream: the name of the stream read (e.g., 'all', 'fixation', 'saccade', 'event')
+            data_file: path to the file read
+            read: the method reading the stream from the file (e.g., self.read_all_data)
+
+        Returns:
+            the data returned by read(data_file)
+        """
+        cache = get_parsed_data_cache()
+        if cache is None:
+            return read(data_file)
+        key = cache.get_key(self, stream, data_file)
+        hit, data = cache.load(key)
+        if not hit:
+            data = read(data_file)
+            cache.store(key, data)
+        return data
+
+    def read_combined_data(self, data_file, read_saccades=True, read_events=True):
+        """ Read all the data streams from a single file. Eye trackers that set single_pass_export
+        should override this method to scan the file only once.
+
+        :param data_file: path to file that contains gaze points, fixations, saccades and events
+        :param read_saccades: True if the saccades should be read
+        :param read_events: True if the events should be read
+        :return: a GazeSampleTable, a list of Fixations, a list of Saccades (or None) and a list of Events (or None)
+        """
+        return (self.read_all_data(data_file), self.read_fixation_data(data_file),
+                self.read_saccade_data(data_file) if read_saccades else None,
+                self.read_event_data(data_file) if read_events else None)
+
     @abstractmethod
     def read_all_data(self, all_file):
         """ Read the data file that contains all gaze points.
 
         :param all_file: path to file that contains all gaze points
-        :return: a list of Datapoints
-        :rtype: list[Datapoint]
+        :return: the Datapoints, filled with a GazeSampleTableBuilder
+        :rtype: GazeSampleTable
         """
         pass
 
@@ -92,6 +193,45 @@ class Recording:
         """
         pass
 
+    def iter_all_data(self, all_file):
+        """ Iterate over the gaze points of the data file in timestamp order. Eye trackers should override
+        this method to read the file lazily, the default implementation reads the whole file first.
+
+        :param all_file: path to file that contains all gaze points
+        :return: a generator of dictionaries with the attributes of each gaze point, as accepted by
+        GazeSampleTableBuilder.append
+        """
+        all_data = self.read_all_data(all_file)
+        for i in xrange(len(all_data)):
+            yield all_data.get_row(i)
+
+    def iter_fixations(self, fixation_file):
+        """ Iterate over the fixations of the data file in timestamp order (see iter_all_data).
+
+        :param fixation_file :path to file that contains all fixations points
+        :return: a generator of Fixations
+        """
+        for fixation in self.read_fixation_data(fixation_file):
+            yield fixation
+
+    def iter_saccades(self, saccade_file):
+        """ Iterate over the saccades of the data file in timestamp order (see iter_all_data).
+
+        :param saccade_file :path to file that contains all saccade_file points
+        :return: a generator of Saccades
+        """
+        for saccade in self.read_saccade_data(saccade_file) or []:
+            yield saccade
+
+    def iter_events(self, event_file):
+        """ Iterate over the events of the data file in timestamp order (see iter_all_data).
+
+        :param event_file :path to file that contains all events
+        :return: a generator of Events
+        """
+        for event in self.read_event_data(event_file) or []:
+            yield event
+
     def process_rec(self, segfile=None, scenelist=None, aoifile=None,
                     aoilist=None, prune_length=None, require_valid_segs=True,
                     auto_partition_low_quality_segments=False, rpsdata=None, export_pupilinfo=False):
@@ -136,20 +276,14 @@ class Recording:
             of the "Segment"s of all "Scene"s in the Recording
         """
 
-        if segfile is not None:
-            scenelist = read_segs(segfile)
-            if params.VERBOSE != "QUIET":
-                print("Done reading the segments!")
-        elif scenelist is None:
-            print("Error in scene file.")
+        scenelist, aoilist = read_scenes_and_aois(segfile, scenelist, aoifile, aoilist)
 
-        if aoifile is not None:
-            aoilist = read_aois(aoifile)
-            if params.VERBOSE != "QUIET":
-                print("Done reading the AOIs!")
-        elif aoilist is None:
-            aoilist = []
-            print("Warning: No AOIs defined!")
+        # indexed once for all the scenes, so that the data of each segment is found by binary search (see get_chunk)
+        fix_data = index_by_time(self.fix_data)
+        sac_data = index_by_time(self.sac_data)
+        event_data = index_by_time(self.event_data)
+        # the positions of the data of all the segments of all the scenes, found at once
+        scene_chunks = find_scene_chunks(scenelist, prune_length, self.all_data, fix_data, sac_data, event_data)
 
         scenes = []
         for scid, sc in scenelist.items():
@@ -158,25 +292,12 @@ class Recording:
             if params.DEBUG or params.VERBOSE == "VERBOSE":
                 print("len(all_data)", len(self.all_data))
             try:
-                # get rest pupil size data
-                if rpsdata is not None:
-                    if scid in rpsdata.keys():
-                        scrpsdata = rpsdata[scid]
-                    else:
-                        scrpsdata = 0
-                        if params.DEBUG:
-                            print(rpsdata.keys())
-                            raise Exception("Scene ID " + scid + " is not in the dictionary with rest pupil sizes. rpsdata is set to 0")
-                        else:
-                            print("Warning: Scene ID " + scid + " is not in the dictionary with rest pupil sizes. rpsdata is set to 0")
-                            pass
-                else:
-                    scrpsdata = 0
-                new_scene = Scene(scid, sc, self.all_data, self.fix_data, saccade_data = self.sac_data, event_data=self.event_data, aoilist=aoilist,
+                scrpsdata = get_rest_pupil_size(rpsdata, scid)
+                new_scene = Scene(scid, sc, self.all_data, fix_data, saccade_data = sac_data, event_data=event_data, aoilist=aoilist,
                                   prune_length=prune_length,
                                   require_valid=require_valid_segs,
                                   auto_partition=auto_partition_low_quality_segments, rest_pupil_size=scrpsdata,
-                                  export_pupilinfo=export_pupilinfo)
+                                  export_pupilinfo=export_pupilinfo, segment_chunks=scene_chunks[scid])
             except Exception as e:
                 warn(str(e))
                 new_scene = None
@@ -191,6 +312,129 @@ class Recording:
             segs.extend(sc.segments)
         return segs, scenes
 
+    def process_rec_streaming(self, segfile=None, scenelist=None, aoifile=None,
+                              aoilist=None, prune_length=None, require_valid_segs=True,
+                              auto_partition_low_quality_segments=False, rpsdata=None, export_pupilinfo=False):
+        """Processes the data for one recording like process_rec, but reads the data files with the iter_* methods
+        instead of keeping all the data of the recording in memory (see iter_segments). The recording can be created
+        with streaming=True.
+
+        Args:
+            see process_rec
+
+        Returns:
+            a list of Scene objects for this Recording
+            a list of Segment objects for this recording. This is an aggregated list
+            of the "Segment"s of all "Scene"s in the Recording
+        """
+        scenelist, aoilist = read_scenes_and_aois(segfile, scenelist, aoifile, aoilist)
+
+        scene_segments = dict((scid, [None] * len(sc)) for scid, sc in scenelist.items())
+        failed_scenes = set()
+        for scid, segind, segments in self.iter_segments(scenelist, aoilist, prune_length,
+                                                         auto_partition_low_quality_segments, rpsdata, export_pupilinfo):
+            if isinstance(segments, Exception):
+                if scid not in failed_scenes:
+                    warn(str(segments))
+                    failed_scenes.add(scid)
+                continue
+            scene_segments[scid][segind] = segments
+
+        scenes = []
+        for scid, sc in scenelist.items():
+            if scid in failed_scenes:
+                continue
+            if params.VERBOSE != "QUIET":
+                print("Preparing scene:" + str(scid))
+            segments = []
+            for segs in scene_segments[scid]:
+                segments.extend(segs)
+            try:
+                new_scene = Scene(scid, sc, None, None, saccade_data=[] if self.saccade_file is not None else None,
+                                  event_data=[] if self.event_file is not None else None, Segments=segments,
+                                  aoilist=aoilist, prune_length=prune_length, require_valid=require_valid_segs,
+                                  auto_partition=auto_partition_low_quality_segments, export_pupilinfo=export_pupilinfo)
+            except Exception as e:
+                warn(str(e))
+                new_scene = None
+                if params.DEBUG:
+                    raise
+                else:
+                    pass
+            if new_scene:
+                scenes.append(new_scene)
+        segs = []
+        for sc in scenes:
+            segs.extend(sc.segments)
+        return segs, scenes
+
+    def iter_segments(self, scenelist, aoilist, prune_length=None, auto_partition=False, rpsdata=None,
+                      export_pupilinfo=False):
+        """Generates the "Segment"s of the recording while reading the data files with the iter_* methods.
+
+        The segment definitions are processed in the order of their end time. The data of each stream is read
+        until the end of the current segment, and the data that ends before all the remaining segments is
+        discarded once the "Segment"s of the current segment have been generated. Only the data of the
+        segments overlapping the current one is kept in memory.
+
+        Args:
+            scenelist: a dict with scid as the key and a list of (segid, start, end) tuples as value (see read_segs)
+            aoilist, prune_length, export_pupilinfo: see Scene.__init__
+            auto_partition: see auto_partition_low_quality_segments in process_rec
+            rpsdata: a dictionary with rest pupil sizes: (scene name is a key, rest pupil size is a value)
+
+        Yields:
+            tuples (scid, segind, segments) where segind is the position of the segment definition in
+            scenelist[scid] and segments is the list of "Segment"s generated for it (see build_segments in Scene.py),
+            or the Exception raised while generating them
+        """
+        segdefs = []
+        for scid, sc in scenelist.items():
+            for segind, (segid, start, end) in enumerate(sc):
+                pruned_end = min(end, start + prune_length) if prune_length != None else end
+                segdefs.append((pruned_end, start, scid, segind, segid, end))
+        segdefs.sort()
+        rest_pupil_sizes = dict((scid, get_rest_pupil_size(rpsdata, scid)) for scid in scenelist)
+        # earliest start of the segments remaining after each segment
+        next_starts = [float('infinity')] * len(segdefs)
+        for i in xrange(len(segdefs) - 2, -1, -1):
+            next_starts[i] = min(next_starts[i + 1], segdefs[i + 1][1])
+
+        samples = StreamBuffer(self.iter_all_data(self.all_file), lambda sample: sample["timestamp"])
+        fixations = StreamBuffer(self.iter_fixations(self.fixation_file))
+        saccades = StreamBuffer(self.iter_saccades(self.saccade_file)) if self.saccade_file is not None else None
+        events = StreamBuffer(self.iter_events(self.event_file)) if self.event_file is not None else None
+        streams = [samples, fixations, saccades, events]
+
+        for (pruned_end, start, scid, segind, segid, end), next_start in zip(segdefs, next_starts):
+            for stream in streams:
+                if stream is not None:
+                    stream.read_until(pruned_end)
+            all_data = GazeSampleTableBuilder(self.read_plan.get_skipped_sample_columns())
+            for sample in samples.items:
+                all_data.append(sample)
+            try:
+                segments = build_segments(segid, start, end, all_data.build(), fixations.items,
+                                          saccades.items if saccades is not None else None,
+                                          events.items if events is not None else None, aoilist, prune_length,
+                                          auto_partition, rest_pupil_sizes[scid], export_pupilinfo)
+            except Exception as e:
+                if params.DEBUG:
+                    raise
+                segments = e
+            else:
+                for seg in segments:
+                    seg.set_indices(*[ind + stream.offset if stream is not None and ind is not None else ind
+                                      for ind, stream in zip(seg.get_indices(), [samples, samples, fixations, fixations,
+                                                                                saccades, saccades, events, events])])
+            yield scid, segind, segments
+
+            samples.discard_before(next_start)
+            fixations.discard_before(next_start, keep=1)  # kept for the half fixations (see get_chunk)
+            if saccades is not None:
+                saccades.discard_before(next_start)
+            if events is not None:
+                events.discard_before(next_start)
 
     def clean_memory(self):
         self.all_data = []
@@ -198,6 +442,61 @@ class Recording:
         self.sac_data = []
         self.event_data = []
 
+class StreamBuffer():
+    """The items of a data stream (e.g., samples, fixations) read so far from an iterator and not discarded yet
+
+    Attributes:
+        items: the list of the items in the buffer, in timestamp order
+        offset: the index in the whole stream of the first item in the buffer
+    """
+
+    def __init__(self, iterator, get_timestamp=lambda item: item.timestamp):
+        self.iterator = iterator
+        self.get_timestamp = get_timestamp
+        self.items = []
+        self.offset = 0
+        self.exhausted = False
+
+    def read_until(self, end):
+        """Reads items until the last item in the buffer is after the given time, or the stream is exhausted
+        """
+        while not self.exhausted and (not self.items or self.get_timestamp(self.items[-1]) <= end):
+            try:
+                self.items.append(next(self.iterator))
+            except StopIteration:
+                self.exhausted = True
+
+    def discard_before(self, start, keep=0):
+        """Discards the items before the given time, except the last keep ones
+        """
+        count = 0
+        while count < len(self.items) and self.get_timestamp(self.items[count]) < start:
+            count += 1
+        count = max(count - keep, 0)
+        del self.items[:count]
+        self.offset += count
+
+
+def read_scenes_and_aois(segfile, scenelist, aoifile, aoilist):
+    """Returns the scenes and "AOI"s to use when processing a recording (see process_rec)
+    """
+    if segfile is not None:
+        scenelist = read_segs(segfile)
+        if params.VERBOSE != "QUIET":
+            print("Done reading the segments!")
+    elif scenelist is None:
+        print("Error in scene file.")
+
+    if aoifile is not None:
+        aoilist = read_aois(aoifile)
+        if params.VERBOSE != "QUIET":
+            print("Done reading the AOIs!")
+    elif aoilist is None:
+        aoilist = []
+        print("Warning: No AOIs defined!")
+    return scenelist, aoilist
+
+
 def read_segs(segfile):
     """Returns a dict with scid as the key and segments as value from a '.seg' file.
 
@@ -368,6 +667,22 @@ def read_rest_pupil_sizes(rpsfile):
         return None
 
 
+def get_rest_pupil_size(rpsdata, scid):
+    """Returns the rest pupil size of a scene from a dictionary with rest pupil sizes (see read_rest_pupil_sizes),
+    0 if rpsdata is None or the scene is not in the dictionary
+    """
+    if rpsdata is None:
+        return 0
+    if scid in rpsdata.keys():
+        return rpsdata[scid]
+    if params.DEBUG:
+        print(rpsdata.keys())
+        raise Exception("Scene ID " + scid + " is not in the dictionary with rest pupil sizes. rpsdata is set to 0")
+    else:
+        print("Warning: Scene ID " + scid + " is not in the dictionary with rest pupil sizes. rpsdata is set to 0")
+    return 0
+
+
 def get_pupil_size(pupilleft, pupilright):
     '''
     If recordings for both eyes are available, return their average,
@@ -12,6 +12,7 @@ Institution: The University of British Columbia.
 import math, EMDAT_core.geometry
 from EMDAT_core.utils import *
 from EMDAT_core.Segment import *
+from EMDAT_core.data_structures import RecordingView
 from copy import deepcopy
 
 
@@ -54,12 +55,14 @@ class Scene(Segment):
         fixation_end = fixation_data[-1].timestamp
         aoi_data: A list of AOI_Stat objects for relevants "AOI"s for this Scene
         has_aois: A boolean indicating if this Scene has AOI features calculated for it
+        moments: a dict with the Moments of each quantity measured in this Scene, merged from the moments of its "Segment"s
 
     """
 
 
     def __init__(self, scid, seglist, all_data, fixation_data, saccade_data = None, event_data = None, Segments = None, aoilist = None,
-                  prune_length= None, require_valid = True, auto_partition = False, rest_pupil_size = 0, export_pupilinfo = False):
+                  prune_length= None, require_valid = True, auto_partition = False, rest_pupil_size = 0, export_pupilinfo = False,
+                  segment_chunks = None):
         """
         Args:
             scid: A string containing the id of the Scene.
@@ -98,206 +101,23 @@ class Scene(Segment):
 
             rest_pupil_size: rest pupil size for the current scene
 
+            segment_chunks: If not None, the positions of the data of each segment of seglist in all_data,
+                fixation_data, saccade_data and event_data, as returned by find_segment_chunks (they are
+                otherwise looked up segment by segment)
+
         Yields:
             a Scene object
         """
 
-        ########################################
-        def partition_segment(new_seg, seg_start, seg_end, rest_pupil_size, export_pupilinfo):
-            """ A helper method for splitting a Segment object into new Segments and removing gaps of invalid samples
-
-            One way to deal with a low quality Segment is to find the gaps of invalid samples within its "Datapoint"s and
-            splitting the Segment into two Segments one from the beginnning of the Segment to the gap and another from after
-            the gap to the end of the Segment. This can be done multiple times resulting multiple "Segment"s with higher
-            quality. For example if a Segment S1 started at s1 and ended at e1 and had two invalid gaps between gs1-ge1 and
-            gs2-ge2 milliseconds, this method will generate the following three segments
-                SS1: starting at s1 and ending at gs1
-                SS2: starting at ge1 and ending at gs2
-                SS3: starting at ge2 and ending at e1
-
-            Args:
-                new_seg: The Segment that is being split
-
-                seg_start: An integer showing the start time of the segment in milliseconds
-
-                seg_end: An integer showing the end time of the segment in milliseconds
-
-                rest_pupil_size: rest pupil size for the current scene
-
-            Returns:
-                subsegments: a list of newly generated "Segment"s
-
-                samp_inds: a list of tuples of the form (start, end) that detrmines the index of the start and end of each
-                    new Segment in the old Segment's all_data field
-
-                fix_inds: a list of tuples of the form (start, end) that detrmines the index of the start and end of each
-                    new Segment in the old Segment's fixation_data field
-
-                sac_inds: a list of tuples of the form (start, end) that detrmines the index of the start and end of each
-                    new Segment in the old Segment's saccade_data field
-
-                event_inds: a list of tuples of the form (start, end) that detrmines the index of the start and end of each
-                    new Segment in the old Segment's event_data field
-            """
-            timegaps = new_seg.getgaps()
-            subsegments = []
-            sub_segid = 0
-            samp_inds = []
-            fix_inds = []
-            saccade_inds = []
-            event_inds = []
-            last_samp_idx = 0
-            last_fix_idx = 0
-            last_sac_idx = 0
-            last_event_idx = 0
-            sub_seg_time_start = seg_start
-            for timebounds in timegaps:
-                sub_seg_time_end = timebounds[0] #end of this sub_seg is start of this gap
-                last_samp_idx, all_start,all_end = get_chunk(all_data, last_samp_idx, sub_seg_time_start, sub_seg_time_end)
-                last_fix_idx, fix_start, fix_end = get_chunk(fixation_data, last_fix_idx, sub_seg_time_start, sub_seg_time_end)
-                if saccade_data != None:
-                    last_sac_idx, sac_start, sac_end = get_chunk(saccade_data, last_sac_idx, sub_seg_time_start, sub_seg_time_end)
-                    saccade_data_in_part = saccade_data[sac_start:sac_end]
-                else:
-                    saccade_data_in_part = None
-                if event_data != None:
-                    last_event_idx, event_start, event_end = get_chunk(event_data, last_event_idx, sub_seg_time_start, sub_seg_time_end)
-                    event_data_in_part = event_data[event_start:event_end]
-                else:
-                    event_data_in_part = None
-
-                sub_seg_time_start = timebounds[1] #beginning of the next sub_seg is end of this gap
-                if fix_end - fix_start>0:
-                    try:
-                        new_sub_seg = Segment(segid+"_"+str(sub_segid), all_data[all_start:all_end], fixation_data[fix_start:fix_end], saccade_data=saccade_data_in_part,
-                                      event_data=event_data_in_part, aois=aoilist, prune_length=prune_length, rest_pupil_size = rest_pupil_size, export_pupilinfo = export_pupilinfo)
-                    except  Exception as e:
-                        warn(str(e))
-                        if params.DEBUG:
-                            raise
-                        else:
-                            continue
-                else:
-                    continue
-                subsegments.append(new_sub_seg)
-                samp_inds.append((all_start,all_end))
-                fix_inds.append((fix_start, fix_end))
-                if saccade_data != None:
-                    saccade_inds.append((sac_start, sac_end))
-                if event_data != None:
-                    event_inds.append((event_start, event_end))
-                sub_segid +=1
-
-            # handling the last sub_seg
-            sub_seg_time_end = seg_end #end of last sub_seg is the end of seg
-            last_samp_idx, all_start,all_end = get_chunk(all_data, last_samp_idx, sub_seg_time_start, sub_seg_time_end)
-            last_fix_idx, fix_start, fix_end = get_chunk(fixation_data, last_fix_idx, sub_seg_time_start, sub_seg_time_end)
-            if saccade_data != None:
-                last_sac_idx, sac_start, sac_end = get_chunk(saccade_data, last_sac_idx, sub_seg_time_start, sub_seg_time_end)
-                saccade_data_in_part = saccade_data[sac_start:sac_end]
-            else:
-                saccade_data_in_part = None
-            if event_data != None:
-                last_event_idx, event_start, event_end = get_chunk(event_data, last_event_idx, sub_seg_time_start, sub_seg_time_end)
-                event_data_in_part = event_data[event_start:event_end]
-            else:
-                event_data_in_part = None
-            if fix_end - fix_start>0: #add the last sub_seg
-                try:
-                    new_sub_seg = Segment(segid+"_"+str(sub_segid), all_data[all_start:all_end], fixation_data[fix_start:fix_end], saccade_data_in_part,
-                                      event_data=event_data_in_part, aois=aoilist, prune_length=prune_length, rest_pupil_size = rest_pupil_size, export_pupilinfo = export_pupilinfo)
-                except Exception as e:
-                    warn(str(e))
-                    if params.DEBUG:
-                        raise
-                    else:
-                        new_sub_seg = None
-
-                if new_sub_seg != None:
-                    subsegments.append(new_sub_seg)
-                    samp_inds.append((all_start,all_end))
-                    fix_inds.append((fix_start, fix_end))
-                    if saccade_data != None:
-                        saccade_inds.append((sac_start, sac_end))
-                    if event_data != None:
-                        event_inds.append((event_start, event_end))
-            #end of handling the last sub_seg
-
-            return subsegments, samp_inds, fix_inds, saccade_inds, event_inds
-        ######################################## end partition_segment()
-
-
-
-        if len(all_data)<=0:
+        if (all_data is None and Segments == None) or (all_data is not None and len(all_data)<=0):
             raise Exception('A scene with no sample data!')
         if Segments == None:
             self.segments = []
 #            print "seglist",seglist
-            for (segid, start, end) in seglist:
-                if params.VERBOSE != "QUIET":
-                    print("segid, start, end:", segid, start, end)
-                # Selecting subsets of points belonging only to the current segment
-                if prune_length != None:
-                    end = min(end, start+prune_length)
-                _, all_start, all_end = get_chunk(all_data, 0, start, end)
-                _, fix_start, fix_end = get_chunk(fixation_data, 0, start, end)
-                if saccade_data != None:
-                    _, sac_start, sac_end = get_chunk(saccade_data, 0, start, end)
-                    saccade_data_in_seg = saccade_data[sac_start:sac_end]
-                else:
-                    sac_start = None
-                    sac_end = None
-                    saccade_data_in_seg = None
-                if event_data != None:
-                    _, event_start, event_end = get_chunk(event_data, 0, start, end)
-                    event_data_in_seg = event_data[event_start:event_end]
-                else:
-                    event_start = None
-                    event_end = None
-                    event_data_in_seg = None
-
-                if fix_end - fix_start>0:
-                    try:
-                        new_seg = Segment(segid, all_data[all_start:all_end], fixation_data[fix_start:fix_end], saccade_data = saccade_data_in_seg,
-							        event_data=event_data_in_seg, aois=aoilist, prune_length=prune_length, rest_pupil_size = rest_pupil_size, export_pupilinfo = export_pupilinfo)
-                    except  Exception as e:
-                        warn(str(e))
-                        if params.DEBUG:
-                            raise
-                        else:
-                            continue
-                else:
-                    continue
-
-                if (new_seg.largest_data_gap > params.MAX_SEG_TIMEGAP) and auto_partition: #low quality segment that needs to be partitioned!
-                    try:
-                        new_segs, samp_inds, fix_inds, sac_inds, event_inds = partition_segment(new_seg, start, end, rest_pupil_size, export_pupilinfo=export_pupilinfo)
-                        if saccade_data != None and event_data != None:
-                            for nseg,samp,fix,sac,eve in zip(new_segs, samp_inds, fix_inds, sac_inds, event_inds):
-                                if nseg.length > params.MINSEGSIZE:
-                                    nseg.set_indices(samp[0],samp[1],fix[0],fix[1],sac[0],sac[1],eve[0],eve[1])
-                                    self.segments.append(nseg)
-                        elif saccade_data != None and event_data == None:
-                            for nseg,samp,fix,sac in zip(new_segs, samp_inds, fix_inds, sac_inds):
-                                if nseg.length > params.MINSEGSIZE:
-                                    nseg.set_indices(samp[0],samp[1],fix[0],fix[1],sac[0],sac[1])
-                                    self.segments.append(nseg)
-                        elif saccade_data == None and event_data != None:
-                            for nseg,samp,fix,eve in zip(new_segs, samp_inds, fix_inds, event_inds):
-                                if nseg.length > params.MINSEGSIZE:
-                                    nseg.set_indices(samp[0],samp[1],fix[0],fix[1],event_st=eve[0],event_end=eve[1])
-                                    self.segments.append(nseg)
-                        else:
-                            for nseg,samp,fix in zip(new_segs, samp_inds, fix_inds):
-                                if nseg.length > params.MINSEGSIZE:
-                                    nseg.set_indices(samp[0],samp[1],fix[0],fix[1])
-                                    self.segments.append(nseg)
-                    except Exception as e:
-                        raise Exception("Error while partitioning scene. "+str(e))
-
-                else:   #good quality segment OR no auto_partition
-                    new_seg.set_indices(all_start,all_end,fix_start,fix_end,sac_start,sac_end,event_start,event_end)
-                    self.segments.append(new_seg)
+            for i, (segid, start, end) in enumerate(seglist):
+                self.segments.extend(build_segments(segid, start, end, all_data, fixation_data, saccade_data, event_data,
+                                                    aoilist, prune_length, auto_partition, rest_pupil_size, export_pupilinfo,
+                                                    segment_chunks[i] if segment_chunks is not None else None))
         else:
             self.segments = Segments #segments are already generated
 
@@ -320,8 +140,7 @@ class Scene(Segment):
             sample_st,sample_end,fix_start,fix_end,sac_st,sac_end,event_st,event_end = seg.get_indices()
             if params.DEBUG or params.VERBOSE == "VERBOSE":
                 print("sample_st,sample_end,fix_start,fix_end",sample_st,sample_end,fix_start,fix_end,sac_st,sac_end,event_st,event_end)
-            fixationlist.append(fixation_data[fix_start:fix_end])
-            totalfixations += len(fixationlist[-1])
+            totalfixations += fix_end - fix_start
             if seg.start < firstsegtime:
                 firstsegtime = seg.start
                 firstseg = seg
@@ -334,15 +153,20 @@ class Scene(Segment):
         self.endseg = endseg
         self.scid = scid
         self.features = {}
-        self.largest_data_gap = maxfeat(self.segments,'largest_data_gap')   #self.segments is used to calculate validity of the scenes instead of segments which is only valid segments
-        self.proportion_valid = weightedmeanfeat(self.segments,'numsamples','proportion_valid') #self.segments is used to calculate validity of the scenes instead of segments which is only valid segments
-        self.proportion_valid_fix = weightedmeanfeat(self.segments,'numsamples','proportion_valid_fix') #self.segments is used to calculate validity of the scenes instead of segments which is only valid segments
+        #self.segments is used to calculate validity of the scenes instead of segments which is only valid segments
+        datagaps = Moments.merge([seg.moments['datagap'] for seg in self.segments])
+        self.largest_data_gap = datagaps.max if datagaps.count > 0 else 0
+        self.proportion_valid = Moments.merge([seg.moments['validity'] for seg in self.segments]).mean
+        self.proportion_valid_fix = Moments.merge([seg.moments['restored'] for seg in self.segments]).mean
         self.validity1 = self.calc_validity1()
         self.validity2 = self.calc_validity2()
         self.validity3 = self.calc_validity3()
         self.is_valid = self.get_validity()
 
-        self.length = sumfeat(segments,"features['length']")
+        # the statistics of the quantities measured in the segments, from which most features are derived
+        self.moments = dict((name, Moments.merge([seg.moments[name] for seg in segments])) for name in segments[0].moments)
+
+        self.length = self.moments['length'].sum
         if self.length == 0:
             raise Exception('Zero length segments!')
 
@@ -350,10 +174,10 @@ class Scene(Segment):
 
         self.features['numsegments'] = len(segments)
         self.features['length'] = self.length
-        self.start = minfeat(segments,'start')
-        self.numfixations = sumfeat(segments,'numfixations')
-        self.end = maxfeat(segments,'end')
-        self.numsamples = sumfeat(segments, 'numsamples')
+        self.start = min(seg.start for seg in segments)
+        self.numfixations = self.moments['fixationduration'].count
+        self.end = max(seg.end for seg in segments)
+        self.numsamples = self.moments['validity'].count
         self.features['numsamples'] = self.numsamples
 
         if prune_length == None:
@@ -410,6 +234,8 @@ class Scene(Segment):
                             self.aoi_data[aid] = merge_aoistats(self.aoi_data[aid],seg.aoi_data[aid], self.features['length'], self.numfixations, self.start)
                     else:
                         self.aoi_data[aid] = deepcopy(seg.aoi_data[aid])
+                        if seg.aoi_data[aid].features['numfixations'] > 0:  # as in merge_aoi_fixations
+                            self.aoi_data[aid].features['stddevfixationduration'] = aggregatestddev(self.aoi_data[aid].moments['fixationduration'])
                         if seg.aoi_data[aid].isActive:
                             self.aoi_data[aid].features['timetofirstfixation'] += self.aoi_data[aid].starttime - self.start
                             self.aoi_data[aid].features['timetolastfixation'] += self.aoi_data[aid].starttime - self.start
@@ -427,16 +253,6 @@ class Scene(Segment):
                                 self.aoi_data[aid].features['timetolastrightclic'] += self.aoi_data[aid].starttime - self.start
                             if self.firstseg.aoi_data[aid].features['timetolastdoubleclic'] != -1:
                                 self.aoi_data[aid].features['timetolastdoubleclic'] += self.aoi_data[aid].starttime - self.start
-        #Merge stdev
-        #For each seg, compute: T = [(numfix-1) * Variance + numfix * power( meanfixduration_in_seg - meanfixduration_in_scene, 2)]
-        #At the Scene level: [ SQRT( SUM(T_seg1...Tsegn) / (numfix-1) ]
-        for aid in self.aoi_data.keys():
-            temp = 0
-            numdata = 0
-            for seg in segments:
-                    temp += (seg.aoi_data[aid].features['numfixations']-1) * seg.aoi_data[aid].variance + seg.aoi_data[aid].features['numfixations'] * math.pow(seg.aoi_data[aid].features['meanfixationduration'] - self.aoi_data[aid].features['meanfixationduration'], 2)
-                    numdata += seg.aoi_data[aid].features['numfixations']
-            self.aoi_data[aid].features['stddevfixationduration'] = math.sqrt(temp / (numdata-1) ) if numdata > 1 else 0
         """
         firstsegaois = self.firstseg.aoi_data.keys()
         for aid in self.aoi_data.keys():
@@ -465,14 +281,14 @@ class Scene(Segment):
             Args:
                 segments: The list of Segments for this Scene with pre-calculated features
         """
-        self.numfixations = sumfeat(segments, 'numfixations')
         self.features['numfixations'] = self.numfixations
         self.features['fixationrate'] = float(self.numfixations) / (self.length - self.length_invalid)
 
+        durations = self.moments['fixationduration']
         if self.numfixations > 0:
-            self.features['meanfixationduration'] = weightedmeanfeat(segments,'numfixations',"features['meanfixationduration']")
-            self.features['stddevfixationduration'] = aggregatestddevfeat(segments, 'numfixations', "features['stddevfixationduration']", "features['meanfixationduration']", self.features['meanfixationduration'])
-            self.features['sumfixationduration'] = sumfeat(segments, "features['sumfixationduration']")
+            self.features['meanfixationduration'] = durations.mean
+            self.features['stddevfixationduration'] = aggregatestddev(durations)
+            self.features['sumfixationduration'] = durations.sum
             self.features['fixationrate'] = float(self.numfixations)/(self.length - self.length_invalid)
         else:
             self.features['meanfixationduration'] = -1
@@ -495,23 +311,26 @@ class Scene(Segment):
             Args:
                 segments: The list of Segments for this Scene with pre-calculated features
         """
-        self.numfixdistances = sumfeat(segments, "numfixdistances")
-        self.numabsangles = sumfeat(segments, "numabsangles")
-        self.numrelangles = sumfeat(segments, "numrelangles")
+        distances = self.moments['pathdistance']
+        abs_angles = self.moments['abspathangles']
+        rel_angles = self.moments['relpathangles']
+        self.numfixdistances = distances.count
+        self.numabsangles = abs_angles.count
+        self.numrelangles = rel_angles.count
 
         if self.numfixations > 1:
-            self.features['meanpathdistance'] = weightedmeanfeat(segments,'numfixdistances',"features['meanpathdistance']")
-            self.features['sumpathdistance'] = sumfeat(segments, "features['sumpathdistance']")
-            self.features['stddevpathdistance'] = aggregatestddevfeat(segments, 'numfixdistances', "features['stddevpathdistance']", "features['meanpathdistance']", self.features['meanpathdistance'])
+            self.features['meanpathdistance'] = distances.mean
+            self.features['sumpathdistance'] = distances.sum
+            self.features['stddevpathdistance'] = aggregatestddev(distances)
             self.features['eyemovementvelocity'] = self.features['sumpathdistance']/(self.length - self.length_invalid)
-            self.features['sumabspathangles'] = sumfeat(segments, "features['sumabspathangles']")
-            self.features['meanabspathangles'] = weightedmeanfeat(segments,'numabsangles',"features['meanabspathangles']")
+            self.features['sumabspathangles'] = abs_angles.sum
+            self.features['meanabspathangles'] = abs_angles.mean
             self.features['abspathanglesrate'] = self.features['sumabspathangles']/(self.length - self.length_invalid)
-            self.features['stddevabspathangles'] = aggregatestddevfeat(segments, 'numabsangles', "features['stddevabspathangles']", "features['meanabspathangles']", self.features['meanabspathangles'])
-            self.features['sumrelpathangles'] = sumfeat(segments, "features['sumrelpathangles']")
-            self.features['meanrelpathangles'] = weightedmeanfeat(segments,'numrelangles',"features['meanrelpathangles']")
+            self.features['stddevabspathangles'] = aggregatestddev(abs_angles)
+            self.features['sumrelpathangles'] = rel_angles.sum
+            self.features['meanrelpathangles'] = rel_angles.mean
             self.features['relpathanglesrate'] = self.features['sumrelpathangles']/(self.length - self.length_invalid)
-            self.features['stddevrelpathangles'] = aggregatestddevfeat(segments, 'numrelangles', "features['stddevrelpathangles']", "features['meanrelpathangles']", self.features['meanrelpathangles'])
+            self.features['stddevrelpathangles'] = aggregatestddev(rel_angles)
         else:
             self.features['meanpathdistance'] = -1
             self.features['sumpathdistance'] = -1
@@ -543,22 +362,20 @@ class Scene(Segment):
             Args:
                 segments: The list of Segments for this Scene with pre-calculated features
         """
-        self.features['blinknum'] = sumfeat(segments, "features['blinknum']")
+        durations = self.moments['blinkduration']
+        intervals = self.moments['blinktimedistance']
+        self.features['blinknum'] = durations.count
         if self.features['blinknum'] > 0:
-            self.features['blinkdurationtotal']     = sumfeat(segments, "features['blinkdurationtotal']")
-            self.features['blinkdurationmean']      = weightedmeanfeat(segments, "features['blinknum']", "features['blinkdurationmean']")
-            self.features['blinkdurationstd']       = aggregatestddevfeat(segments, "features['blinknum']", "features['blinkdurationstd']",
-                                                      "features['blinkdurationmean']", self.features['blinkdurationmean'])
-            self.features['blinkdurationmin']       = minfeat(segments, "features['blinkdurationmin']", -1)
-            self.features['blinkdurationmax']       = maxfeat(segments, "features['blinkdurationmax']")
+            self.features['blinkdurationtotal']     = durations.sum
+            self.features['blinkdurationmean']      = durations.mean
+            self.features['blinkdurationstd']       = aggregatestddev(durations)
+            self.features['blinkdurationmin']       = durations.min
+            self.features['blinkdurationmax']       = durations.max
             self.features['blinkrate']              = float(self.features['blinknum']) / (self.length - self.length_invalid)
-            self.features['blinktimedistancemean']  = weightedmeanfeat(segments,
-                                                      "features['blinknum']", "features['blinktimedistancemean']")
-            self.features['blinktimedistancestd']   = aggregatestddevfeat(segments, "features['blinknum']",
-                                                      "features['blinktimedistancestd']", "features['blinktimedistancemean']",
-                                                      self.features['blinktimedistancemean'])
-            self.features['blinktimedistancemin']   = minfeat(segments, "features['blinktimedistancemin']", -1)
-            self.features['blinktimedistancemax']   = maxfeat(segments, "features['blinktimedistancemax']")
+            self.features['blinktimedistancemean']  = intervals.mean if intervals.count > 0 else -1
+            self.features['blinktimedistancestd']   = aggregatestddev(intervals) if intervals.count > 0 else -1
+            self.features['blinktimedistancemin']   = intervals.min if intervals.count > 0 else -1
+            self.features['blinktimedistancemax']   = intervals.max if intervals.count > 0 else -1
         else:
             self.features['blinkdurationtotal']     = -1
             self.features['blinkdurationmean']      = -1
@@ -586,16 +403,18 @@ class Scene(Segment):
                 segments: The list of Segments for this Scene with pre-calculated features
                 export_pupilinfo: True to export raw pupil data in EMDAT output (False by default).
         """
-        self.numpupilsizes    = sumfeat(segments,'numpupilsizes')
-        self.numpupilvelocity = sumfeat(segments,'numpupilvelocity')
+        pupilsizes = self.moments['pupilsize']
+        pupilvelocities = self.moments['pupilvelocity']
+        self.numpupilsizes    = pupilsizes.count
+        self.numpupilvelocity = pupilvelocities.count
 
         if self.numpupilsizes > 0: # check if scene has any pupil data
             if export_pupilinfo:
                 self.pupilinfo_for_export = mergevalues(segments, 'pupilinfo_for_export')
-            self.features['meanpupilsize'] = weightedmeanfeat(segments, 'numpupilsizes', "features['meanpupilsize']")
-            self.features['stddevpupilsize'] = aggregatestddevfeat(segments, 'numpupilsizes', "features['stddevpupilsize']", "features['meanpupilsize']", self.features['meanpupilsize']) #stddev(self.adjvalidpupilsizes)
-            self.features['maxpupilsize'] = maxfeat(segments, "features['maxpupilsize']")
-            self.features['minpupilsize'] = minfeat(segments, "features['minpupilsize']", -1)
+            self.features['meanpupilsize'] = pupilsizes.mean
+            self.features['stddevpupilsize'] = aggregatestddev(pupilsizes)
+            self.features['maxpupilsize'] = pupilsizes.max
+            self.features['minpupilsize'] = pupilsizes.min
             self.features['startpupilsize'] = self.firstseg.features['startpupilsize']
             self.features['endpupilsize'] = self.endseg.features['endpupilsize']
         else:
@@ -608,10 +427,10 @@ class Scene(Segment):
             self.features['endpupilsize'] = -1
 
         if self.numpupilvelocity > 0: # check if scene has any pupil velocity data
-            self.features['meanpupilvelocity'] = weightedmeanfeat(segments, 'numpupilvelocity', "features['meanpupilvelocity']")
-            self.features['stddevpupilvelocity'] = aggregatestddevfeat(segments, 'numpupilvelocity', "features['stddevpupilvelocity']", "features['meanpupilvelocity']", self.features['meanpupilvelocity']) #stddev(self.valid_pupil_velocity)
-            self.features['maxpupilvelocity'] = maxfeat(segments, "features['maxpupilvelocity']")
-            self.features['minpupilvelocity'] = minfeat(segments, "features['minpupilvelocity']", -1)
+            self.features['meanpupilvelocity'] = pupilvelocities.mean
+            self.features['stddevpupilvelocity'] = aggregatestddev(pupilvelocities)
+            self.features['maxpupilvelocity'] = pupilvelocities.max
+            self.features['minpupilvelocity'] = pupilvelocities.min
         else:
             self.features['meanpupilvelocity'] = -1
             self.features['stddevpupilvelocity'] = -1
@@ -631,12 +450,13 @@ class Scene(Segment):
             Args:
                 segments: The list of Segments for this Scene with pre-calculated features
         """
-        self.numdistancedata = sumfeat(segments,'numdistancedata') #Distance
+        distances = self.moments['distance']
+        self.numdistancedata = distances.count #Distance
         if self.numdistancedata > 0: # check if scene has any pupil data
-            self.features['meandistance'] = weightedmeanfeat(segments, 'numdistancedata', "features['meandistance']")
-            self.features['stddevdistance'] = aggregatestddevfeat(segments, 'numdistancedata', "features['stddevdistance']", "features['meandistance']", self.features['meandistance'])
-            self.features['maxdistance'] = maxfeat(segments, "features['maxdistance']")
-            self.features['mindistance'] = minfeat(segments, "features['mindistance']", -1)
+            self.features['meandistance'] = distances.mean
+            self.features['stddevdistance'] = aggregatestddev(distances)
+            self.features['maxdistance'] = distances.max
+            self.features['mindistance'] = distances.min
             self.features['startdistance'] = self.firstseg.features['startdistance']
             self.features['enddistance'] = self.endseg.features['enddistance']
         else:
@@ -668,20 +488,24 @@ class Scene(Segment):
                 saccade_data: The list of saccade datapoints for this Scene
                 segments: The list of Segments for this Scene with pre-calculated features
         """
-        if saccade_data != None:
-            self.features['numsaccades'] = sumfeat(segments,'numsaccades')
-            self.features['sumsaccadedistance'] = sumfeat(segments, "features['sumsaccadedistance']")
-            self.features['meansaccadedistance'] = weightedmeanfeat(self.segments,'numsaccades',"features['meansaccadedistance']")
-            self.features['stddevsaccadedistance'] = aggregatestddevfeat(segments, 'numsaccades', "features['stddevsaccadedistance']", "features['meansaccadedistance']", self.features['meansaccadedistance'])
-            self.features['longestsaccadedistance'] = maxfeat(segments, "features['longestsaccadedistance']")
-            self.features['sumsaccadeduration'] = sumfeat(segments,"features['sumsaccadeduration']")
-            self.features['meansaccadeduration'] = weightedmeanfeat(self.segments,'numsaccades',"features['meansaccadeduration']")
-            self.features['stddevsaccadeduration'] = aggregatestddevfeat(segments, 'numsaccades', "features['stddevsaccadeduration']", "features['meansaccadeduration']", self.features['meansaccadeduration'])
-            self.features['longestsaccadeduration'] = maxfeat(segments, "features['longestsaccadeduration']")
-            self.features['meansaccadespeed'] = weightedmeanfeat(self.segments,'numsaccades',"features['meansaccadespeed']")
-            self.features['stddevsaccadespeed'] = aggregatestddevfeat(segments, 'numsaccades', "features['stddevsaccadespeed']", "features['meansaccadespeed']", self.features['meansaccadespeed'])
-            self.features['maxsaccadespeed'] = maxfeat(segments, "features['maxsaccadespeed']")
-            self.features['minsaccadespeed'] = minfeat(segments, "features['minsaccadespeed']", -1)
+        self.numsaccades = self.moments['saccadedistance'].count
+        if saccade_data != None and self.numsaccades > 0:
+            distance = self.moments['saccadedistance']
+            duration = self.moments['saccadeduration']
+            speed = self.moments['saccadespeed']
+            self.features['numsaccades'] = self.numsaccades
+            self.features['sumsaccadedistance'] = distance.sum
+            self.features['meansaccadedistance'] = distance.mean
+            self.features['stddevsaccadedistance'] = aggregatestddev(distance)
+            self.features['longestsaccadedistance'] = distance.max
+            self.features['sumsaccadeduration'] = duration.sum
+            self.features['meansaccadeduration'] = duration.mean
+            self.features['stddevsaccadeduration'] = aggregatestddev(duration)
+            self.features['longestsaccadeduration'] = duration.max
+            self.features['meansaccadespeed'] = speed.mean
+            self.features['stddevsaccadespeed'] = aggregatestddev(speed)
+            self.features['maxsaccadespeed'] = speed.max
+            self.features['minsaccadespeed'] = speed.min
             self.features['fixationsaccadetimeratio'] = sumfeat(segments, "features['fixationsaccadetimeratio']") / float(len(segments))
         else:
             self.features['numsaccades'] = 0
@@ -774,6 +598,271 @@ class Scene(Segment):
         #self.adjvalidpupilsizes = []
         #self.distances_from_screen = []
 
+def build_segments(segid, start, end, all_data, fixation_data, saccade_data, event_data, aoilist, prune_length,
+                   auto_partition, rest_pupil_size, export_pupilinfo, chunks=None):
+    """Generates the "Segment"s for one segment definition of a Scene
+
+    Args:
+        segid: the id of the Segment
+
+        start: An integer showing the start time of the segment in milliseconds
+
+        end: An integer showing the end time of the segment in milliseconds
+
+        all_data, fixation_data, saccade_data, event_data, aoilist, prune_length, auto_partition, rest_pupil_size,
+            export_pupilinfo: see Scene.__init__
+
+        chunks: If not None, the positions of the data of the segment in the four streams (see find_segment_chunks)
+
+    Returns:
+        a list of "Segment"s with their indices in all_data, fixation_data, saccade_data and event_data set. The list has more
+        than one Segment if the segment was partitioned (see auto_partition), and is empty if no Segment could be generated
+    """
+    if params.VERBOSE != "QUIET":
+        print("segid, start, end:", segid, start, end)
+    # Selecting subsets of points belonging only to the current segment
+    if prune_length != None:
+        end = min(end, start+prune_length)
+    if chunks is None:
+        chunks = find_segment_chunks([(start, end)], all_data, fixation_data, saccade_data, event_data)[0]
+    (all_start, all_end), (fix_start, fix_end), (sac_start, sac_end), (event_start, event_end) = chunks
+    if saccade_data != None:
+        saccade_data_in_seg = RecordingView(saccade_data, sac_start, sac_end)
+    else:
+        saccade_data_in_seg = None
+    if event_data != None:
+        event_data_in_seg = RecordingView(event_data, event_start, event_end)
+    else:
+        event_data_in_seg = None
+
+    if fix_end - fix_start>0:
+        try:
+            new_seg = Segment(segid, all_data[all_start:all_end], RecordingView(fixation_data, fix_start, fix_end), saccade_data = saccade_data_in_seg,
+                          event_data=event_data_in_seg, aois=aoilist, prune_length=prune_length, rest_pupil_size = rest_pupil_size, export_pupilinfo = export_pupilinfo)
+        except  Exception as e:
+            warn(str(e))
+            if params.DEBUG:
+                raise
+            else:
+                return []
+    else:
+        return []
+
+    segments = []
+    if (new_seg.largest_data_gap > params.MAX_SEG_TIMEGAP) and auto_partition: #low quality segment that needs to be partitioned!
+        try:
+            new_segs, samp_inds, fix_inds, sac_inds, event_inds = partition_segment(new_seg, segid, start, end, all_data, fixation_data, saccade_data, event_data, aoilist,
+                                                                                    prune_length, rest_pupil_size, export_pupilinfo=export_pupilinfo)
+            if saccade_data != None and event_data != None:
+                for nseg,samp,fix,sac,eve in zip(new_segs, samp_inds, fix_inds, sac_inds, event_inds):
+                    if nseg.length > params.MINSEGSIZE:
+                        nseg.set_indices(samp[0],samp[1],fix[0],fix[1],sac[0],sac[1],eve[0],eve[1])
+                        segments.append(nseg)
+            elif saccade_data != None and event_data == None:
+                for nseg,samp,fix,sac in zip(new_segs, samp_inds, fix_inds, sac_inds):
+                    if nseg.length > params.MINSEGSIZE:
+                        nseg.set_indices(samp[0],samp[1],fix[0],fix[1],sac[0],sac[1])
+                        segments.append(nseg)
+            elif saccade_data == None and event_data != None:
+                for nseg,samp,fix,eve in zip(new_segs, samp_inds, fix_inds, event_inds):
+                    if nseg.length > params.MINSEGSIZE:
+                        nseg.set_indices(samp[0],samp[1],fix[0],fix[1],event_st=eve[0],event_end=eve[1])
+                        segments.append(nseg)
+            else:
+                for nseg,samp,fix in zip(new_segs, samp_inds, fix_inds):
+                    if nseg.length > params.MINSEGSIZE:
+                        nseg.set_indices(samp[0],samp[1],fix[0],fix[1])
+                        segments.append(nseg)
+        except Exception as e:
+            raise Exception("Error while partitioning scene. "+str(e))
+
+    else:   #good quality segment OR no auto_partition
+        new_seg.set_indices(all_start,all_end,fix_start,fix_end,sac_start,sac_end,event_start,event_end)
+        segments.append(new_seg)
+    return segments
+
+
+def find_segment_chunks(intervals, all_data, fixation_data, saccade_data, event_data):
+    """Returns the positions of the data of each of the given segments in the four data streams, found for all the
+    segments at once (see get_chunks)
+
+    Args:
+        intervals: a list of (start, end) tuples with the times of the segments in milliseconds (with prune_length applied)
+
+        all_data, fixation_data, saccade_data, event_data: the data of the Scene (see Scene.__init__)
+
+    Returns:
+        a list with, for each segment, a tuple of the (start, end) positions of its data in all_data, fixation_data,
+        saccade_data and event_data ((None, None) for saccade_data or event_data if None)
+    """
+    starts = [start for start, _ in intervals]
+    ends = [end for _, end in intervals]
+    streams = []
+    for data in (all_data, fixation_data, saccade_data, event_data):
+        streams.append(get_chunks(data, starts, ends) if data is not None else [(None, None)] * len(intervals))
+    return zip(*streams)
+
+
+def find_scene_chunks(scenelist, prune_length, all_data, fixation_data, saccade_data, event_data):
+    """Returns the positions of the data of all the segments of all the scenes in the four data streams, found
+    for all the segments at once (see find_segment_chunks)
+
+    Args:
+        scenelist: a dict with scid as the key and a list of (segid, start, end) tuples as value (see read_segs)
+
+        prune_length, all_data, fixation_data, saccade_data, event_data: see Scene.__init__
+
+    Returns:
+        a dict with scid as the key and the segment_chunks of the Scene as value (see Scene.__init__)
+    """
+    scids = []
+    intervals = []
+    for scid, seglist in scenelist.items():
+        for segid, start, end in seglist:
+            if prune_length != None:
+                end = min(end, start+prune_length)
+            scids.append(scid)
+            intervals.append((start, end))
+    segment_chunks = dict((scid, []) for scid in scenelist)
+    for scid, chunks in zip(scids, find_segment_chunks(intervals, all_data, fixation_data, saccade_data, event_data)):
+        segment_chunks[scid].append(chunks)
+    return segment_chunks
+
+
+def partition_segment(new_seg, segid, seg_start, seg_end, all_data, fixation_data, saccade_data, event_data, aoilist,
+                      prune_length, rest_pupil_size, export_pupilinfo):
+    """ A helper method for splitting a Segment object into new Segments and removing gaps of invalid samples
+
+    One way to deal with a low quality Segment is to find the gaps of invalid samples within its "Datapoint"s and
+    splitting the Segment into two Segments one from the beginnning of the Segment to the gap and another from after
+    the gap to the end of the Segment. This can be done multiple times resulting multiple "Segment"s with higher
+    quality. For example if a Segment S1 started at s1 and ended at e1 and had two invalid gaps between gs1-ge1 and
+    gs2-ge2 milliseconds, this method will generate the following three segments
+        SS1: starting at s1 and ending at gs1
+        SS2: starting at ge1 and ending at gs2
+        SS3: starting at ge2 and ending at e1
+
+    Args:
+        new_seg: The Segment that is being split
+
+        segid: the id of the Segment that is being split
+
+        seg_start: An integer showing the start time of the segment in milliseconds
+
+        seg_end: An integer showing the end time of the segment in milliseconds
+
+        all_data, fixation_data, saccade_data, event_data: the data of the Scene (see Scene.__init__)
+
+        aoilist: If not None, a list of "AOI"s.
+
+        prune_length: see Scene.__init__
+
+        rest_pupil_size: rest pupil size for the current scene
+
+        export_pupilinfo: True to export raw pupil data in EMDAT output
+
+    Returns:
+        subsegments: a list of newly generated "Segment"s
+
+        samp_inds: a list of tuples of the form (start, end) that detrmines the index of the start and end of each
+            new Segment in the old Segment's all_data field
+
+        fix_inds: a list of tuples of the form (start, end) that detrmines the index of the start and end of each
+            new Segment in the old Segment's fixation_data field
+
+        sac_inds: a list of tuples of the form (start, end) that detrmines the index of the start and end of each
+            new Segment in the old Segment's saccade_data field
+
+        event_inds: a list of tuples of the form (start, end) that detrmines the index of the start and end of each
+            new Segment in the old Segment's event_data field
+    """
+    timegaps = new_seg.getgaps()
+    subsegments = []
+    sub_segid = 0
+    samp_inds = []
+    fix_inds = []
+    saccade_inds = []
+    event_inds = []
+    last_samp_idx = 0
+    last_fix_idx = 0
+    last_sac_idx = 0
+    last_event_idx = 0
+    sub_seg_time_start = seg_start
+    for timebounds in timegaps:
+        sub_seg_time_end = timebounds[0] #end of this sub_seg is start of this gap
+        last_samp_idx, all_start,all_end = get_chunk(all_data, last_samp_idx, sub_seg_time_start, sub_seg_time_end)
+        last_fix_idx, fix_start, fix_end = get_chunk(fixation_data, last_fix_idx, sub_seg_time_start, sub_seg_time_end)
+        if saccade_data != None:
+            last_sac_idx, sac_start, sac_end = get_chunk(saccade_data, last_sac_idx, sub_seg_time_start, sub_seg_time_end)
+            saccade_data_in_part = RecordingView(saccade_data, sac_start, sac_end)
+        else:
+            saccade_data_in_part = None
+        if event_data != None:
+            last_event_idx, event_start, event_end = get_chunk(event_data, last_event_idx, sub_seg_time_start, sub_seg_time_end)
+            event_data_in_part = RecordingView(event_data, event_start, event_end)
+        else:
+            event_data_in_part = None
+
+        sub_seg_time_start = timebounds[1] #beginning of the next sub_seg is end of this gap
+        if fix_end - fix_start>0:
+            try:
+                new_sub_seg = Segment(segid+"_"+str(sub_segid), all_data[all_start:all_end], RecordingView(fixation_data, fix_start, fix_end), saccade_data=saccade_data_in_part,
+                              event_data=event_data_in_part, aois=aoilist, prune_length=prune_length, rest_pupil_size = rest_pupil_size, export_pupilinfo = export_pupilinfo)
+            except  Exception as e:
+                warn(str(e))
+                if params.DEBUG:
+                    raise
+                else:
+                    continue
+        else:
+            continue
+        subsegments.append(new_sub_seg)
+        samp_inds.append((all_start,all_end))
+        fix_inds.append((fix_start, fix_end))
+        if saccade_data != None:
+            saccade_inds.append((sac_start, sac_end))
+        if event_data != None:
+            event_inds.append((event_start, event_end))
+        sub_segid +=1
+
+    # handling the last sub_seg
+    sub_seg_time_end = seg_end #end of last sub_seg is the end of seg
+    last_samp_idx, all_start,all_end = get_chunk(all_data, last_samp_idx, sub_seg_time_start, sub_seg_time_end)
+    last_fix_idx, fix_start, fix_end = get_chunk(fixation_data, last_fix_idx, sub_seg_time_start, sub_seg_time_end)
+    if saccade_data != None:
+        last_sac_idx, sac_start, sac_end = get_chunk(saccade_data, last_sac_idx, sub_seg_time_start, sub_seg_time_end)
+        saccade_data_in_part = RecordingView(saccade_data, sac_start, sac_end)
+    else:
+        saccade_data_in_part = None
+    if event_data != None:
+        last_event_idx, event_start, event_end = get_chunk(event_data, last_event_idx, sub_seg_time_start, sub_seg_time_end)
+        event_data_in_part = RecordingView(event_data, event_start, event_end)
+    else:
+        event_data_in_part = None
+    if fix_end - fix_start>0: #add the last sub_seg
+        try:
+            new_sub_seg = Segment(segid+"_"+str(sub_segid), all_data[all_start:all_end], RecordingView(fixation_data, fix_start, fix_end), saccade_data_in_part,
+                              event_data=event_data_in_part, aois=aoilist, prune_length=prune_length, rest_pupil_size = rest_pupil_size, export_pupilinfo = export_pupilinfo)
+        except Exception as e:
+            warn(str(e))
+            if params.DEBUG:
+                raise
+            else:
+                new_sub_seg = None
+
+        if new_sub_seg != None:
+            subsegments.append(new_sub_seg)
+            samp_inds.append((all_start,all_end))
+            fix_inds.append((fix_start, fix_end))
+            if saccade_data != None:
+                saccade_inds.append((sac_start, sac_end))
+            if event_data != None:
+                event_inds.append((event_start, event_end))
+    #end of handling the last sub_seg
+
+    return subsegments, samp_inds, fix_inds, saccade_inds, event_inds
+
+
 def merge_aoistats(main_AOI_Stat,new_AOI_Stat,total_time,total_numfixations,sc_start=0):
         """a helper method that updates the AOI_Stat object of this Scene with a new AOI_Stat object
 
@@ -793,32 +882,13 @@ def merge_aoistats(main_AOI_Stat,new_AOI_Stat,total_time,total_numfixations,sc_s
         """
         maois = main_AOI_Stat
         merge_aoi_fixations(maois, new_AOI_Stat, total_time, total_numfixations, sc_start)
-        #calculating the transitions to and from this AOI and other active AOIs at the moment
-        new_AOI_Stat_transition_aois = filter(lambda x: x.startswith('numtransfrom_'), new_AOI_Stat.features.keys())
-        if params.DEBUG or params.VERBOSE == "VERBOSE":
-            print("Segment's transition_aois", new_AOI_Stat_transition_aois)
-
         merge_aoi_events(maois, new_AOI_Stat, total_time, sc_start)
 
-        maois.total_trans_from += new_AOI_Stat.total_trans_from   #updating the total number of transition from this AOI
-        for feat in new_AOI_Stat_transition_aois:
-            if feat in maois.features:
-                maois.features[feat] += new_AOI_Stat.features[feat]
-            else:
-                maois.features[feat] = new_AOI_Stat.features[feat]
-#               sumtransfrom += maois.features[feat]
+        # the transitions from each AOI are added up, and the proportions updated
+        maois.set_transition_features(maois.transition_aids, maois.transitions_from + new_AOI_Stat.transitions_from)
 
         merge_aoi_distance(maois, new_AOI_Stat)
         merge_aoi_pupil(maois, new_AOI_Stat)
-        # updating the proportion tansition features based on new transitions to and from this AOI
-        maois_transition_aois = filter(lambda x: x.startswith('numtransfrom_'),maois.features.keys()) #all the transition features for this AOI should be aupdated even if they are not active for this segment
-        for feat in maois_transition_aois:
-            aid = feat[len('numtransfrom_'):]
-            if maois.total_trans_from > 0:
-                maois.features['proptransfrom_%s'%(aid)] = float(maois.features[feat]) / maois.total_trans_from
-            else:
-                maois.features['proptransfrom_%s'%(aid)] = 0
-        ###endof transition calculation
         return maois
 
 
@@ -840,14 +910,13 @@ def merge_aoi_fixations(maois, new_AOI_Stat, total_time, total_numfixations, sc_
             sc_start: start time (timestamp) of the scene
     """
     if new_AOI_Stat.features['numfixations'] > 0:
-        aoi_list = [maois, new_AOI_Stat]
-        numfixations = sumfeat(aoi_list, "features['numfixations']")
-        maois.features['longestfixation'] = maxfeat(aoi_list, "features['longestfixation']")
+        durations = Moments.merge([maois.moments['fixationduration'], new_AOI_Stat.moments['fixationduration']])
+        maois.moments['fixationduration'] = durations
+        maois.features['longestfixation'] = max(maois.features['longestfixation'], new_AOI_Stat.features['longestfixation'])
         maois.features['totaltimespent'] += new_AOI_Stat.features['totaltimespent']
-        aggregate_meanfixationduration = maois.features['totaltimespent'] / numfixations
-        maois.features['stddevfixationduration'] = aggregatestddevfeat(aoi_list, "features['numfixations']", "features['stddevfixationduration']", "features['meanfixationduration']", aggregate_meanfixationduration)
+        maois.features['stddevfixationduration'] = aggregatestddev(durations)
         maois.features['numfixations'] +=  new_AOI_Stat.features['numfixations']
-        maois.features['meanfixationduration'] = aggregate_meanfixationduration
+        maois.features['meanfixationduration'] = durations.mean
         maois.features['proportiontime'] = float(maois.features['totaltimespent'])/total_time
         maois.features['proportionnum'] = float(maois.features['numfixations'])/total_numfixations
 
@@ -875,15 +944,13 @@ def merge_aoi_distance(maois, new_AOI_Stat):
             maois: AOI_Stat object of this Scene (must have been initialised)
             new_AOI_Stat: a new AOI_Stat object
     """
-    aoi_list = [maois, new_AOI_Stat]
     if new_AOI_Stat.numdistancedata > 0:
-        total_distances = sumfeat(aoi_list, 'numdistancedata')
-        aggregate_mean_distance = weightedmeanfeat(aoi_list, 'numdistancedata', "features['meandistance']")
-        maois.features['stddevdistance'] = aggregatestddevfeat(aoi_list, 'numdistancedata', "features['stddevdistance']",
-                                                                    "features['meandistance']", aggregate_mean_distance)
-        maois.features['maxdistance'] = maxfeat(aoi_list, "features['maxdistance']")
-        maois.features['mindistance'] = minfeat(aoi_list, "features['mindistance']")
-        maois.features['meandistance'] = aggregate_mean_distance
+        distances = Moments.merge([maois.moments['distance'], new_AOI_Stat.moments['distance']])
+        maois.moments['distance'] = distances
+        maois.features['stddevdistance'] = aggregatestddev(distances)
+        maois.features['maxdistance'] = distances.max
+        maois.features['mindistance'] = distances.min
+        maois.features['meandistance'] = distances.mean
         if maois.starttime > new_AOI_Stat.starttime:
             maois.features['startdistance'] = new_AOI_Stat.features['startdistance']
         if maois.endtime < new_AOI_Stat.endtime:
@@ -904,14 +971,13 @@ def merge_aoi_pupil(maois, new_AOI_Stat):
             maois: AOI_Stat object of this Scene (must have been initialised)
             new_AOI_Stat: a new AOI_Stat object
     """
-    aoi_list = [maois, new_AOI_Stat]
     if (new_AOI_Stat.numpupilsizes > 0):
-        aggregate_mean_pupil = weightedmeanfeat(aoi_list, 'numpupilsizes', "features['meanpupilsize']")
-        maois.features['stddevpupilsize'] = aggregatestddevfeat(aoi_list, 'numpupilsizes', "features['stddevpupilsize']",
-                                                                        "features['meanpupilsize']", aggregate_mean_pupil)
-        maois.features['maxpupilsize'] = maxfeat(aoi_list, "features['maxpupilsize']")
-        maois.features['minpupilsize'] = minfeat(aoi_list, "features['minpupilsize']")
-        maois.features['meanpupilsize'] = aggregate_mean_pupil
+        pupilsizes = Moments.merge([maois.moments['pupilsize'], new_AOI_Stat.moments['pupilsize']])
+        maois.moments['pupilsize'] = pupilsizes
+        maois.features['stddevpupilsize'] = aggregatestddev(pupilsizes)
+        maois.features['maxpupilsize'] = pupilsizes.max
+        maois.features['minpupilsize'] = pupilsizes.min
+        maois.features['meanpupilsize'] = pupilsizes.mean
         if maois.starttime > new_AOI_Stat.starttime:
             maois.features['startpupilsize'] = new_AOI_Stat.features['startpupilsize']
         if maois.endtime < new_AOI_Stat.endtime:
@@ -919,12 +985,12 @@ def merge_aoi_pupil(maois, new_AOI_Stat):
         maois.numpupilsizes += new_AOI_Stat.numpupilsizes
 
     if (new_AOI_Stat.numpupilvelocity > 0):
-        aggregate_mean_velocity =  weightedmeanfeat(aoi_list, 'numpupilvelocity', "features['meanpupilvelocity']")
-        maois.features['stddevpupilvelocity'] = aggregatestddevfeat(aoi_list, 'numpupilvelocity', "features['stddevpupilvelocity']",
-                                                                        "features['meanpupilvelocity']", aggregate_mean_velocity)
-        maois.features['maxpupilvelocity'] = maxfeat(aoi_list, "features['maxpupilvelocity']")
-        maois.features['minpupilvelocity'] = minfeat(aoi_list, "features['minpupilvelocity']")
-        maois.features['meanpupilvelocity'] = aggregate_mean_velocity
+        pupilvelocities = Moments.merge([maois.moments['pupilvelocity'], new_AOI_Stat.moments['pupilvelocity']])
+        maois.moments['pupilvelocity'] = pupilvelocities
+        maois.features['stddevpupilvelocity'] = aggregatestddev(pupilvelocities)
+        maois.features['maxpupilvelocity'] = pupilvelocities.max
+        maois.features['minpupilvelocity'] = pupilvelocities.min
+        maois.features['meanpupilvelocity'] = pupilvelocities.mean
         maois.numpupilvelocity += new_AOI_Stat.numpupilvelocity
 
 def merge_aoi_events(maois, new_AOI_Stat, total_time, sc_start):
@@ -972,58 +1038,25 @@ def merge_aoi_events(maois, new_AOI_Stat, total_time, sc_start):
             maois.features['timetolastdoubleclic'] = max(maois.features['timetolastdoubleclic'], deepcopy(new_AOI_Stat.features['timetolastdoubleclic']) + new_AOI_Stat.starttime - sc_start)
 
 
-def weightedmeanfeat(obj_list, totalfeat,ratefeat):
-    """a helper method that calculates the weighted average of a target feature over a list of Segments
-
-    Args:
-        obj_list: a list of Segments which all have a numeric field for which the weighted average is calculated
-
-        totalfeat: a string containing the name of the feature that has the total value of the target feature
-
-        ratefeat: a string containing the name of the feature that has the rate value of the target feature
-
-    Returns:
-        the weighted average of the ratefeat over the Segments
+def _getfeat(obj, feat):
+    """Returns the value of a feature of an object, given either as the name of an attribute (e.g., 'numfixations')
+    or as an entry of its features dict (e.g., "features['numfixations']")
     """
-    num_valid = float(0)
-    num = 0
+    if feat.startswith("features['") and feat.endswith("']"):
+        return obj.features[feat[len("features['"):-len("']")]]
+    return getattr(obj, feat)
 
-    for obj in obj_list:
-        t = eval('obj.'+totalfeat)
-        num_valid += t * eval('obj.'+ratefeat)
-        num += t
-    if num != 0:
-        return num_valid / num
-    return 0
-
-def aggregatestddevfeat(obj_list, totalfeat, sdfeat, meanfeat, meanscene):
-    """a helper method that calculates the aggregated standard deviation of a target feature over a list of Segments
+def aggregatestddev(moments):
+    """a helper method that returns the standard deviation of merged Moments, or 0 if there are less than two values
 
     Args:
-        obj_list: a list of Segments which all have a numeric field for which the stdev is calculated
-
-        totalfeat: a string containing the name of the feature that has the total value of the target feature
-
-        ratefeat: a string containing the name of the feature that has the rate value of the target feature
+        moments: a Moments object
 
     Returns:
-        the weighted average of the ratefeat over the Segments
+        the standard deviation of the values summarized by the Moments
     """
-    num = float(0)
-    den = float(0)
-
-    for obj in obj_list:
-        t = eval('obj.'+totalfeat)
-        if t > 0:
-            sd = eval('obj.'+sdfeat)
-            if math.isnan(sd): sd = 0
-            meanobj = eval('obj.'+meanfeat)
-
-            num += (t-1) * sd**2 + t * (meanobj-meanscene)**2
-            den += t
-
-    if den > 1:
-        return math.sqrt(float(num)/(den-1))
+    if moments.count > 1:
+        return moments.get_stddev()
     return 0
 
 def sumfeat(obj_list, feat):
@@ -1040,49 +1073,9 @@ def sumfeat(obj_list, feat):
     """
     sum = 0
     for obj in obj_list:
-        sum += eval('obj.'+feat)
+        sum += _getfeat(obj, feat)
     return sum
 
-def minfeat(obj_list, feat, nonevalue = None):
-    """a helper method that calculates the min of a target feature over a list of objects
-
-    Args:
-
-        obj_list: a list of objects
-
-        feat: a string containing the name of the target feature
-
-        nonevalue: value to be ignored when computing the min (typically -1 in EMDAT)
-
-    Returns:
-        the min of the target feature over the given list of objects
-    """
-    min = float('+infinity')
-    for obj in obj_list:
-        val = eval('obj.'+feat)
-        if min > val and val != nonevalue:
-            min = val
-    return min
-
-def maxfeat(obj_list, feat):
-    """a helper method that calculates the max of a target feature over a list of objects
-
-    Args:
-
-        obj_list: a list of objects
-
-        feat: a string containing the name of the target feature
-
-    Returns:
-        the max of the target feature over the given list of objects
-    """
-    max = float('-infinity')
-    for obj in obj_list:
-        val = eval('obj.'+feat)
-        if max < val:
-            max = val
-    return max
-
 def mergevalues(obj_list, field):
     """a helper method that merges lists of values stored in field
 
@@ -1097,5 +1090,5 @@ def mergevalues(obj_list, field):
     """
     mergedlist = []
     for obj in obj_list:
-        mergedlist.extend(eval('obj.'+ field))
+        mergedlist.extend(_getfeat(obj, field))
     return mergedlist
@@ -11,10 +11,14 @@ Institution: The University of British Columbia.
 
 import params
 from EMDAT_core import geometry
+from EMDAT_core.data_structures import GazeSampleTable, NO_FIXATION_INDEX
 from EMDAT_core.AOI import *
 from warnings import warn
 from math import isnan
-from EMDAT_core.AOI import _fixation_inside_aoi
+import numpy as np
+
+# attributes of the "Saccade"s summarized by calc_saccade_stats
+SACCADE_STAT_ATTRIBUTES = ('saccadedistance', 'saccadeduration', 'saccadespeed')
 
 class Segment():
     """A Segment is a class that represents the smallest unit of aggregated eye data samples with a conceptual meaning.
@@ -50,15 +54,24 @@ class Segment():
         fixation_data: A list of "Fixation"s for this Segment
         fixation_start: timestamp of the first entry from list of "Fixation"s for this Segment
         fixation_end: timestamp of the last entry from list of "Fixation"s for this Segment
+        moments: a dict with the Moments of each quantity measured in this Segment, from which its features are derived
+            and merged into the features of a Scene: 'fixationduration', 'pathdistance', 'abspathangles', 'relpathangles',
+            'blinkduration', 'blinktimedistance', 'pupilsize', 'pupilvelocity', 'distance', the saccade attributes
+            of SACCADE_STAT_ATTRIBUTES, and for the validity of the Scene 'validity' and 'restored' (see SampleStats),
+            'datagap' (the lengths of the gaps of invalid samples, or the length of the Segment if it has no Fixation)
+            and 'length' (the length of the Segment)
         aoi_data: A list of AOI_Stat objects for relevant "AOI"s for this Segment
         has_aois: A boolean indicating if this Segment has AOI features calculated for it
+        transition_aids: the list of the ids of the "AOI"s of this Segment
+        transition_counts: a numpy integer array whose element [i, j] is the number of transitions from the i-th
+            to the j-th AOI of transition_aids (see FixationAOIs.get_transition_counts)
     """
     def __init__(self, segid, all_data, fixation_data, saccade_data = None, event_data = None, aois = None, prune_length = None, rest_pupil_size = 0, export_pupilinfo = False):
         """
         Args:
             segid: A string containing the id of the Segment.
 
-            all_data: a list of "Datapoint"s which make up this Segment.
+            all_data: a GazeSampleTable (or a list of "Datapoint"s) with the samples which make up this Segment.
 
             fixation_data: a list of "Fixation"s which make up this Segment.
 
@@ -86,12 +99,14 @@ class Segment():
         #self.saccade_data = saccade_data
         #self.event_data = event_data
         self.features = {}
+        if not isinstance(all_data, GazeSampleTable):
+            all_data = GazeSampleTable.from_datapoints(all_data)
 
         """ If prune_length specified, keep only data from start to start + prune_length
             of the segment
         """
         if prune_length:
-            all_data = filter(lambda x: x.timestamp <= self.start + prune_length, all_data)
+            all_data = all_data[all_data.timestamp <= self.start + prune_length]
             fixation_data = filter(lambda x: x.timestamp <= self.start + prune_length, fixation_data)
             if event_data != None:
                 event_data = filter(lambda x: x.timestamp <= self.start + prune_length, event_data)
@@ -106,12 +121,19 @@ class Segment():
         self.start = all_data[0].timestamp
         self.numfixations = len(fixation_data)
 
+        """ Statistics of the samples used by the features below, computed in one pass """
+        stats = SampleStats(all_data, rest_pupil_size)
+        self.moments = {}
+
         """ Validity-related features, determining if the segment is valid """
         self.time_gaps = []
         self.all_invalid_gaps = []
-        self.largest_data_gap = self.calc_largest_validity_gap(all_data)
-        self.proportion_valid = self.calc_validity_proportion(all_data)
-        self.proportion_valid_fix = self.calc_validity_fixation(all_data)
+        self.largest_data_gap = self.calc_largest_validity_gap(all_data, stats)
+        self.proportion_valid = self.calc_validity_proportion(all_data, stats)
+        self.proportion_valid_fix = self.calc_validity_fixation(all_data, stats)
+        self.moments['validity'] = stats.validity
+        # as in calc_validity_fixation, no sample is restored in a segment without fixations
+        self.moments['restored'] = stats.restored if self.numfixations > 0 else Moments.from_mask(np.zeros(stats.numsamples, dtype=np.bool_))
         self.validity1 = self.calc_validity1()
         self.validity2 = self.calc_validity2()
         self.validity3 = self.calc_validity3()
@@ -121,21 +143,22 @@ class Segment():
         self.end = all_data[-1].timestamp
         self.length = self.end - self.start
         self.features['length'] = self.end - self.start
+        self.moments['length'] = Moments.from_array(np.array([self.length]))
         self.features['length_invalid'] = self.length_invalid
-        self.numsamples = self.calc_num_samples(all_data)
+        self.numsamples = self.calc_num_samples(all_data, stats)
         self.features['numsamples'] = self.numsamples
         self.numfixations = len(fixation_data)
         self.features['numfixations'] = self.numfixations
         self.features['fixationrate'] = float(self.numfixations) / (self.length - self.length_invalid)
 
         """ calculate blink features (no rest pupil size adjustments yet)"""
-        self.calc_blink_features(all_data)
+        self.calc_blink_features(all_data, stats)
 
         """ calculate pupil dilation features (no rest pupil size adjustments yet)"""
-        self.calc_pupil_features(all_data, export_pupilinfo, rest_pupil_size)
+        self.calc_pupil_features(all_data, export_pupilinfo, rest_pupil_size, stats)
 
         """ calculate distance from screen features"""
-        self.calc_distance_features(all_data)
+        self.calc_distance_features(all_data, stats)
 
         """ calculate fixations, angles and path features"""
         self.calc_fix_ang_path_features(fixation_data)
@@ -149,8 +172,9 @@ class Segment():
         """ calculate AOIs features """
         self.has_aois = False
         if aois:
-            self.set_aois(aois, all_data, fixation_data, event_data, rest_pupil_size, export_pupilinfo)
-            self.features['aoisequence'] = self.generate_aoi_sequence(fixation_data, aois)
+            fixation_aois = FixationAOIs(fixation_data, aois)
+            self.set_aois(aois, all_data, fixation_data, event_data, rest_pupil_size, export_pupilinfo, fixation_aois)
+            self.features['aoisequence'] = self.generate_aoi_sequence(fixation_data, aois, fixation_aois)
 
 
     def set_indices(self,sample_st,sample_end,fix_st,fix_end,sac_st=None,sac_end=None,event_st=None,event_end=None):
@@ -197,25 +221,37 @@ class Segment():
         raise Exception ('The indices values are accessed before setting the initial value in segement:'+self.segid+'!')
 
 
-    def set_aois(self, aois, all_data, fixation_data, event_data = None, rest_pupil_size = 0, export_pupilinfo = False):
+    def set_aois(self, aois, all_data, fixation_data, event_data = None, rest_pupil_size = 0, export_pupilinfo = False, fixation_aois = None):
         """Sets the relevant "AOI"s for this Segment
 
         Args:
-            all_data: a list of "Datapoint"s which make up this Segment
+            all_data: the GazeSampleTable of "Datapoint"s which make up this Segment
             fixation_data: The list of "Fixation"s which make up this Segment
             aois: a list of "AOI"s relevant to this Segment
             rest_pupil_size:
+            fixation_aois: the FixationAOIs of fixation_data and aois (computed if None)
         """
+        if fixation_aois is None:
+            fixation_aois = FixationAOIs(fixation_data, aois)
 
         if len(aois) == 0:
             warn("No AOIs passed to segment:"+self.segid)
         active_aois=[]
         self.aoi_data = {}
-        for aoi in aois:
+        # which samples, fixations and events are inside each AOI
+        index = get_aoi_index(aois)
+        self.transition_aids = [aoi.aid for aoi in aois]
+        self.transition_counts = fixation_aois.get_transition_counts(self.start, self.end)
+        samples_inside = index.inside_masks(all_data.gazepointx, all_data.gazepointy)
+        events_inside = index.events_inside_masks(event_data) if event_data != None else [None] * len(aois)
+        for i, aoi in enumerate(aois):
             #print "checking:",aoi.aid
             print("Generating features for %s AOI in segment %s" % (aoi.aid, self.segid))
-            aoistat = AOI_Stat(aoi, all_data, fixation_data, self.start, self.end, self.length_invalid, aois, event_data, rest_pupil_size, export_pupilinfo)
+            aoistat = AOI_Stat(aoi, all_data, fixation_data, self.start, self.end, self.length_invalid, aois, event_data, rest_pupil_size, export_pupilinfo,
+                               (samples_inside[i], fixation_aois.inside, events_inside[i]), self.transition_counts[:, i])
             self.aoi_data[aoi.aid] = aoistat
+            if not aoistat.isActive:
+                self.transition_counts[:, i] = 0
 
             act, _ = aoi.is_active_partition(self.fixation_start, self.fixation_end)
             if act:
@@ -226,7 +262,7 @@ class Segment():
             msg = "No active AOIs passed to segment:%s start:%d end:%d" %(self.segid,self.start,self.end)
             warn(msg)
 
-    def calc_blink_features(self, all_data):
+    def calc_blink_features(self, all_data, stats = None):
         """ Calculates blink features such as
                 blink_num:                 number of blinks on the in the segment
                 blink_duration_total:       sum of the blink durations for this segment
@@ -240,11 +276,11 @@ class Segment():
                 blink_time_distance_min:    minimal time difference between consequtive blinks
                 blink_time_distance_max:    maximal time difference between consequtive blinks
             Args:
-                all_data: The list of "Datapoint"s which make up this Segment
+                all_data: The GazeSampleTable of "Datapoint"s which make up this Segment
+                stats: the SampleStats of all_data (computed if None)
         """
-        blink_durations = []
-        blink_intervals = []
-        last_blink_detected = -1
+        if stats is None:
+            stats = SampleStats(all_data)
         self.features['blinknum']               = 0
         self.features['blinkdurationtotal']     = 0
         self.features['blinkdurationmean']      = 0
@@ -259,44 +295,32 @@ class Segment():
         lower_bound, upper_bould = params.blink_threshold
         ### File operations are for testing
         #file = open('outputfolder/blinks/blinks_%s.txt' % all_data[0].participant_name, 'w
-        blinks_validity_gaps = self.calc_blink_validity_gaps(all_data)
-        if params.EYETRACKERTYPE == "SMI":
-            for i in range(len(blinks_validity_gaps)):
-                blink_length = blinks_validity_gaps[i][1] - blinks_validity_gaps[i][0]
-                blink_durations.append(blink_length)
-                #file.write('Blink start, end: %d %d\n' % (self.time_gaps[i][0], self.time_gaps[i][1]))
-                if last_blink_detected != -1:
-                    # Calculate time difference between start of current blink and end of previous blink
-                    blink_intervals.append(blinks_validity_gaps[i][0] - blinks_validity_gaps[last_blink_detected][1])
-                last_blink_detected = i
-        else:
-            for i in range(len(blinks_validity_gaps)):
-                blink_length = blinks_validity_gaps[i][1] - blinks_validity_gaps[i][0]
-                if blink_length <= upper_bould and blink_length >= lower_bound:
-                    blink_durations.append(blink_length)
-                    #file.write('Blink start, end: %d %d\n' % (self.time_gaps[i][0], self.time_gaps[i][1]))
-                    if last_blink_detected != -1:
-                        # Calculate time difference between start of current blink and end of previous blink
-                        blink_intervals.append(blinks_validity_gaps[i][0] - blinks_validity_gaps[last_blink_detected][1])
-                    last_blink_detected = i
+        blink_starts, blink_ends = stats.blink_gap_starts, stats.blink_gap_ends
+        blink_lengths = blink_ends - blink_starts
+        if params.EYETRACKERTYPE != "SMI":
+            is_blink = (blink_lengths <= upper_bould) & (blink_lengths >= lower_bound)
+            blink_starts, blink_ends, blink_lengths = blink_starts[is_blink], blink_ends[is_blink], blink_lengths[is_blink]
+        blink_durations = self.moments['blinkduration'] = Moments.from_array(blink_lengths)
+        # time difference between start of each blink and end of previous blink
+        blink_intervals = self.moments['blinktimedistance'] = Moments.from_array(blink_starts[1:] - blink_ends[:-1])
 
         #file.close()
-        if len(blink_durations) > 0:
-            self.features['blinknum']               = len(blink_durations)
-            self.features['blinkdurationtotal']     = sum(blink_durations)
-            self.features['blinkdurationmean']      = mean(blink_durations)
-            self.features['blinkdurationstd']       = stddev(blink_durations)
-            self.features['blinkdurationmin']       = min(blink_durations)
-            self.features['blinkdurationmax']       = max(blink_durations)
+        if blink_durations.count > 0:
+            self.features['blinknum']               = blink_durations.count
+            self.features['blinkdurationtotal']     = blink_durations.sum
+            self.features['blinkdurationmean']      = blink_durations.mean
+            self.features['blinkdurationstd']       = blink_durations.get_stddev()
+            self.features['blinkdurationmin']       = blink_durations.min
+            self.features['blinkdurationmax']       = blink_durations.max
             self.features['blinkrate']              = float(self.features['blinknum']) / (self.length - self.length_invalid)
-        if len(blink_intervals) > 0:
-            self.features['blinktimedistancemean']  = mean(blink_intervals)
-            self.features['blinktimedistancestd']   = stddev(blink_intervals)
-            self.features['blinktimedistancemin']   = min(blink_intervals)
-            self.features['blinktimedistancemax']   = max(blink_intervals)
+        if blink_intervals.count > 0:
+            self.features['blinktimedistancemean']  = blink_intervals.mean
+            self.features['blinktimedistancestd']   = blink_intervals.get_stddev()
+            self.features['blinktimedistancemin']   = blink_intervals.min
+            self.features['blinktimedistancemax']   = blink_intervals.max
 
 
-    def calc_pupil_features(self, all_data, export_pupilinfo, rest_pupil_size):
+    def calc_pupil_features(self, all_data, export_pupilinfo, rest_pupil_size, stats = None):
         """ Calculates pupil features such as
                 mean_pupil_size:            mean of pupil sizes
                 stddev_pupil_size:          standard deviation of pupil sizes
@@ -308,22 +332,22 @@ class Segment():
                 max_pupil_velocity:         largest pupil velocity in this segment
 
             Args:
-                all_data: The list of "Datapoint"s which make up this Segment
+                all_data: The GazeSampleTable of "Datapoint"s which make up this Segment
+                stats: the SampleStats of all_data, with the pupil sizes adjusted with rest_pupil_size (computed if None)
         """
+        if stats is None:
+            stats = SampleStats(all_data, rest_pupil_size)
         # check if pupil sizes are available for all missing points
-        pupil_invalid_data = filter(lambda x: x.pupilsize == -1 and x.gazepointx > 0, all_data)
-        if len(pupil_invalid_data) > 0:
+        num_pupil_invalid = stats.num_pupil_invalid
+        if num_pupil_invalid > 0:
             if params.DEBUG:
                 raise Exception("Pupil size is unavailable for a valid data sample. \
-                        Number of missing points: " + str(len(pupil_invalid_data)))
+                        Number of missing points: " + str(num_pupil_invalid))
             else:
-                warn("Pupil size is unavailable for a valid data sample. Number of missing points: " + str(len(pupil_invalid_data)) )
+                warn("Pupil size is unavailable for a valid data sample. Number of missing points: " + str(num_pupil_invalid) )
 
-		#get all pupil sizes (valid + invalid)
-        #pupilsizes = map(lambda x: x.pupilsize, all_data)
-        #get all datapoints where pupil size is available
-        valid_pupil_data = filter(lambda x: x.pupilsize > 0, all_data)
-        valid_pupil_velocity = filter(lambda x: x.pupilvelocity != -1, all_data)
+        pupilsizes = self.moments['pupilsize'] = stats.pupilsize
+        pupilvelocities = self.moments['pupilvelocity'] = stats.pupilvelocity
 
         #number of valid pupil sizes
         self.features['meanpupilsize']       = -1
@@ -336,35 +360,27 @@ class Segment():
         self.features['stddevpupilvelocity'] = -1
         self.features['maxpupilvelocity']    = -1
         self.features['minpupilvelocity']    = -1
-        self.numpupilsizes                   = len(valid_pupil_data)
-        self.numpupilvelocity                = len(valid_pupil_velocity)
+        self.numpupilsizes                   = pupilsizes.count
+        self.numpupilvelocity                = pupilvelocities.count
 
         if self.numpupilsizes > 0: #check if the current segment has pupil data available
-            if params.PUPIL_ADJUSTMENT == "rpscenter":
-                adjvalidpupilsizes = map(lambda x: x.pupilsize - rest_pupil_size, valid_pupil_data)
-            elif params.PUPIL_ADJUSTMENT == "PCPS":
-                adjvalidpupilsizes = map(lambda x: (x.pupilsize - rest_pupil_size) / (1.0 * rest_pupil_size), valid_pupil_data)
-            else:
-                adjvalidpupilsizes = map(lambda x: x.pupilsize, valid_pupil_data)#valid_pupil_data
-
-            valid_pupil_velocity = map(lambda x: x.pupilvelocity, valid_pupil_velocity)#valid_pupil_data
-
             if export_pupilinfo:
-                self.pupilinfo_for_export = map(lambda x: [x.timestamp, x.pupilsize, rest_pupil_size], valid_pupil_data)
-            self.features['meanpupilsize']           = mean(adjvalidpupilsizes)
-            self.features['stddevpupilsize']         = stddev(adjvalidpupilsizes)
-            self.features['maxpupilsize']            = max(adjvalidpupilsizes)
-            self.features['minpupilsize']            = min(adjvalidpupilsizes)
-            self.features['startpupilsize']          = adjvalidpupilsizes[0]
-            self.features['endpupilsize']            = adjvalidpupilsizes[-1]
-
-            if len(valid_pupil_velocity) > 0:
-                self.features['meanpupilvelocity']   = mean(valid_pupil_velocity)
-                self.features['stddevpupilvelocity'] = stddev(valid_pupil_velocity)
-                self.features['maxpupilvelocity']    = max(valid_pupil_velocity)
-                self.features['minpupilvelocity']    = min(valid_pupil_velocity)
-
-    def calc_distance_features(self, all_data):
+                valid_pupil = stats.valid_pupil
+                self.pupilinfo_for_export = map(lambda t, p: [t, p, rest_pupil_size], all_data.timestamp[valid_pupil].tolist(), all_data.pupilsize[valid_pupil].tolist())
+            self.features['meanpupilsize']           = pupilsizes.mean
+            self.features['stddevpupilsize']         = pupilsizes.get_stddev()
+            self.features['maxpupilsize']            = pupilsizes.max
+            self.features['minpupilsize']            = pupilsizes.min
+            self.features['startpupilsize']          = pupilsizes.first
+            self.features['endpupilsize']            = pupilsizes.last
+
+            if pupilvelocities.count > 0:
+                self.features['meanpupilvelocity']   = pupilvelocities.mean
+                self.features['stddevpupilvelocity'] = pupilvelocities.get_stddev()
+                self.features['maxpupilvelocity']    = pupilvelocities.max
+                self.features['minpupilvelocity']    = pupilvelocities.min
+
+    def calc_distance_features(self, all_data, stats = None):
         """ Calculates distance features such as
                 mean_distance:            mean of distances from the screen
                 stddev_distance:          standard deviation of distances from the screen
@@ -374,27 +390,28 @@ class Segment():
                 end_distance:             distance from the screen in the end of this segment
 
             Args:
-                all_data: The list of "Datapoint"s which make up this Segment
+                all_data: The GazeSampleTable of "Datapoint"s which make up this Segment
+                stats: the SampleStats of all_data (computed if None)
         """
+        if stats is None:
+            stats = SampleStats(all_data)
         # check if distances are available for all missing points
-        invalid_distance_data = filter(lambda x: x.distance <= 0 and x.gazepointx >= 0, all_data)
-        if len(invalid_distance_data) > 0:
+        num_invalid_distance = stats.num_invalid_distance
+        if num_invalid_distance > 0:
             warn("Distance from screen is unavailable for a valid data sample. \
-                        Number of missing points: " + str(len(invalid_distance_data)))
+                        Number of missing points: " + str(num_invalid_distance))
 
-        #get all datapoints where distance is available
-        valid_distance_data = filter(lambda x: x.distance > 0, all_data)
+        distances = self.moments['distance'] = stats.distance
 
         #number of valid distance datapoints
-        self.numdistancedata = len(valid_distance_data)
+        self.numdistancedata = distances.count
         if self.numdistancedata > 0: #check if the current segment has pupil data available
-            distances_from_screen               = map(lambda x: x.distance, valid_distance_data)
-            self.features['meandistance']       = mean(distances_from_screen)
-            self.features['stddevdistance']     = stddev(distances_from_screen)
-            self.features['maxdistance']        = max(distances_from_screen)
-            self.features['mindistance']        = min(distances_from_screen)
-            self.features['startdistance']      = distances_from_screen[0]
-            self.features['enddistance']        = distances_from_screen[-1]
+            self.features['meandistance']       = distances.mean
+            self.features['stddevdistance']     = distances.get_stddev()
+            self.features['maxdistance']        = distances.max
+            self.features['mindistance']        = distances.min
+            self.features['startdistance']      = distances.first
+            self.features['enddistance']        = distances.last
         else:
             self.features['meandistance']       = -1
             self.features['stddevdistance']     = -1
@@ -423,21 +440,25 @@ class Segment():
             Args:
                 saccade_data: The list of saccade datapoints for this Segment
         """
+        self.moments.update(calc_saccade_stats(saccade_data if saccade_data != None else []))
         if saccade_data != None and len(saccade_data) > 0:
+            distance = self.moments['saccadedistance']
+            duration = self.moments['saccadeduration']
+            speed = self.moments['saccadespeed']
             self.numsaccades = len(saccade_data)
             self.features['numsaccades'] = self.numsaccades
-            self.features['sumsaccadedistance'] = sum(map(lambda x: float(x.saccadedistance), saccade_data))
-            self.features['meansaccadedistance'] = mean(map(lambda x: float(x.saccadedistance), saccade_data))
-            self.features['stddevsaccadedistance'] = stddev(map(lambda x: float(x.saccadedistance), saccade_data))
-            self.features['longestsaccadedistance'] = max(map(lambda x: float(x.saccadedistance), saccade_data))
-            self.features['sumsaccadeduration'] = sum(map(lambda x: float(x.saccadeduration), saccade_data))
-            self.features['meansaccadeduration'] = mean(map(lambda x: float(x.saccadeduration), saccade_data))
-            self.features['stddevsaccadeduration'] = stddev(map(lambda x: float(x.saccadeduration), saccade_data))
-            self.features['longestsaccadeduration'] = max(map(lambda x: float(x.saccadeduration), saccade_data))
-            self.features['meansaccadespeed'] = mean(map(lambda x: float(x.saccadespeed), saccade_data))
-            self.features['stddevsaccadespeed'] = stddev(map(lambda x: float(x.saccadespeed), saccade_data))
-            self.features['maxsaccadespeed'] = max(map(lambda x: float(x.saccadespeed), saccade_data))
-            self.features['minsaccadespeed'] = min(map(lambda x: float(x.saccadespeed), saccade_data))
+            self.features['sumsaccadedistance'] = distance.sum
+            self.features['meansaccadedistance'] = distance.mean
+            self.features['stddevsaccadedistance'] = distance.get_stddev()
+            self.features['longestsaccadedistance'] = distance.max
+            self.features['sumsaccadeduration'] = duration.sum
+            self.features['meansaccadeduration'] = duration.mean
+            self.features['stddevsaccadeduration'] = duration.get_stddev()
+            self.features['longestsaccadeduration'] = duration.max
+            self.features['meansaccadespeed'] = speed.mean
+            self.features['stddevsaccadespeed'] = speed.get_stddev()
+            self.features['maxsaccadespeed'] = speed.max
+            self.features['minsaccadespeed'] = speed.min
             self.features['fixationsaccadetimeratio'] = float(self.features['sumfixationduration']) / self.features['sumsaccadeduration']
         else:
             self.numsaccades = 0
@@ -475,16 +496,18 @@ class Segment():
             Args:
                 saccade_data: The list of saccade datapoints for this Segment
         """
+        durations = self.moments['fixationduration'] = Moments.from_array(np.array([fix.fixationduration for fix in fixation_data]))
         if self.numfixations > 0:
             self.fixation_start = fixation_data[0].timestamp
             self.fixation_end = fixation_data[-1].timestamp
-            self.features['meanfixationduration'] = mean(map(lambda x: float(x.fixationduration), fixation_data))
-            self.features['stddevfixationduration'] = stddev(map(lambda x: float(x.fixationduration), fixation_data))
-            self.features['sumfixationduration'] = sum(map(lambda x: x.fixationduration, fixation_data))
+            self.features['meanfixationduration'] = durations.mean
+            self.features['stddevfixationduration'] = durations.get_stddev()
+            self.features['sumfixationduration'] = durations.sum
             self.features['fixationrate'] = float(self.numfixations) / (self.length - self.length_invalid)
-            distances = self.calc_distances(fixation_data)
-            abs_angles = self.calc_abs_angles(fixation_data)
-            rel_angles = self.calc_rel_angles(fixation_data)
+            xs, ys = get_fixation_coordinates(fixation_data)
+            distances = self.moments['pathdistance'] = Moments.from_array(geometry.path_distances(xs, ys))
+            abs_angles = self.moments['abspathangles'] = Moments.from_array(geometry.path_abs_angles(xs, ys))
+            rel_angles = self.moments['relpathangles'] = Moments.from_array(geometry.path_rel_angles(xs, ys))
         else:
             self.fixation_start = -1
             self.fixation_end = -1
@@ -492,23 +515,26 @@ class Segment():
             self.features['stddevfixationduration'] = -1
             self.features['sumfixationduration'] = -1
             self.features['fixationrate'] = -1
-
-        self.numfixdistances = len(distances)
-        self.numabsangles = len(abs_angles)
-        self.numrelangles = len(rel_angles)
-        if len(distances) > 0:
-            self.features['meanpathdistance'] = mean(distances)
-            self.features['sumpathdistance'] = sum(distances)
-            self.features['stddevpathdistance'] = stddev(distances)
+            distances = self.moments['pathdistance'] = Moments()
+            abs_angles = self.moments['abspathangles'] = Moments()
+            rel_angles = self.moments['relpathangles'] = Moments()
+
+        self.numfixdistances = distances.count
+        self.numabsangles = abs_angles.count
+        self.numrelangles = rel_angles.count
+        if distances.count > 0:
+            self.features['meanpathdistance'] = distances.mean
+            self.features['sumpathdistance'] = distances.sum
+            self.features['stddevpathdistance'] = distances.get_stddev()
             self.features['eyemovementvelocity'] = self.features['sumpathdistance']/(self.length - self.length_invalid)
-            self.features['sumabspathangles'] = sum(abs_angles)
-            self.features['abspathanglesrate'] = sum(abs_angles)/(self.length - self.length_invalid)
-            self.features['meanabspathangles'] = mean(abs_angles)
-            self.features['stddevabspathangles'] = stddev(abs_angles)
-            self.features['sumrelpathangles'] = sum(rel_angles)
-            self.features['relpathanglesrate'] = sum(rel_angles)/(self.length - self.length_invalid)
-            self.features['meanrelpathangles'] = mean(rel_angles)
-            self.features['stddevrelpathangles'] = stddev(rel_angles)
+            self.features['sumabspathangles'] = abs_angles.sum
+            self.features['abspathanglesrate'] = abs_angles.sum/(self.length - self.length_invalid)
+            self.features['meanabspathangles'] = abs_angles.mean
+            self.features['stddevabspathangles'] = abs_angles.get_stddev()
+            self.features['sumrelpathangles'] = rel_angles.sum
+            self.features['relpathanglesrate'] = rel_angles.sum/(self.length - self.length_invalid)
+            self.features['meanrelpathangles'] = rel_angles.mean
+            self.features['stddevrelpathangles'] = rel_angles.get_stddev()
         else:
             self.features['meanpathdistance'] = -1
             self.features['sumpathdistance'] = -1
@@ -575,93 +601,60 @@ class Segment():
             self.features['timetofirstkeypressed'] = -1
 
 
-    def calc_validity_proportion(self, all_data):
+    def calc_validity_proportion(self, all_data, stats = None):
         """Calculates the proportion of "Datapoint"s which are valid.
 
         Args:
-            all_data: The list of "Datapoint"s which make up this Segment
+            all_data: The GazeSampleTable of "Datapoint"s which make up this Segment
+            stats: the SampleStats of all_data (computed if None)
 
         Returns:
             A float indicating the proportion of valid samples over all the samples in this Segment
         """
-        num_valid = float(0)
-        num = 0
-
-        for d in all_data:
-            #if d.stimuliname == 'ScreenRec':
-            #if d.stimuliname == 'Screen Recordings (1)'
-            if d.stimuliname != '':
-                num += 1
-                if d.is_valid:
-                    num_valid += 1
-#            else:
-#                print "###",d.event, d.data1
-        if num == 0:
+        if stats is None:
+            stats = SampleStats(all_data)
+        #only count samples with a stimuli name (e.g., 'ScreenRec')
+        if stats.numsamples == 0:
             return 0.0
         else:
-            return num_valid / num
+            return float(stats.numvalid) / stats.numsamples
 
 
-    def calc_largest_validity_gap(self, all_data):
+    def calc_largest_validity_gap(self, all_data, stats = None):
         """Calculates the largest gap of invalid samples in the "Datapoint"s for this Segment.
 
         Args:
-            all_data: The list of "Datapoint"s which make up this Segement
+            all_data: The GazeSampleTable of "Datapoint"s which make up this Segement
+            stats: the SampleStats of all_data (computed if None)
 
         Returns:
             An integer indicating the length of largest invalid gap for this Segment in milliseconds
         """
-        if self.numfixations == 0:
-            return all_data[-1].timestamp - all_data[0].timestamp
-        self.time_gaps = []
-        self.all_invalid_gaps = []
-        max_size = 0
-        dindex = 0
-        datalen = len(all_data)
-        while dindex < datalen:
-            d = all_data[dindex]
-            while d.is_valid and (dindex < datalen - 1):
-                dindex += 1
-                d = all_data[dindex]
-            if not (d.is_valid):
-                gap_start = d.timestamp
-                while not (d.is_valid) and (dindex < datalen - 1):
-                    dindex += 1
-                    d = all_data[dindex]
-                if d.timestamp - gap_start > max_size:
-                    max_size = d.timestamp - gap_start
-                if d.timestamp - gap_start > params.MAX_SEG_TIMEGAP:
-                    self.time_gaps.append((gap_start, d.timestamp))
-            dindex += 1
-        return max_size
+        if self.numfixations == 0:  # the whole segment is a gap
+            self.moments['datagap'] = Moments.from_array(np.array([all_data[-1].timestamp - all_data[0].timestamp]))
+            return self.moments['datagap'].max
+        if stats is None:
+            stats = SampleStats(all_data)
+        gap_starts, gap_ends = stats.gap_starts, stats.gap_ends
+        self.moments['datagap'] = Moments.from_array(gap_ends - gap_starts)
+        gap_lengths = (gap_ends - gap_starts).tolist()
+        self.all_invalid_gaps = zip(gap_starts.tolist(), gap_ends.tolist())
+        self.time_gaps = [gap for gap, length in zip(self.all_invalid_gaps, gap_lengths) if length > params.MAX_SEG_TIMEGAP]
+        return max([0] + gap_lengths)
 
 
     def calc_blink_validity_gaps(self, all_data):
         """Calculates the blink validity gaps for this segment
 
         Args:
-            all_data: The list of "Datapoint"s which make up this Segement
+            all_data: The GazeSampleTable of "Datapoint"s which make up this Segement
 
         Returns:
             An array for tuples (int, int) indicating beginning and end timestamps for each contiguous invalid group of rows
         """
 
-        blinks_validity_gaps = []
-        dindex = 0
-        datalen = len(all_data)
-        while dindex < datalen:
-            d = all_data[dindex]
-            while d.is_valid_blink and (dindex < datalen - 1):
-                dindex += 1
-                d = all_data[dindex]
-            if not (d.is_valid_blink):
-                gap_start = d.timestamp
-                while not (d.is_valid_blink) and (dindex < datalen - 1):
-                    dindex += 1
-                    d = all_data[dindex]
-                blinks_validity_gaps.append((gap_start, d.timestamp))
-            dindex += 1
-        return blinks_validity_gaps
+        gap_starts, gap_ends = find_invalid_gaps(all_data.timestamp, all_data.is_valid_blink)
+        return zip(gap_starts.tolist(), gap_ends.tolist())
 
     def getgaps(self):
         """Returns the list of invalid gaps > params.MAX_SEG_TIMEGAP for this Segment
@@ -690,7 +683,7 @@ class Segment():
             length += gap[1] - gap[0]
         return length
 
-    def calc_validity_fixation(self, all_data):
+    def calc_validity_fixation(self, all_data, stats = None):
         """Calculates the proportion of (valid + restored) "Datapoint"s over all "Datapoint"s of the Segment.
 
         Restored samples are the samples which are not valid but they are part of a Fixation.
@@ -699,28 +692,21 @@ class Segment():
         was looking at that same point during that period.
 
         Args:
-            all_data: The list of "Datapoint"s which make up this Segement
+            all_data: The GazeSampleTable of "Datapoint"s which make up this Segement
+            stats: the SampleStats of all_data (computed if None)
 
         Returns:
             A float indicating the proportion of (valid + restored) samples over all the samples in this Segment
         """
         if self.numfixations == 0:
             return 0.0
-        num_valid = float(0)
-        num = 0
-
-        for d in all_data:
-            #if d.stimuliname == 'ScreenRec':
-            if d.stimuliname != '':
-                num += 1
-                if d.is_valid or d.fixationindex!=None:
-                    num_valid += 1.0
-#            else:
-#                print "###",d.event, d.data1
-        if num == 0:
+        if stats is None:
+            stats = SampleStats(all_data)
+        #only count samples with a stimuli name (e.g., 'ScreenRec')
+        if stats.numsamples == 0:
             return 0.0
         else:
-            return num_valid / num
+            return float(stats.numrestored) / stats.numsamples
 
     def calc_validity1(self, threshold = params.VALID_PROP_THRESH):
         """Returns a boolean indicating whether this Segment is valid using proportion of valid samples threshold
@@ -761,19 +747,7 @@ class Segment():
         Args:
             fixdata: a list of "Fixation"s
         """
-        distances = []
-        lastx = fixdata[0].mappedfixationpointx
-        lasty = fixdata[0].mappedfixationpointy
-
-        for i in xrange(1, len(fixdata)):
-            x = fixdata[i].mappedfixationpointx
-            y = fixdata[i].mappedfixationpointy
-            dist = math.sqrt((x - lastx)**2 + (y - lasty)**2)
-            distances.append(dist)
-            lastx = x
-            lasty = y
-
-        return distances
+        return geometry.path_distances(*get_fixation_coordinates(fixdata)).tolist()
 
     def calc_abs_angles(self, fixdata):
         """returns the absolute angles between a sequence of "Fixation"s that build a scan path.
@@ -786,19 +760,7 @@ class Segment():
         Returns:
             a list of absolute angles for the saccades formed by the given sequence of "Fixation"s in Radiant
         """
-        abs_angles = []
-        lastx = fixdata[0].mappedfixationpointx
-        lasty = fixdata[0].mappedfixationpointy
-
-        for i in xrange(1,len(fixdata)):
-            x = fixdata[i].mappedfixationpointx
-            y = fixdata[i].mappedfixationpointy
-            (dist, theta) = geometry.vector_difference((lastx,lasty), (x, y))
-            abs_angles.append(abs(theta))
-            lastx=x
-            lasty=y
-
-        return abs_angles
+        return geometry.path_abs_angles(*get_fixation_coordinates(fixdata)).tolist()
 
     def calc_rel_angles(self, fixdata):
         """returns the relative angles between a sequence of "Fixation"s that build a scan path in Radiant
@@ -813,66 +775,34 @@ class Segment():
         Returns:
             a list of relative angles for the saccades formed by the given sequence of "Fixation"s in Radiant
         """
-        rel_angles = []
-        lastx = fixdata[0].mappedfixationpointx
-        lasty = fixdata[0].mappedfixationpointy
-
-        for i in xrange(1, len(fixdata) - 1):
-            x = fixdata[i].mappedfixationpointx
-            y = fixdata[i].mappedfixationpointy
-            nextx = fixdata[i + 1].mappedfixationpointx
-            nexty = fixdata[i + 1].mappedfixationpointy
-            v1 = (lastx - x, lasty - y)
-            v2 = (nextx - x, nexty - y)
-
-            if v1 != (0.0, 0.0) and v2 != (0.0, 0.0):
-                v1_dot = math.sqrt(geometry.simpledotproduct(v1, v1))
-                v2_dot = math.sqrt(geometry.simpledotproduct(v2, v2))
-                normv1 = ((lastx - x) / v1_dot, (lasty - y) / v1_dot)
-                normv2 = ((nextx - x) / v2_dot, (nexty - y) / v2_dot)
-                dotproduct = geometry.simpledotproduct(normv1, normv2)
-                if dotproduct < -1:
-                    dotproduct = -1.0
-                if dotproduct > 1:
-                    dotproduct = 1.0
-                theta = math.acos(dotproduct)
-                rel_angles.append(theta)
-            else:
-                rel_angles.append(0.0)
-            lastx = x
-            lasty = y
-
-        return rel_angles
+        return geometry.path_rel_angles(*get_fixation_coordinates(fixdata)).tolist()
 
-    def calc_num_samples(self, all_data):
+    def calc_num_samples(self, all_data, stats = None):
         """Returns the number of samples in the Segment
 
         Args:
-            all_data: a list of "Datapoint"s which make up this Segment.
+            all_data: a GazeSampleTable of "Datapoint"s which make up this Segment.
+            stats: the SampleStats of all_data (computed if None)
 
         Returns:
             An integer determining the number of samples in the Segment
 
         """
-        num = 0
-        for d in all_data:
-            if d.stimuliname != '':
-                num += 1
-        return num
+        if stats is None:
+            stats = SampleStats(all_data)
+        return stats.numsamples
 
-    def generate_aoi_sequence(self, fixdata, aois):
+    def generate_aoi_sequence(self, fixdata, aois, fixation_aois = None):
         """returns the sequence of AOI's where "Fixation"s occurred
         Args:
             fixdata: a list of "Fixation"s
+            fixation_aois: the FixationAOIs of fixdata and aois (computed if None)
         Returns:
             a list of AOI names that correspond to the sequence of "Fixation" locations
         """
-        sequence = []
-        for fix in fixdata:
-            for aoi in aois:
-                if _fixation_inside_aoi(fix, aoi.polyin, aoi.polyout) and aoi.is_active(fix.timestamp, fix.timestamp) :
-                    sequence.append(aoi.aid)
-        return sequence
+        if fixation_aois is None:
+            fixation_aois = FixationAOIs(fixdata, aois)
+        return fixation_aois.get_sequence()
 
     def getid(self):
         """Returns the segid for this Segment
@@ -958,3 +888,93 @@ class Segment():
         for i in xrange(len(fn)):
             print(fn[i],':',fv[i])
         print
+
+
+class SampleStats():
+    """The statistics of the samples of a Segment from which its sample-level features are calculated
+
+    They are all computed in one vectorized pass over the columns of the samples, each mask being computed once,
+    instead of filtering the samples again for each feature.
+
+    Attributes:
+        numsamples: An integer indicating the number of samples with a stimuli name (e.g., 'ScreenRec')
+        numvalid: An integer indicating the number of valid samples among them
+        numrestored: An integer indicating the number of (valid + restored) samples among them (see Segment.calc_validity_fixation)
+        validity: the Moments of the validity of these samples (1 if valid, 0 otherwise)
+        restored: the Moments of the validity of these samples after restoration (1 if valid or restored, 0 otherwise)
+        gap_starts, gap_ends: numpy arrays with the start and end timestamps of the gaps of invalid samples (see find_invalid_gaps)
+        blink_gap_starts, blink_gap_ends: numpy arrays with the start and end timestamps of the gaps of samples invalid for blinks
+        num_pupil_invalid: An integer indicating the number of samples with a gaze point but no pupil size
+        num_invalid_distance: An integer indicating the number of samples with a gaze point but no distance from the screen
+        valid_pupil: a numpy boolean array indicating the samples whose pupil size is available
+        pupilsize: the Moments of the available pupil sizes, adjusted with the rest pupil size
+        pupilvelocity: the Moments of the available pupil velocities
+        distance: the Moments of the available distances from the screen
+    """
+
+    def __init__(self, all_data, rest_pupil_size = 0):
+        """Inits SampleStats class
+
+        Args:
+            all_data: the GazeSampleTable of "Datapoint"s which make up the Segment
+            rest_pupil_size: rest pupil size used to adjust the pupil sizes (see adjust_pupil_sizes)
+        """
+        named = all_data.has_stimuliname()
+        self.numsamples = int(np.count_nonzero(named))
+        self.validity = Moments.from_mask(all_data.is_valid[named])
+        self.numvalid = self.validity.sum
+        restored = all_data.is_valid | (all_data.fixationindex != NO_FIXATION_INDEX)
+        self.restored = Moments.from_mask(restored[named])
+        self.numrestored = self.restored.sum
+
+        self.gap_starts, self.gap_ends = find_invalid_gaps(all_data.timestamp, all_data.is_valid)
+        self.blink_gap_starts, self.blink_gap_ends = find_invalid_gaps(all_data.timestamp, all_data.is_valid_blink)
+
+        with np.errstate(invalid='ignore'): # missing values are NaN
+            self.num_pupil_invalid = int(np.count_nonzero((all_data.pupilsize == -1) & (all_data.gazepointx > 0)))
+            self.num_invalid_distance = int(np.count_nonzero((all_data.distance <= 0) & (all_data.gazepointx >= 0)))
+            self.valid_pupil = all_data.pupilsize > 0
+            valid_distance = all_data.distance > 0
+
+        self.pupilsize = Moments.from_array(adjust_pupil_size_array(all_data.pupilsize[self.valid_pupil], rest_pupil_size))
+        self.pupilvelocity = Moments.from_array(all_data.pupilvelocity[all_data.pupilvelocity != -1])
+        self.distance = Moments.from_array(all_data.distance[valid_distance])
+
+
+def calc_saccade_stats(saccade_data):
+    """Returns the statistics of the distances, durations and speeds of a list of "Saccade"s, which are extracted
+    from the "Saccade"s in one pass
+
+    Args:
+        saccade_data: a list of "Saccade"s
+
+    Returns:
+        a dict with the Moments of each attribute of SACCADE_STAT_ATTRIBUTES, keyed by the name of the attribute
+    """
+    columns = np.array([(sac.saccadedistance, sac.saccadeduration, sac.saccadespeed) for sac in saccade_data],
+                       dtype=np.float64).reshape(-1, len(SACCADE_STAT_ATTRIBUTES))
+    return dict((name, Moments.from_array(columns[:, i])) for i, name in enumerate(SACCADE_STAT_ATTRIBUTES))
+
+
+def get_fixation_coordinates(fixdata):
+    """Returns two numpy float arrays with the x and y coordinates (mapped to the media) of a list of "Fixation"s
+    """
+    xs = np.array([fix.mappedfixationpointx for fix in fixdata], dtype=np.float64)
+    ys = np.array([fix.mappedfixationpointy for fix in fixdata], dtype=np.float64)
+    return xs, ys
+
+
+def find_invalid_gaps(timestamps, is_valid):
+    """Finds the gaps of invalid samples (the runs of consecutive invalid samples) by run-length encoding
+
+    Args:
+        timestamps: a numpy array with the timestamps of the samples
+        is_valid: a numpy boolean array indicating whether each sample is valid
+
+    Returns:
+        two numpy arrays with the start and end timestamps of the gaps. A gap starts at its first invalid sample
+        and ends at the first valid sample after it (at the last sample if the gap runs to the end)
+    """
+    invalid = np.concatenate(([False], ~np.asarray(is_valid, dtype=np.bool_), [False]))
+    changes = np.flatnonzero(invalid[1:] != invalid[:-1])
+    return timestamps[changes[::2]], timestamps[np.minimum(changes[1::2], len(timestamps) - 1)]
@@ -0,0 +1,184 @@
+"""
+UBC Eye Movement Data Analysis Toolkit (EMDAT), Version 3
+
+Cache of the data parsed from the files exported by the eye trackers, so that the (slow) parsing of
+the raw text exports is only done once. Each parsed stream (samples, fixations, saccades or events)
+is stored in its own entry under params.PARSEDDATACACHEFOLDER:
+    - the columns of a GazeSampleTable are stored as .npy files, which are memory-mapped when loaded
+    - the other streams (lists of "Fixation"s, "Saccade"s and "Event"s) are pickled
+An entry is identified by the path, size and modification time of the exported file, the reader
+(class, and source code of the reader and of the modules used for parsing), the reader-related parameters from params.py, the media offset and the
+columns of the samples which are read (see EMDAT_core.feature_planning).
+When the total size of the cache exceeds params.PARSEDDATACACHEMAXSIZE, the least recently used
+entries are removed.
+
+Institution: The University of British Columbia.
+"""
+
+import os
+import shutil
+import tempfile
+import hashlib
+import inspect
+import importlib
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+import numpy as np
+import params
+from EMDAT_core.data_structures import GazeSampleTable
+
+# version of the layout of the cache entries, to be increased when the layout changes
+CACHE_FORMAT_VERSION = 2
+
+# parameters from params.py used by the eye tracker readers
+READER_PARAMS = ('NUMBEROFEXTRAHEADERLINES', 'FIXATIONHEADERLINES', 'ALLDATAHEADERLINES', 'EVENTSHEADERLINES',
+                 'EVENTS_FIRST_DATA_LINE', 'FIXATION_HEADER_LINE', 'SACCADE_HEADER_LINE', 'USER_EVENT_HEADER_LINE',
+                 'RAW_HEADER_LINE', 'MONOCULAR_EYE', 'VALID_SAMPLES_PROP_SACCADE')
+
+# modules used by all the eye tracker readers to parse the exported files and build the parsed data
+PARSING_MODULES = ('EMDAT_core.export_parsing', 'EMDAT_core.compressed_input', 'EMDAT_core.data_structures',
+                   'EMDAT_core.utils')
+
+
+class ParsedDataCache():
+    """A folder that holds the data streams parsed by the eye tracker readers
+    """
+
+    def __init__(self, folder, max_size):
+        """Inits ParsedDataCache class
+
+        Args:
+            folder: the folder where the parsed data is stored (created if needed)
+            max_size: the maximum total size of the cache entries in bytes
+
+        Yields:
+            a ParsedDataCache object
+        """
+        self.folder = folder
+        self.max_size = max_size
+        if not os.path.isdir(folder):
+            try:
+                os.makedirs(folder)
+            except OSError:  # created concurrently by another process
+                if not os.path.isdir(folder):
+                    raise
+
+    def get_key(self, recording, stream, data_file):
+        """Returns the key of the cache entry for a data stream read from an exported file
+
+        Args:
+            recording: the Recording object reading the file
+            stream: the name of the stream read (e.g., 'all', 'fixation', 'saccade', 'event')
+            data_file: the name of the file exported by the eye tracker
+
+        Returns:
+            a string
+        """
+        stat = os.stat(data_file)
+        reader = type(recording)
+        key = [CACHE_FORMAT_VERSION, stream, os.path.abspath(data_file), stat.st_size, stat.st_mtime,
+               reader.__module__, reader.__name__, _get_source_digest(reader), recording.media_offset]
+        key.extend(getattr(params, name, None) for name in READER_PARAMS)
+        if stream == 'all':  # the columns of the samples which are read
+            key.append(recording.read_plan.get_skipped_sample_columns())
+        return hashlib.sha1(repr(key)).hexdigest()
+
+    def load(self, key):
+        """Returns the data stored for the given key
+
+        Returns:
+            a boolean indicating if the key is in the cache, and the data (None if not in the cache)
+        """
+        entry = os.path.join(self.folder, key)
+        if not os.path.isdir(entry):
+            return False, None
+        try:
+            with open(os.path.join(entry, 'data.pkl'), 'rb') as f:
+                data = pickle.load(f)
+            if isinstance(data, dict) and data.get('GazeSampleTable'):
+                columns = dict((name, np.load(os.path.join(entry, name + '.npy'), mmap_mode='r'))
+                               for name in GazeSampleTable.columns)
+                data = GazeSampleTable(columns, data['stimulinames'])
+        except (IOError, OSError, EOFError, ValueError, pickle.UnpicklingError):  # incomplete or removed entry
+            return False, None
+        try:
+            os.utime(entry, None)  # mark the entry as recently used
+        except OSError:
+            pass
+        return True, data
+
+    def store(self, key, data):
+        """Stores the data for the given key, and evicts old entries if the cache is too large
+
+        Args:
+            key: a key returned by get_key
+            data: a GazeSampleTable or any picklable data stream
+        """
+        entry = os.path.join(self.folder, key)
+        tmp_entry = tempfile.mkdtemp(prefix='.tmp', dir=self.folder)
+        try:
+            if isinstance(data, GazeSampleTable):
+                for name in GazeSampleTable.columns:
+                    np.save(os.path.join(tmp_entry, name + '.npy'), np.ascontiguousarray(getattr(data, name)))
+                header = {'GazeSampleTable': True, 'stimulinames': data.stimulinames}
+            else:
+                header = data
+            with open(os.path.join(tmp_entry, 'data.pkl'), 'wb') as f:
+                pickle.dump(header, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_entry, entry)
+        except OSError:  # the entry was stored concurrently by another process
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+        self.evict()
+
+    def evict(self):
+        """Removes the least recently used entries until the total size of the cache is below its maximum size
+        """
+        entries = []
+        total_size = 0
+        for name in os.listdir(self.folder):
+            entry = os.path.join(self.folder, name)
+            if name.startswith('.tmp') or not os.path.isdir(entry):
+                continue
+            try:
+                size = sum(os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry))
+                entries.append((os.path.getmtime(entry), size, entry))
+            except OSError:  # removed concurrently by another process
+                continue
+            total_size += size
+
+        entries.sort()
+        while total_size > self.max_size and entries:
+            _, size, entry = entries.pop(0)
+            shutil.rmtree(entry, ignore_errors=True)
+            total_size -= size
+
+
+def get_parsed_data_cache():
+    """Returns the ParsedDataCache set in params.py, or None if the cache is disabled
+    """
+    folder = getattr(params, 'PARSEDDATACACHEFOLDER', None)
+    if not folder:
+        return None
+    return ParsedDataCache(folder, getattr(params, 'PARSEDDATACACHEMAXSIZE', 2 * 1024 ** 3))
+
+
+_source_digests = {}
+
+
+def _get_source_digest(reader):
+    """Returns a digest of the source code of the modules defining the reader and its base classes, and of
+    the PARSING_MODULES, so that cache entries are not reused after the parsing code is modified
+    """
+    if reader not in _source_digests:
+        digest = hashlib.sha1()
+        sources = list(inspect.getmro(reader)) + [importlib.import_module(name) for name in PARSING_MODULES]
+        for source in sources:
+            try:
+                with open(inspect.getsourcefile(source), 'rb') as f:
+                    digest.update(f.read())
+            except (IOError, TypeError):  # built-in class or source not available
+                continue
+        _source_digests[reader] = digest.hexdigest()
+    return _source_digests[reader]
@@ -0,0 +1,189 @@
+"""
+UBC Eye Movement Data Analysis Toolkit (EMDAT), Version 3
+
+Reading of the files exported by the eye trackers when they are compressed (.gz, .xz or .zst), without
+decompressing them to disk first. The file is decompressed in a background thread which feeds the parser
+through a bounded buffer (see params.DECOMPRESSIONBUFFERSIZE), so that reading the file, decompressing it
+and parsing the rows overlap.
+.xz files need the lzma module (backports.lzma with Python 2) and .zst files need the zstandard package.
+
+Institution: The University of British Columbia.
+"""
+
+import gzip
+import io
+import os
+import threading
+import Queue
+import params
+
+# size of the chunks of decompressed data passed from the background thread to the parser
+DECOMPRESSION_CHUNK_SIZE = 1024 ** 2
+
+
+def _open_gzip(data_file):
+    return gzip.open(data_file, 'rb')
+
+
+def _open_xz(data_file):
+    try:
+        import lzma
+    except ImportError:
+        try:
+            from backports import lzma
+        except ImportError:
+            raise Exception("Reading the .xz file '" + data_file + "' requires the lzma module "
+                            "(the backports.lzma package with Python 2)")
+    return lzma.LZMAFile(data_file, 'rb')
+
+
+def _open_zstd(data_file):
+    try:
+        import zstandard
+    except ImportError:
+        raise Exception("Reading the .zst file '" + data_file + "' requires the zstandard package")
+    return zstandard.ZstdDecompressor().stream_reader(open(data_file, 'rb'))
+
+
+# functions opening a compressed file as a file object returning the decompressed data, by file extension
+DECOMPRESSORS = {'.gz': _open_gzip,
+                 '.xz': _open_xz,
+                 '.zst': _open_zstd}
+
+
+def is_compressed(data_file):
+    """Returns True if the file is compressed (according to its extension)
+    """
+    return os.path.splitext(data_file)[1].lower() in DECOMPRESSORS
+
+
+def find_data_file(data_file):
+    """Returns the name of the file if it exists, otherwise the name of a compressed version of the file
+    if there is one (e.g., 'P1_Data_Export.tsv.gz' for 'P1_Data_Export.tsv'), otherwise the name of the file
+    """
+    if data_file is None or os.path.exists(data_file):
+        return data_file
+    for extension in sorted(DECOMPRESSORS):
+        if os.path.exists(data_file + extension):
+            return data_file + extension
+    return data_file
+
+
+def open_data_file(data_file):
+    """Opens a file exported by an eye tracker for reading, decompressing it if it is compressed
+
+    Args:
+        data_file: A string containing the name of the file
+
+    Returns:
+        a file object. For a compressed file, it can only seek forward and its positions are
+        positions in the decompressed data.
+    """
+    if not is_compressed(data_file):
+        return open(data_file, 'r')
+    open_compressed = DECOMPRESSORS[os.path.splitext(data_file)[1].lower()]
+    return io.BufferedReader(DecompressedStream(data_file, open_compressed), DECOMPRESSION_CHUNK_SIZE)
+
+
+class DecompressedStream(io.RawIOBase):
+    """The decompressed data of a compressed file, decompressed in a background thread
+
+    The thread puts the chunks of decompressed data in a queue holding at most params.DECOMPRESSIONBUFFERSIZE
+    bytes, from which they are read by the parser. Errors raised while decompressing are raised in the parser.
+    """
+
+    def __init__(self, data_file, open_compressed):
+        """Inits DecompressedStream class and starts the decompression thread
+
+        Args:
+            data_file: A string containing the name of the compressed file
+            open_compressed: a function opening the compressed file as a file object returning the decompressed data
+        """
+        io.RawIOBase.__init__(self)
+        buffer_size = getattr(params, 'DECOMPRESSIONBUFFERSIZE', 16 * 1024 ** 2)
+        self.chunks = Queue.Queue(max(buffer_size // DECOMPRESSION_CHUNK_SIZE, 1))
+        self.chunk = ''
+        self.offset = 0  # position in self.chunk
+        self.position = 0  # position in the decompressed data
+        self.eof = False
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._decompress, args=(data_file, open_compressed))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _decompress(self, data_file, open_compressed):
+        """Decompresses the file and puts the decompressed chunks in the queue (run in the background thread)
+        """
+        try:
+            f = open_compressed(data_file)
+            try:
+                while not self.stopped.is_set():
+                    chunk = f.read(DECOMPRESSION_CHUNK_SIZE)
+                    self._put(chunk)
+                    if not chunk:  # end of the file
+                        break
+            finally:
+                f.close()
+        except Exception as e:
+            self._put(e)
+
+    def _put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.chunks.put(item, timeout=0.1)
+                return
+            except Queue.Full:  # the parser is late, wait unless it is closed
+                continue
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def readinto(self, b):
+        if self.offset >= len(self.chunk):
+            if self.eof:
+                return 0
+            item = self.chunks.get()
+            if isinstance(item, Exception):
+                self.eof = True
+                raise item
+            if not item:
+                self.eof = True
+                return 0
+            self.chunk = item
+            self.offset = 0
+        n = min(len(b), len(self.chunk) - self.offset)
+        b[:n] = self.chunk[self.offset:self.offset + n]
+        self.offset += n
+        self.position += n
+        return n
+
+    def seek(self, position, whence=io.SEEK_SET):
+        """Moves forward to the given position in the decompressed data, by skipping the data before it
+        """
+        if whence == io.SEEK_CUR:
+            position += self.position
+        elif whence != io.SEEK_SET:
+            raise IOError("Cannot seek from the end of a compressed file")
+        if position < self.position:
+            raise IOError("Cannot seek backward in a compressed file")
+        skipped = bytearray(DECOMPRESSION_CHUNK_SIZE)
+        while self.position < position:
+            if self.readinto(memoryview(skipped)[:position - self.position]) == 0:
+                break
+        return self.position
+
+    def close(self):
+        if not self.closed:
+            self.stopped.set()
+            while True:  # unblock the decompression thread
+                try:
+                    self.chunks.get_nowait()
+                except Queue.Empty:
+                    break
+        io.RawIOBase.close(self)
@@ -7,9 +7,31 @@ Authors: Nicholas FitzGerald (creator), Oliver Schmid, Samad Kardan, Sebastien L
 Institution: The University of British Columbia.
 """
 from warnings import warn
+from array import array
+import math
+import numpy as np
 
 
-class Datapoint:
+class _Record(object):
+    """Base class of the compact data structures below, which store their attributes in __slots__
+    instead of a per-instance __dict__
+    """
+    __slots__ = ()
+
+    def get_attributes(self):
+        """Returns a dictionary with the attributes which are set (what vars() returns for an object with a __dict__)
+        """
+        return dict((name, getattr(self, name)) for name in self.__slots__ if hasattr(self, name))
+
+    def __getstate__(self):
+        return self.get_attributes()
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+
+class Datapoint(_Record):
     """
     A class that holds the information for one eye gaze data sample (one line of data logs)
 
@@ -19,6 +41,8 @@ class Datapoint:
 
         Please refer to the Tobii manual for the description of the rest of the attributes
     """
+    __slots__ = ('timestamp', 'pupilsize', 'pupilvelocity', 'distance', 'is_valid', 'is_valid_blink', 'stimuliname',
+                 'fixationindex', 'gazepointx', 'gazepointy', 'segid')
 
     def __init__(self, data):
         """
@@ -32,28 +56,351 @@ class Datapoint:
         Yields:
             a Datapoint object
         """
-        self.timestamp = data.get("timestamp", None)
-        self.pupilsize = data.get("pupilsize", None)
-        self.pupilvelocity = data.get("pupilvelocity", None)
-        self.distance = data.get("distance", None)
-        self.is_valid = data.get("is_valid", None)
-        self.is_valid_blink = data.get("is_valid_blink", None)
-        self.stimuliname = data.get("stimuliname", None)
-        self.fixationindex = data.get("fixationindex", None)
-        self.gazepointx = data.get("gazepointx", None)
-        self.gazepointy = data.get("gazepointy", None)
+        self._init_values(data.get("timestamp", None), data.get("pupilsize", None), data.get("pupilvelocity", None),
+                          data.get("distance", None), data.get("is_valid", None), data.get("is_valid_blink", None),
+                          data.get("stimuliname", None), data.get("fixationindex", None), data.get("gazepointx", None),
+                          data.get("gazepointy", None))
+
+    @classmethod
+    def from_values(cls, timestamp, pupilsize, pupilvelocity, distance, is_valid, is_valid_blink, stimuliname,
+                    fixationindex, gazepointx, gazepointy):
+        """Returns a Datapoint with the given attributes, without the dictionary taken by the constructor
+        """
+        datapoint = cls.__new__(cls)
+        datapoint._init_values(timestamp, pupilsize, pupilvelocity, distance, is_valid, is_valid_blink, stimuliname,
+                               fixationindex, gazepointx, gazepointy)
+        return datapoint
+
+    def _init_values(self, timestamp, pupilsize, pupilvelocity, distance, is_valid, is_valid_blink, stimuliname,
+                     fixationindex, gazepointx, gazepointy):
+        self.timestamp = timestamp
+        self.pupilsize = pupilsize
+        self.pupilvelocity = pupilvelocity
+        self.distance = distance
+        self.is_valid = is_valid
+        self.is_valid_blink = is_valid_blink
+        self.stimuliname = stimuliname
+        self.fixationindex = fixationindex
+        self.gazepointx = gazepointx
+        self.gazepointy = gazepointy
         self.segid = None
 
     def get_string(self, sep='\t'):
         return str(self.timestamp)+sep+str(self.pupilsize)+sep+str(self.pupilvelocity)+sep+str(self.distance)+sep+str(self.is_valid)+sep+str(self.stimuliname)+sep+str(self.fixationindex)#+sep+str(self.gazepointxleft)
 
-class Fixation:
+
+# value stored in the fixationindex column of a GazeSampleTable for samples that are not part of a fixation
+NO_FIXATION_INDEX = -1
+
+
+class GazeSampleTable(object):
+    """
+    A class that holds the gaze data samples of a recording as contiguous typed columns
+    (one numpy array per attribute of "Datapoint") instead of a list of "Datapoint"s.
+
+    Slicing a GazeSampleTable with a range (e.g., all_data[start:end]) returns a new GazeSampleTable
+    that shares the memory of the original one. Indexing it with an integer returns the corresponding
+    Datapoint, so code that expects a list of "Datapoint"s keeps working.
+
+    Attributes:
+        timestamp, pupilsize, pupilvelocity, distance, is_valid, is_valid_blink, fixationindex,
+        gazepointx, gazepointy: numpy arrays with one value per sample. Missing gaze coordinates
+            are stored as NaN and missing fixation indices as NO_FIXATION_INDEX.
+        stimuliindex: a numpy array with, for each sample, the index of its stimuli name in stimulinames
+        stimulinames: a list of the distinct stimuli names
+    """
+
+    columns = ('timestamp', 'pupilsize', 'pupilvelocity', 'distance', 'is_valid', 'is_valid_blink',
+               'fixationindex', 'gazepointx', 'gazepointy', 'stimuliindex')
+
+    dtypes = {'timestamp': np.int64,
+              'pupilsize': np.float64,
+              'pupilvelocity': np.float64,
+              'distance': np.float64,
+              'is_valid': np.bool_,
+              'is_valid_blink': np.bool_,
+              'fixationindex': np.int64,
+              'gazepointx': np.float64,
+              'gazepointy': np.float64,
+              'stimuliindex': np.int32}
+
+    def __init__(self, columns=None, stimulinames=None):
+        """Initializes a GazeSampleTable from already built columns
+
+        Args:
+            columns: a dictionary mapping each name in GazeSampleTable.columns to a sequence of values
+                (an empty table is created if None)
+            stimulinames: the list of distinct stimuli names referenced by the stimuliindex column
+
+        Yields:
+            a GazeSampleTable object
+        """
+        if columns is None:
+            columns = {}
+        for name in self.columns:
+            setattr(self, name, np.asarray(columns.get(name, []), dtype=self.dtypes[name]))
+        self.stimulinames = stimulinames if stimulinames is not None else []
+        self._sorted_timestamps = None  # unknown until has_sorted_timestamps is called
+
+    @staticmethod
+    def from_datapoints(datapoints):
+        """Returns a GazeSampleTable holding the same samples as a list of "Datapoint"s
+        """
+        builder = GazeSampleTableBuilder()
+        for datapoint in datapoints:
+            builder.append(datapoint.get_attributes())
+        return builder.build()
+
+    @staticmethod
+    def concatenate(tables):
+        """Returns a GazeSampleTable with the samples of all the given tables, in order
+        """
+        tables = list(tables)
+        if len(tables) == 0:
+            return GazeSampleTable()
+        stimulinames = list(tables[0].stimulinames)
+        stimuliindex = []
+        for table in tables:
+            if table.stimulinames == stimulinames:
+                stimuliindex.append(table.stimuliindex)
+            else:
+                for name in table.stimulinames:
+                    if name not in stimulinames:
+                        stimulinames.append(name)
+                remap = np.array([stimulinames.index(name) for name in table.stimulinames], dtype=np.int32)
+                stimuliindex.append(remap[table.stimuliindex])
+        columns = dict((name, np.concatenate([getattr(table, name) for table in tables]))
+                       for name in GazeSampleTable.columns if name != 'stimuliindex')
+        columns['stimuliindex'] = np.concatenate(stimuliindex)
+        return GazeSampleTable(columns, stimulinames)
+
+    def __len__(self):
+        return len(self.timestamp)
+
+    def __getitem__(self, key):
+        """Returns the Datapoint at the given position if key is an integer, otherwise a GazeSampleTable
+        with the samples selected by key (a slice, a boolean mask or an array of indices)
+        """
+        if isinstance(key, (int, long, np.integer)):
+            return self.get_datapoint(key)
+        columns = dict((name, getattr(self, name)[key]) for name in self.columns)
+        table = GazeSampleTable(columns, self.stimulinames)
+        if isinstance(key, slice) and key.step in (None, 1) and self._sorted_timestamps:
+            table._sorted_timestamps = True  # a range of sorted timestamps is sorted
+        return table
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self.get_datapoint(i)
+
+    def get_row(self, i):
+        """Returns a dictionary with the attributes of the sample at position i, as read by the tracker readers
+        """
+        fixationindex = int(self.fixationindex[i])
+        gazepointx = float(self.gazepointx[i])
+        gazepointy = float(self.gazepointy[i])
+        return {"timestamp": int(self.timestamp[i]),
+                "pupilsize": float(self.pupilsize[i]),
+                "pupilvelocity": float(self.pupilvelocity[i]),
+                "distance": float(self.distance[i]),
+                "is_valid": bool(self.is_valid[i]),
+                "is_valid_blink": bool(self.is_valid_blink[i]),
+                "stimuliname": self.stimulinames[self.stimuliindex[i]],
+                "fixationindex": None if fixationindex == NO_FIXATION_INDEX else fixationindex,
+                "gazepointx": None if math.isnan(gazepointx) else gazepointx,
+                "gazepointy": None if math.isnan(gazepointy) else gazepointy}
+
+    def get_datapoint(self, i):
+        """Returns the Datapoint at position i (see get_row)
+        """
+        fixationindex = int(self.fixationindex[i])
+        gazepointx = float(self.gazepointx[i])
+        gazepointy = float(self.gazepointy[i])
+        return Datapoint.from_values(int(self.timestamp[i]), float(self.pupilsize[i]), float(self.pupilvelocity[i]),
+                                     float(self.distance[i]), bool(self.is_valid[i]), bool(self.is_valid_blink[i]),
+                                     self.stimulinames[self.stimuliindex[i]],
+                                     None if fixationindex == NO_FIXATION_INDEX else fixationindex,
+                                     None if math.isnan(gazepointx) else gazepointx,
+                                     None if math.isnan(gazepointy) else gazepointy)
+
+    def has_sorted_timestamps(self):
+        """Returns True if the timestamps of the samples are in increasing order (checked once per table)
+        """
+        if self._sorted_timestamps is None:
+            self._sorted_timestamps = bool(np.all(self.timestamp[1:] >= self.timestamp[:-1]))
+        return self._sorted_timestamps
+
+    def has_stimuliname(self):
+        """Returns a boolean mask of the samples with a non-empty stimuli name
+        """
+        named = np.array([name != '' for name in self.stimulinames], dtype=np.bool_)
+        if len(named) == 0:
+            return np.zeros(len(self), dtype=np.bool_)
+        return named[self.stimuliindex]
+
+
+class GazeSampleTableBuilder:
+    """
+    A class used by the tracker readers to fill a GazeSampleTable one sample at a time
+    without creating a Datapoint object for each sample.
+    """
+
+    def __init__(self, skipped_columns=()):
+        """Inits GazeSampleTableBuilder class
+
+        Args:
+            skipped_columns: the names of the float columns which are not read (e.g., 'pupilsize'). They are not stored
+                and are missing (NaN) for all the samples of the table.
+        """
+        # timestamps and fixation indices are buffered as doubles, which represent integers exactly up to 2**53
+        self.timestamp = array('d')
+        self.pupilsize = array('d')
+        self.pupilvelocity = array('d')
+        self.distance = array('d')
+        self.is_valid = array('b')
+        self.is_valid_blink = array('b')
+        self.fixationindex = array('d')
+        self.gazepointx = array('d')
+        self.gazepointy = array('d')
+        self.stimuliindex = array('i')
+        self.stimulinames = []
+        self._stimulicodes = {}
+        for name in skipped_columns:
+            setattr(self, name, _SkippedColumn())
+
+    def __len__(self):
+        return len(self.timestamp)
+
+    def append(self, data):
+        """Adds one sample to the table
+
+        Args:
+            data: a dictionary with the attributes of the sample, as accepted by Datapoint
+        """
+        self.timestamp.append(data["timestamp"])
+        self.pupilsize.append(_value_or_nan(data.get("pupilsize")))
+        self.pupilvelocity.append(_value_or_nan(data.get("pupilvelocity")))
+        self.distance.append(_value_or_nan(data.get("distance")))
+        self.is_valid.append(bool(data.get("is_valid")))
+        self.is_valid_blink.append(bool(data.get("is_valid_blink")))
+        fixationindex = data.get("fixationindex")
+        self.fixationindex.append(NO_FIXATION_INDEX if fixationindex is None else fixationindex)
+        self.gazepointx.append(_value_or_nan(data.get("gazepointx")))
+        self.gazepointy.append(_value_or_nan(data.get("gazepointy")))
+        stimuliname = data.get("stimuliname")
+        code = self._stimulicodes.get(stimuliname)
+        if code is None:
+            code = self._stimulicodes[stimuliname] = len(self.stimulinames)
+            self.stimulinames.append(stimuliname)
+        self.stimuliindex.append(code)
+
+    def build(self):
+        """Returns the GazeSampleTable holding all the samples appended so far
+        """
+        columns = {}
+        for name in GazeSampleTable.columns:
+            buffered = getattr(self, name)
+            if isinstance(buffered, _SkippedColumn):   # the same NaN for all the samples, without allocating the column
+                columns[name] = np.broadcast_to(np.float64(np.nan), (len(self),))
+            elif len(buffered) == 0:
+                columns[name] = []
+            else:   # copy, since the buffers can be reallocated by later appends
+                columns[name] = np.frombuffer(buffered, dtype=_ARRAY_DTYPES[buffered.typecode]).astype(GazeSampleTable.dtypes[name])
+        return GazeSampleTable(columns, list(self.stimulinames))
+
+
+_ARRAY_DTYPES = {'d': np.float64, 'b': np.int8, 'i': np.intc}
+
+
+class _SkippedColumn:
+    """Stands for the buffer of a column of GazeSampleTableBuilder which is not read: the appended values are dropped
+    """
+
+    def append(self, value):
+        pass
+
+
+def _value_or_nan(value):
+    return float('nan') if value is None else value
+
+
+class RecordingView(object):
+    """
+    A read-only view of a range of a list of "Fixation"s, "Saccade"s or "Event"s of a recording, used by the
+    "Segment"s, their partitions and the "AOI_Stat"s instead of slices of the list, which would copy it.
+    It supports len, iteration and indexing like a list, and slicing a view returns a view of the same list.
+    (The samples do not need views, since slicing a GazeSampleTable does not copy it.)
+
+    Attributes:
+        source: the list of items viewed
+        start: the index in source of the first item in the view
+        end: the index in source after the last item in the view
+        time_index: a TimeIndex of source (see EMDAT_core.utils.index_by_time), shared by the views of the view,
+            or None
+    """
+    __slots__ = ('source', 'start', 'end', 'time_index')
+
+    def __init__(self, source, start=0, end=None, time_index=None):
+        """Inits RecordingView class with the items of source from start to end, with the same bounds as source[start:end]
+
+        Args:
+            source: a list (or a RecordingView, in which case the new view refers to its list)
+            start: the index of the first item in source
+            end: the index after the last item in source, None for the end of source
+            time_index: a TimeIndex of source, None to use the one of source if it is a RecordingView
+
+        Yields:
+            a RecordingView object
+        """
+        start, end, _ = slice(start, end).indices(len(source))
+        end = max(start, end)
+        if isinstance(source, RecordingView):
+            start += source.start
+            end += source.start
+            if time_index is None:
+                time_index = source.time_index
+            source = source.source
+        self.source = source
+        self.start = start
+        self.end = end
+        self.time_index = time_index
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __getitem__(self, key):
+        """Returns the item at the given position if key is an integer (negative positions count from the end
+        of the view), otherwise a RecordingView of the items selected by the slice key
+        """
+        if isinstance(key, slice):
+            start, end, step = key.indices(len(self))
+            if step != 1:
+                return [self.source[self.start + i] for i in xrange(start, end, step)]
+            return RecordingView(self, start, end)
+        if key < 0:
+            key += len(self)
+        if key < 0 or key >= len(self):
+            raise IndexError("RecordingView index out of range")
+        return self.source[self.start + key]
+
+    def __iter__(self):
+        source = self.source
+        for i in xrange(self.start, self.end):
+            yield source[i]
+
+    def __repr__(self):
+        return "RecordingView(%d items from %d to %d)" % (len(self), self.start, self.end)
+
+
+class Fixation(_Record):
     """
     A class that holds the information for one Fixation
 
     Attributes:
         segid: a string indicating the Segment to which this Fixation belongs
     """
+    __slots__ = ('fixationindex', 'timestamp', 'fixationduration', 'mappedfixationpointx', 'mappedfixationpointy',
+                 'segid')
 
     def __init__(self, data, media_offset = (0, 0)):
         """Initializes a Fixation with attributes
@@ -67,12 +414,25 @@ class Fixation:
         Yields:
             a Fixation object
         """
-
-        self.fixationindex = data.get("fixationindex", None)
-        self.timestamp = data.get("timestamp", None)
-        self.fixationduration = data.get("fixationduration", None)
-        self.mappedfixationpointx = data.get("fixationpointx", None)
-        self.mappedfixationpointy = data.get("fixationpointy", None)
+        self._init_values(data.get("fixationindex", None), data.get("timestamp", None),
+                          data.get("fixationduration", None), data.get("fixationpointx", None),
+                          data.get("fixationpointy", None), media_offset)
+
+    @classmethod
+    def from_values(cls, fixationindex, timestamp, fixationduration, fixationpointx, fixationpointy,
+                    media_offset=(0, 0)):
+        """Returns a Fixation with the given attributes, without the dictionary taken by the constructor
+        """
+        fixation = cls.__new__(cls)
+        fixation._init_values(fixationindex, timestamp, fixationduration, fixationpointx, fixationpointy, media_offset)
+        return fixation
+
+    def _init_values(self, fixationindex, timestamp, fixationduration, fixationpointx, fixationpointy, media_offset):
+        self.fixationindex = fixationindex
+        self.timestamp = timestamp
+        self.fixationduration = fixationduration
+        self.mappedfixationpointx = fixationpointx
+        self.mappedfixationpointy = fixationpointy
         self.segid = None
 
         if self.fixationduration == 0:
@@ -109,13 +469,16 @@ class Fixation:
     def get_string(self, sep='\t'):
         return str(self.fixationindex)+sep+str(self.timestamp)+sep+str(self.fixationduration)+sep+str(self.mappedfixationpointx)+sep+str(self.mappedfixationpointy)
 
-class Saccade:
+class Saccade(_Record):
     """
     A class that holds the information for one Saccade
 
     Attributes:
         segid: a string indicating the Segment to which this Saccade belongs
     """
+    __slots__ = ('saccadeindex', 'timestamp', 'saccadeduration', 'saccadedistance', 'saccadespeed',
+                 'saccadeacceleration', 'saccadestartpointx', 'saccadestartpointy', 'saccadeendpointx',
+                 'saccadeendpointy', 'saccadequality', 'segid')
 
     def __init__(self, data, media_offset = (0, 0)):
         """Initializes a Saccade with attributes
@@ -129,18 +492,39 @@ class Saccade:
         Yields:
             a Sacade object
         """
-
-        self.saccadeindex = data.get("saccadeindex", None)
-        self.timestamp = data.get("timestamp", None)
-        self.saccadeduration = data.get("saccadeduration", None)
-        self.saccadedistance = data.get("saccadedistance", None)
-        self.saccadespeed = data.get("saccadespeed", None)
-        self.saccadeacceleration = data.get("saccadeacceleration", None)
-        self.saccadestartpointx = data.get("saccadestartpointx", None)
-        self.saccadestartpointy = data.get("saccadestartpointy", None)
-        self.saccadeendpointx = data.get("saccadeendpointx", None)
-        self.saccadeendpointy = data.get("saccadeendpointy", None)
-        self.saccadequality = data.get("saccadequality", None)
+        self._init_values(data.get("saccadeindex", None), data.get("timestamp", None),
+                          data.get("saccadeduration", None), data.get("saccadedistance", None),
+                          data.get("saccadespeed", None), data.get("saccadeacceleration", None),
+                          data.get("saccadestartpointx", None), data.get("saccadestartpointy", None),
+                          data.get("saccadeendpointx", None), data.get("saccadeendpointy", None),
+                          data.get("saccadequality", None), media_offset)
+
+    @classmethod
+    def from_values(cls, saccadeindex, timestamp, saccadeduration, saccadedistance, saccadespeed, saccadeacceleration,
+                    saccadestartpointx, saccadestartpointy, saccadeendpointx, saccadeendpointy, saccadequality=None,
+                    media_offset=(0, 0)):
+        """Returns a Saccade with the given attributes, without the dictionary taken by the constructor
+        """
+        saccade = cls.__new__(cls)
+        saccade._init_values(saccadeindex, timestamp, saccadeduration, saccadedistance, saccadespeed,
+                             saccadeacceleration, saccadestartpointx, saccadestartpointy, saccadeendpointx,
+                             saccadeendpointy, saccadequality, media_offset)
+        return saccade
+
+    def _init_values(self, saccadeindex, timestamp, saccadeduration, saccadedistance, saccadespeed, saccadeacceleration,
+                     saccadestartpointx, saccadestartpointy, saccadeendpointx, saccadeendpointy, saccadequality,
+                     media_offset):
+        self.saccadeindex = saccadeindex
+        self.timestamp = timestamp
+        self.saccadeduration = saccadeduration
+        self.saccadedistance = saccadedistance
+        self.saccadespeed = saccadespeed
+        self.saccadeacceleration = saccadeacceleration
+        self.saccadestartpointx = saccadestartpointx
+        self.saccadestartpointy = saccadestartpointy
+        self.saccadeendpointx = saccadeendpointx
+        self.saccadeendpointy = saccadeendpointy
+        self.saccadequality = saccadequality
         self.segid = None
 
         if self.saccadeduration == 0:
@@ -180,10 +564,13 @@ class Saccade:
         return str(self.saccadeindex)+sep+str(self.timestamp)+sep+str(self.saccadeduration)+sep+str(self.saccadedistance)+sep+str(self.saccadespeed)+sep+str(self.saccadeacceleration)+sep+str(
               self.saccadestartpointx)+sep+str(self.saccadestartpointy)+sep+str(self.saccadeendpointx)+sep+str(self.saccadeendpointy)+sep+str(self.saccadequality)
 
-class Event:
+class Event(_Record):
     """
     A class that holds the information for one Event
     """
+    __slots__ = ('timestamp', 'event', 'eventKey', 'x_coord', 'y_coord', 'key_code', 'key_name', 'description',
+                 'data1', 'data2', 'segid')
+
     def __init__(self, data, media_offset=(0, 0)):
         """Initializes an Event with attributes
 
@@ -193,15 +580,29 @@ class Event:
         Yields:
             an Event object
         """
-
-        self.timestamp = data.get("timestamp", None)
-        self.event = data.get("event", None)
-        self.eventKey = data.get("event_key", None)
-        self.x_coord = data.get("x_coord", None)
-        self.y_coord = data.get("y_coord", None)
-        self.key_code = data.get("key_code", None)
-        self.key_name = data.get("key_name", None)
-        self.description = data.get("description", None)
+        self._init_values(data.get("timestamp", None), data.get("event", None), data.get("event_key", None),
+                          data.get("x_coord", None), data.get("y_coord", None), data.get("key_code", None),
+                          data.get("key_name", None), data.get("description", None), media_offset)
+
+    @classmethod
+    def from_values(cls, timestamp, event, event_key=None, x_coord=None, y_coord=None, key_code=None, key_name=None,
+                    description=None, media_offset=(0, 0)):
+        """Returns an Event with the given attributes, without the dictionary taken by the constructor
+        """
+        event_object = cls.__new__(cls)
+        event_object._init_values(timestamp, event, event_key, x_coord, y_coord, key_code, key_name, description,
+                                  media_offset)
+        return event_object
+
+    def _init_values(self, timestamp, event, event_key, x_coord, y_coord, key_code, key_name, description, media_offset):
+        self.timestamp = timestamp
+        self.event = event
+        self.eventKey = event_key
+        self.x_coord = x_coord
+        self.y_coord = y_coord
+        self.key_code = key_code
+        self.key_name = key_name
+        self.description = description
         self.segid = None
 
         if self.event == "LeftMouseClick" or self.event == "RightMouseClick":
@@ -0,0 +1,309 @@
+"""
+UBC Eye Movement Data Analysis Toolkit (EMDAT), Version 3
+
+Reading of the text files exported by the eye trackers with row parsers (see RowParser).
+Rows are read with csv.reader as lists, and each parser resolves the positions of the columns it
+uses once from the header of the file (see RowParser.compile). Large files are split into line-aligned byte ranges which are parsed in a pool of processes,
+and the data read from each range is stitched back in order (see read_rows). Compressed files are
+decompressed while they are read (see EMDAT_core.compressed_input).
+
+Institution: The University of British Columbia.
+"""
+
+import csv
+import os
+import itertools
+import multiprocessing
+from abc import ABCMeta, abstractmethod
+import params
+from EMDAT_core.compressed_input import open_data_file, is_compressed
+
+
+class RowParser():
+    """Base class of the parsers that read one data stream (e.g., samples, fixations) from the rows of an exported file
+
+    compile(fieldnames) is called with the header of the file before the first row. parse(row) is then called with each
+    row of the file, as a list of strings (see iter_csv_rows), and returns what was read from the row (e.g., a
+    dictionary for a sample, a Fixation) or None.
+    A parser that keeps some state between rows (e.g., the previous pupil size) sets synchronized to True once
+    its state no longer depends on the rows before the last one parsed. This is where a parser can start reading
+    a byte range in the middle of a file without knowing the rows before it.
+
+    Attributes:
+        data: the container in which read_rows collects the data read by the parser
+        synchronized: True if the state of the parser does not depend on the rows before the last one parsed
+    """
+    __metaclass__ = ABCMeta
+
+    def __init__(self):
+        self.data = self.new_data()
+        self.synchronized = False
+
+    def compile(self, fieldnames):
+        """Resolves the positions of the columns used by the parser (see get_column_indices)
+        """
+        pass
+
+    @abstractmethod
+    def parse(self, row):
+        """Reads one row of the file
+
+        Args:
+            row: the row as a list of strings, with None for the missing values of short rows (see iter_csv_rows)
+
+        Returns:
+            what was read from the row (e.g., a dictionary for a sample, a Fixation), or None if the row has no data
+            for this parser
+        """
+        pass
+
+    def new_data(self):
+        """Returns an empty container for the data read by the parser
+        """
+        return []
+
+    def get_data(self):
+        """Returns the data collected in self.data
+        """
+        return self.data
+
+    def join_data(self, parts):
+        """Returns the data read from consecutive parts of a file (as returned by get_data), joined in order
+        """
+        data = []
+        for part in parts:
+            data.extend(part)
+        return data
+
+
+def get_column_indices(fieldnames, names):
+    """Returns the positions of the given columns in the header of a file
+
+    Args:
+        fieldnames: the names of the columns of the file
+        names: the names of the columns to find
+
+    Returns:
+        a list with the position of each column (the last one if a name appears several times in the header)
+    """
+    positions = dict((name, i) for i, name in enumerate(fieldnames))
+    missing = [name for name in names if name not in positions]
+    if missing:
+        raise Exception("Missing column(s) in the data file: " + ", ".join(missing))
+    return [positions[name] for name in names]
+
+
+def iter_csv_rows(reader, fieldnames):
+    """Yields the rows of a csv.reader like csv.DictReader would, but as lists: empty rows are skipped
+    and the missing values of short rows are None
+    """
+    length = len(fieldnames)
+    for row in reader:
+        if len(row) < length:
+            if not row:
+                continue
+            row.extend([None] * (length - len(row)))
+        yield row
+
+
+def read_header(data_file, header_line=1):
+    """Returns a header line of an exported file and the position of the line following it
+
+    Args:
+        data_file: A string containing the name of the file (possibly compressed, see open_data_file)
+        header_line: the number of the header line (1 for the first line)
+
+    Returns:
+        the header line (a string) and the position in bytes of the first line after the header
+    """
+    with open_data_file(data_file) as f:
+        for _ in xrange(header_line - 1):
+            f.readline()
+        line = f.readline()
+        return line, f.tell()
+
+
+def iter_rows(data_file, parser, fieldnames, data_start, delimiter):
+    """Reads the rows of an exported file one at a time and yields what the parser reads from each row
+
+    Args:
+        data_file: A string containing the name of the file
+        parser: a RowParser
+        fieldnames: the names of the columns of the file
+        data_start: the position in bytes of the first row in the file
+        delimiter: the delimiter of the columns
+
+    Yields:
+        the items returned by the parser (e.g., a dictionary for each sample, "Fixation"s)
+    """
+    parser.compile(fieldnames)
+    with open_data_file(data_file) as f:
+        f.seek(data_start)
+        for row in iter_csv_rows(csv.reader(f, delimiter=delimiter), fieldnames):
+            item = parser.parse(row)
+            if item is not None:
+                yield item
+
+
+def read_rows(data_file, parsers, fieldnames, data_start, delimiter):
+    """Reads the rows of an exported file once and feeds each row to all the given parsers.
+
+    Files larger than params.PARALLELPARSINGMINSIZE are split into line-aligned byte ranges which are parsed
+    in params.PARSINGPROCESSES processes. The parsing of each range (except the first one) starts with new
+    parsers, and the rows parsed before a parser is synchronized (see RowParser) are parsed again afterwards
+    by the parser that read the previous range, so that the result is the same as reading the file at once.
+
+    Args:
+        data_file: A string containing the name of the file
+        parsers: a list of RowParsers
+        fieldnames: the names of the columns of the file
+        data_start: the position in bytes of the first row in the file
+        delimiter: the delimiter of the columns
+
+    Returns:
+        a list with the data read by each parser (see RowParser.get_data), in the same order as the parsers
+    """
+    ranges = split_file(data_file, data_start, get_parsing_processes(data_file))
+    tasks = [(data_file, fieldnames, delimiter, start, end, parsers, i == 0) for i, (start, end) in enumerate(ranges)]
+    if len(tasks) == 1:
+        chunks = [parse_range(tasks[0])]
+    else:
+        pool = multiprocessing.Pool(min(len(tasks), get_parsing_processes(data_file)))
+        try:
+            chunks = pool.map(parse_range, tasks)
+        finally:
+            pool.close()
+            pool.join()
+
+    streams = []
+    for i, parser in enumerate(parsers):
+        parts = []
+        carried = None  # the parser that read the previous ranges, with its state at the end of these ranges
+        for prefix, range_parsers, range_data, prefix_lengths in chunks:
+            if prefix_lengths[i] > 0:
+                carried.data = carried.new_data()
+                for row in iter_csv_rows(csv.reader(prefix[:prefix_lengths[i]], delimiter=delimiter), fieldnames):
+                    item = carried.parse(row)
+                    if item is not None:
+                        carried.data.append(item)
+                parts.append(carried.get_data())
+            parts.append(range_data[i])
+            if range_parsers[i].synchronized:
+                carried = range_parsers[i]
+        streams.append(parts[0] if len(parts) == 1 else parser.join_data(parts))
+    return streams
+
+
+def parse_range(task):
+    """Parses the rows in a byte range of a file (run in the processes of the pool used by read_rows)
+
+    Args:
+        task: a tuple (data_file, fieldnames, delimiter, start, end, parsers, is_first). If is_first is True,
+            the parsers are in their initial state for the first row of the file
+
+    Returns:
+        prefix: the lines of the range parsed before all the parsers are synchronized
+        parsers: the parsers, in their state at the end of the range
+        data: the data read by each parser once synchronized
+        prefix_lengths: the number of lines at the beginning of the range which must be parsed again by each parser
+    """
+    data_file, fieldnames, delimiter, start, end, parsers, is_first = task
+    for parser in parsers:
+        parser.compile(fieldnames)
+        parser.synchronized = parser.synchronized or is_first
+    prefix_lengths = [0] * len(parsers)
+    prefix = []
+
+    with open_data_file(data_file) as f:
+        f.seek(start)
+        if is_first and end is None:
+            lines = f
+        else:
+            lines = iter_range_lines(f, start, end, prefix, parsers)
+        reader = csv.reader(lines, delimiter=delimiter)
+        rows = iter_csv_rows(reader, fieldnames)
+        for row in rows:  # until all the parsers are synchronized
+            if all(parser.synchronized for parser in parsers):
+                break
+            for i, parser in enumerate(parsers):
+                synchronized = parser.synchronized
+                item = parser.parse(row)
+                if synchronized:
+                    if item is not None:
+                        parser.data.append(item)
+                elif parser.synchronized:
+                    prefix_lengths[i] = reader.line_num
+        else:
+            row = None
+        if row is not None:
+            collectors = [(parser.parse, parser.data.append) for parser in parsers]
+            for row in itertools.chain([row], rows):
+                for parse, append in collectors:
+                    item = parse(row)
+                    if item is not None:
+                        append(item)
+        for i, parser in enumerate(parsers):
+            if not parser.synchronized:
+                prefix_lengths[i] = reader.line_num
+
+    data = [parser.get_data() for parser in parsers]
+    for parser in parsers:
+        parser.data = None
+    return prefix, parsers, data, prefix_lengths
+
+
+def iter_range_lines(f, start, end, prefix, parsers):
+    """Yields the lines of a file between two positions, and keeps them in prefix until all the parsers are synchronized
+    """
+    position = start
+    while end is None or position < end:
+        line = f.readline()
+        if not line:
+            break
+        position += len(line)
+        if not all(parser.synchronized for parser in parsers):
+            prefix.append(line)
+        yield line
+
+
+def split_file(data_file, data_start, processes):
+    """Splits the rows of a file into line-aligned byte ranges of similar sizes
+
+    Args:
+        data_file: A string containing the name of the file
+        data_start: the position in bytes of the first row in the file
+        processes: the number of processes parsing the file
+
+    Returns:
+        a list of (start, end) tuples, end being None for the last range
+    """
+    size = os.path.getsize(data_file)
+    if processes <= 1 or size < getattr(params, 'PARALLELPARSINGMINSIZE', 0):
+        return [(data_start, None)]
+    if is_compressed(data_file):  # a compressed file can only be read from the beginning
+        return [(data_start, None)]
+
+    number_of_ranges = processes * 4  # more ranges than processes, so that the processes finish at the same time
+    bounds = [data_start]
+    with open(data_file, 'r') as f:
+        for k in xrange(1, number_of_ranges):
+            position = data_start + (size - data_start) * k // number_of_ranges
+            if position <= bounds[-1]:
+                continue
+            f.seek(position - 1)
+            f.readline()  # move to the beginning of the next line
+            position = f.tell()
+            if bounds[-1] < position < size:
+                bounds.append(position)
+    return zip(bounds, bounds[1:] + [None])
+
+
+def get_parsing_processes(data_file):
+    """Returns the number of processes used to parse a file (see params.PARSINGPROCESSES)
+    """
+    if multiprocessing.current_process().daemon:  # a daemonic process (e.g., a worker of a Pool) cannot start new processes
+        return 1
+    processes = getattr(params, 'PARSINGPROCESSES', 1)
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    return max(processes, 1)
@@ -0,0 +1,95 @@
+"""
+UBC Eye Movement Data Analysis Toolkit (EMDAT), Version 3
+
+Planning of the data read from the files exported by the eye trackers. Given the features that will be
+exported, plan_reading works out which data streams (saccades, events) and which optional columns of the
+gaze samples are needed to compute them, so that the readers can skip parsing and storing everything else.
+
+Institution: The University of British Columbia.
+"""
+
+# Columns of the GazeSampleTable that only some features need. The timestamps, validity, fixation indices
+# and stimuli names of the samples are always read, since they are needed to build the "Segment"s.
+OPTIONAL_SAMPLE_COLUMNS = ('pupilsize', 'pupilvelocity', 'distance', 'gazepointx', 'gazepointy')
+
+PUPIL_FEATURES = ('meanpupilsize', 'stddevpupilsize', 'maxpupilsize', 'minpupilsize', 'startpupilsize',
+                  'endpupilsize', 'meanpupilvelocity', 'stddevpupilvelocity', 'maxpupilvelocity', 'minpupilvelocity')
+
+DISTANCE_FEATURES = ('meandistance', 'stddevdistance', 'maxdistance', 'mindistance', 'startdistance', 'enddistance')
+
+SACCADE_FEATURES = ('numsaccades', 'sumsaccadedistance', 'meansaccadedistance', 'stddevsaccadedistance',
+                    'longestsaccadedistance', 'sumsaccadeduration', 'meansaccadeduration', 'stddevsaccadeduration',
+                    'longestsaccadeduration', 'meansaccadespeed', 'stddevsaccadespeed', 'minsaccadespeed',
+                    'maxsaccadespeed', 'fixationsaccadetimeratio')
+
+EVENT_FEATURES = ('numevents', 'numleftclic', 'numrightclic', 'numdoubleclic', 'numkeypressed', 'leftclicrate',
+                  'rightclicrate', 'doubleclicrate', 'keypressedrate', 'timetofirstleftclic', 'timetofirstrightclic',
+                  'timetofirstdoubleclic', 'timetofirstkeypressed', 'timetolastleftclic', 'timetolastrightclic',
+                  'timetolastdoubleclic')
+
+
+class ReadPlan():
+    """The data that the eye tracker readers have to read from the exported files
+
+    Attributes:
+        sample_columns: a frozenset with the names of the optional columns of the gaze samples to read
+            (see OPTIONAL_SAMPLE_COLUMNS). The columns which are not read are left missing (NaN).
+        saccades: True if the "Saccade"s should be read
+        events: True if the "Event"s should be read
+    """
+
+    def __init__(self, sample_columns=OPTIONAL_SAMPLE_COLUMNS, saccades=True, events=True):
+        """Inits ReadPlan class (the default plan reads everything)
+        """
+        self.sample_columns = frozenset(sample_columns)
+        self.saccades = saccades
+        self.events = events
+
+    def get_skipped_sample_columns(self):
+        """Returns a tuple with the names of the optional columns of the gaze samples which are not read
+        """
+        return tuple(name for name in OPTIONAL_SAMPLE_COLUMNS if name not in self.sample_columns)
+
+    def __repr__(self):
+        return "ReadPlan(%r, saccades=%r, events=%r)" % (sorted(self.sample_columns), self.saccades, self.events)
+
+
+def plan_reading(featurelist=None, aoifeaturelist=None, export_pupilinfo=False):
+    """Returns the ReadPlan of the data needed to compute the given features
+
+    Args:
+        featurelist: a list with the names of the Segment/Scene features to be exported,
+            or None for all the features
+        aoifeaturelist: a list with the AOI features to be exported, either as feature names (e.g., 'meanpupilsize')
+            or as labels prefixed with the name of the AOI (e.g., 'Top_meanpupilsize'). None for all the AOI features,
+            an empty list for none of them (see AOI_Stat.get_features)
+        export_pupilinfo: True if the raw pupil data is exported (see Segment)
+
+    Returns:
+        a ReadPlan
+    """
+    pupil = export_pupilinfo or _is_requested(PUPIL_FEATURES, featurelist, aoifeaturelist)
+    distance = _is_requested(DISTANCE_FEATURES, featurelist, aoifeaturelist)
+    sample_columns = []
+    if pupil:
+        sample_columns.extend(['pupilsize', 'pupilvelocity'])
+    if distance:
+        sample_columns.append('distance')
+    if pupil or distance:  # to find the samples inside the "AOI"s, and check the missing pupil sizes and distances
+        sample_columns.extend(['gazepointx', 'gazepointy'])
+    return ReadPlan(sample_columns,
+                    saccades=featurelist is None or any(feature in SACCADE_FEATURES for feature in featurelist),
+                    events=_is_requested(EVENT_FEATURES, featurelist, aoifeaturelist))
+
+
+def _is_requested(features, featurelist, aoifeaturelist):
+    """Returns True if any of the given features is in featurelist or aoifeaturelist (see plan_reading)
+    """
+    if featurelist is None or aoifeaturelist is None:  # all the features, or all the AOI features
+        return True
+    if any(feature in features for feature in featurelist):
+        return True
+    for label in aoifeaturelist:
+        if any(label == feature or label.endswith('_' + feature) for feature in features):
+            return True
+    return False
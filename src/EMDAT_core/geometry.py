@@ -8,6 +8,7 @@ Institution: The University of British Columbia.
 """
 
 import os, sys, math, random
+import numpy as np
 
 
 def euclidean_distance(point1, point2):
@@ -85,3 +86,66 @@ def simpledotproduct(pt1, pt2):
     y2 = float(pt2[1])
 
     return x1*x2 + y1*y2
+
+
+def path_distances(xs, ys):
+    """Returns the Euclidean distances between the consecutive points of a path
+
+    Args:
+        xs, ys: numpy float arrays with the coordinates of the points
+
+    Returns:
+        a numpy array with the len(xs) - 1 distances
+    """
+    dx = np.diff(xs)
+    dy = np.diff(ys)
+    return np.sqrt(dx * dx + dy * dy)
+
+
+def path_abs_angles(xs, ys):
+    """Returns the absolute angles (in radians) between the consecutive moves of a path and the horizontal axis,
+    with the conventions of vector_difference: the absolute value of the angle, and 0 for a horizontal
+    move or no move
+
+    Args:
+        xs, ys: numpy float arrays with the coordinates of the points
+
+    Returns:
+        a numpy array with the len(xs) - 1 angles, between 0 and pi
+    """
+    dx = np.diff(xs)
+    dy = np.diff(ys)
+    # the angle is folded from the first quadrant as in vector_difference (np.arctan2 rounds differently)
+    with np.errstate(divide='ignore', invalid='ignore'): # a vertical move gives atan(inf) = pi/2
+        theta = np.arctan(np.abs(dy) / np.abs(dx))
+    angles = np.where(dx > 0, theta, math.pi - theta)
+    angles[dy == 0] = 0.0
+    return angles
+
+
+def path_rel_angles(xs, ys):
+    """Returns the relative angles (in radians) between the consecutive moves of a path, i.e. the internal
+    angles at the points of the path between the previous and the next point
+
+    The angle is the arc cosine of the dot product of the normalized vectors from the point to the previous
+    and to the next point, which is clamped to [-1, 1] against rounding errors. The angle is 0 if the next
+    or the previous point is the same as the point.
+
+    Args:
+        xs, ys: numpy float arrays with the coordinates of the points
+
+    Returns:
+        a numpy array with the len(xs) - 2 angles, between 0 and pi
+    """
+    if len(xs) < 3:
+        return np.zeros(0)
+    x, y = xs[1:-1], ys[1:-1]
+    v1x, v1y = xs[:-2] - x, ys[:-2] - y
+    v2x, v2y = xs[2:] - x, ys[2:] - y
+    norm1 = np.sqrt(v1x * v1x + v1y * v1y)
+    norm2 = np.sqrt(v2x * v2x + v2y * v2y)
+    with np.errstate(divide='ignore', invalid='ignore'): # zero vectors are handled below
+        dotproduct = (v1x / norm1) * (v2x / norm2) + (v1y / norm1) * (v2y / norm2)
+        angles = np.arccos(np.clip(dotproduct, -1.0, 1.0))
+    angles[(norm1 == 0) | (norm2 == 0)] = 0.0
+    return angles
@@ -8,9 +8,10 @@ Authors: Samad Kardan (creator), Sebastien Lalle.
 Institution: The University of British Columbia.
 """
 
-from EMDAT_core.data_structures import Fixation
+from EMDAT_core.data_structures import Fixation, GazeSampleTable, RecordingView
 import params
 import math
+import numpy as np
 
 
 def point_inside_polygon(x,y,poly):
@@ -45,10 +46,112 @@ def point_inside_polygon(x,y,poly):
 
     return inside
 
+
+class CompiledPolygon():
+    """A polygon prepared for testing many points at once with points_inside_polygon
+
+    Attributes:
+        is_empty: True if the polygon has no vertices
+        min_x, max_x, min_y, max_y: the bounding box of the polygon (None if it is empty)
+        is_rectangle: True if the polygon is a rectangle aligned with the axes
+        is_integer: True if all the coordinates of the vertices are integers
+        edges: a list of the (p1x, p1y, p2x, p2y) edges of the polygon which are not horizontal (horizontal
+            edges are never crossed by the ray of point_inside_polygon)
+    """
+
+    def __init__(self, poly):
+        """Inits CompiledPolygon class
+
+        Args:
+            poly: a list of (x,y) pairs defining the polygon
+        """
+        self.is_empty = len(poly) == 0
+        if self.is_empty:
+            self.min_x = self.max_x = self.min_y = self.max_y = None
+            self.is_rectangle = False
+            self.is_integer = True
+            self.edges = []
+            return
+        xs = [p[0] for p in poly]
+        ys = [p[1] for p in poly]
+        self.min_x, self.max_x = min(xs), max(xs)
+        self.min_y, self.max_y = min(ys), max(ys)
+        self.is_integer = all(isinstance(v, (int, long)) for v in xs + ys)
+        edges = zip(poly, poly[1:] + poly[:1])
+        self.edges = [(p1x, p1y, p2x, p2y) for (p1x, p1y), (p2x, p2y) in edges if p1y != p2y]
+        vertices = poly[:-1] if len(poly) > 1 and tuple(poly[0]) == tuple(poly[-1]) else poly
+        self.is_rectangle = (len(vertices) == 4 and len(set(xs)) == 2 and len(set(ys)) == 2 and
+                             all(p1[0] == p2[0] or p1[1] == p2[1] for p1, p2 in zip(vertices, vertices[1:] + vertices[:1])))
+
+
+_compiled_polygons = {}
+
+
+def compile_polygon(poly):
+    """Returns the CompiledPolygon of a polygon, which is only compiled the first time
+
+    Args:
+        poly: a list of (x,y) pairs defining the polygon
+    """
+    key = repr(poly)  # distinguishes integer and float coordinates
+    compiled = _compiled_polygons.get(key)
+    if compiled is None:
+        compiled = _compiled_polygons[key] = CompiledPolygon(list(poly))
+    return compiled
+
+
+def points_inside_polygon(xs, ys, poly):
+    """Determines which points are inside a given polygon, with the same results as point_inside_polygon
+
+    The points outside the bounding box of the polygon are discarded first. The points of an axis-aligned
+    rectangle are tested against its bounds, and the other points by counting the edges crossed by their ray
+    ("Ray Casting Method"), one edge at a time for all the points.
+
+    Args:
+        xs, ys: numpy arrays with the coordinates of the points
+        poly: a list of (x,y) pairs defining the polygon, or its CompiledPolygon
+
+    Returns:
+        a numpy boolean array indicating whether each point is inside the polygon
+    """
+    if not isinstance(poly, CompiledPolygon):
+        poly = compile_polygon(poly)
+    inside = np.zeros(len(xs), dtype=np.bool_)
+    if poly.is_empty:
+        return inside
+    with np.errstate(invalid='ignore'): # missing coordinates are NaN, and outside
+        if poly.is_rectangle:
+            inside[:] = (xs > poly.min_x) & (xs <= poly.max_x) & (ys > poly.min_y) & (ys <= poly.max_y)
+            return inside
+        candidates = np.flatnonzero((xs >= poly.min_x) & (xs <= poly.max_x) & (ys > poly.min_y) & (ys <= poly.max_y))
+    if len(candidates) == 0:
+        return inside
+    x = xs[candidates]
+    y = ys[candidates]
+    # integers are divided as in point_inside_polygon with Python 2 (floor division)
+    integer = poly.is_integer and y.dtype.kind in 'iu'
+    crossings = np.zeros(len(candidates), dtype=np.bool_)
+    for p1x, p1y, p2x, p2y in poly.edges:
+        crossed = (y > min(p1y, p2y)) & (y <= max(p1y, p2y)) & (x <= max(p1x, p2x))
+        if p1x != p2x:
+            if integer:
+                xinters = (y - p1y) * (p2x - p1x) // (p2y - p1y) + p1x
+            else:
+                xinters = (y - p1y) * (p2x - p1x) / float(p2y - p1y) + p1x
+            crossed &= x <= xinters
+        crossings ^= crossed
+    inside[candidates] = crossings
+    return inside
+
+
 def get_chunk(data, ind, start, end):
     """Returns index of first and last records in data that fall within a time interval (start-end)
+
+    The records are found by binary search in a GazeSampleTable with sorted timestamps, and in a RecordingView
+    with a TimeIndex (see index_by_time). Otherwise data is scanned from ind.
+
     Args:
-        data: a list of subsequent Fixations or Datapoints
+        data: a list (or a RecordingView) of subsequent Fixations or Datapoints, or a GazeSampleTable
         ind: an integer indicating the starting index in data for search, if not known
             should be set to zero.
         start: an integer indicating the start of interval in milliseconds
@@ -63,10 +166,20 @@ def get_chunk(data, ind, start, end):
         end_ind: an integer indicating the index of last record in the list that falls within
             the given time interval
     """
+    if isinstance(data, RecordingView) and data.time_index is not None:
+        chunk = data.time_index.get_chunk(data, ind, start, end)
+        if chunk is not None:
+            return chunk
     datalen = len(data)
     curr_ind = ind
     if curr_ind < datalen:
-        if isinstance(data[curr_ind],Fixation): #if it is a fixation
+        if isinstance(data, GazeSampleTable) and data.has_sorted_timestamps(): # binary search in the timestamp column
+            timestamps = data.timestamp
+            curr_ind = max(curr_ind, int(np.searchsorted(timestamps, start, 'left')))
+            start_ind = curr_ind
+            curr_ind = max(curr_ind, int(np.searchsorted(timestamps, end, 'right')))
+            end_ind = curr_ind - 1
+        elif not isinstance(data, GazeSampleTable) and isinstance(data[curr_ind],Fixation): #if it is a fixation
             if params.INCLUDE_HALF_FIXATIONS:
                 while curr_ind < datalen and data[curr_ind].timestamp < start:
                     curr_ind += 1
@@ -106,6 +219,16 @@ def get_chunk(data, ind, start, end):
                         end_ind = curr_ind -1
                 else:
                     end_ind = curr_ind -1
+        elif isinstance(data, GazeSampleTable): # samples are looked up in the timestamp column
+            timestamps = data.timestamp
+            while curr_ind < datalen and timestamps[curr_ind] < start:
+                curr_ind += 1
+
+            start_ind = curr_ind
+            while curr_ind < datalen and timestamps[curr_ind] <= end:
+                curr_ind += 1
+
+            end_ind = curr_ind -1
         else: # if this is not a Fixation we do not have to worry about half fixations
             while curr_ind < datalen and data[curr_ind].timestamp < start:
                 curr_ind += 1
@@ -122,6 +245,253 @@ def get_chunk(data, ind, start, end):
 
     return curr_ind, start_ind, end_ind
 
+
+def get_chunks(data, starts, ends):
+    """Returns the indices of the first and last records in data that fall within each of the given time intervals,
+    found for all the intervals at once (by a vectorized binary search when get_chunk would use one)
+
+    Args:
+        data: see get_chunk
+        starts: a list with the start of each interval in milliseconds
+        ends: a list with the end of each interval in milliseconds
+
+    Returns:
+        a list with a tuple (start_ind, end_ind) for each interval, as returned by get_chunk(data, 0, start, end)
+    """
+    chunks = None
+    if len(data) > 0 and len(starts) > 0:
+        if isinstance(data, RecordingView) and data.time_index is not None:
+            chunks = data.time_index.get_chunks(data, starts, ends)
+        elif isinstance(data, GazeSampleTable) and data.has_sorted_timestamps():
+            start_inds = np.searchsorted(data.timestamp, starts, 'left')
+            end_inds = np.maximum(start_inds, np.searchsorted(data.timestamp, ends, 'right'))
+            chunks = zip(start_inds.tolist(), end_inds.tolist())
+    if chunks is None:
+        chunks = [get_chunk(data, 0, start, end)[1:] for start, end in zip(starts, ends)]
+    return chunks
+
+
+class TimeIndex():
+    """The times of a list of "Fixation"s, "Saccade"s or "Event"s as numpy arrays, with which get_chunk finds
+    the chunks of a RecordingView of the list by binary search instead of scanning it
+
+    Attributes:
+        timestamps: the timestamps of the items
+        ends: the end times of the fixations (timestamp + duration), None if the items are not all "Fixation"s
+        midpoints: the times of the middle of the fixations (see params.INCLUDE_HALF_FIXATIONS), None if the
+            items are not all "Fixation"s
+        is_sorted: True if the timestamps (and end times of the fixations) are in increasing order, which
+            the binary search needs
+    """
+
+    def __init__(self, data):
+        """Inits TimeIndex class
+
+        Args:
+            data: a list of "Fixation"s, "Saccade"s or "Event"s
+        """
+        self.timestamps = np.array([item.timestamp for item in data])
+        self.ends = None
+        self.midpoints = None
+        if len(data) > 0 and all(isinstance(item, Fixation) and item.fixationduration is not None for item in data):
+            self.ends = np.array([item.timestamp + item.fixationduration for item in data])
+            self.midpoints = np.array([item.timestamp + item.fixationduration/2.0 for item in data])
+        self.is_sorted = self.timestamps.dtype != object and _is_sorted(self.timestamps) and \
+            (self.ends is None or (self.ends.dtype != object and _is_sorted(self.ends)))
+
+    def get_chunk(self, view, ind, start, end):
+        """Returns the same as get_chunk(view, ind, start, end) for a RecordingView of the indexed list,
+        or None if the chunk cannot be found by binary search
+        """
+        datalen = len(view)
+        if not self.is_sorted or ind >= datalen:
+            return None
+        first = view.start
+        timestamps = self.timestamps[first:first + datalen]
+        # first position from ind with a timestamp not before start (the items before ind are not searched)
+        curr_ind = max(ind, int(np.searchsorted(timestamps, start, 'left')))
+        if isinstance(view[ind], Fixation):
+            if self.ends is None:
+                return None
+            ends = self.ends[first:first + datalen]
+            midpoints = self.midpoints[first:first + datalen]
+            if params.INCLUDE_HALF_FIXATIONS:
+                if curr_ind == 0:  # the fixation "before" would be the last one (see get_chunk)
+                    return None
+                if midpoints[curr_ind - 1] > start:  # if the last fixation before, is mostly in this segment
+                    curr_ind -= 1
+            start_ind = curr_ind
+            curr_ind = max(curr_ind, int(np.searchsorted(ends, end, 'right')))
+            if curr_ind == start_ind:   # an empty chunk!
+                end_ind = curr_ind - 1
+            elif midpoints[curr_ind - 1] > end:  # if the last fixation is mostly outside this segment
+                end_ind = curr_ind - 2
+            else:
+                end_ind = curr_ind - 1
+        else:
+            start_ind = curr_ind
+            curr_ind = max(curr_ind, int(np.searchsorted(timestamps, end, 'right')))
+            end_ind = curr_ind - 1
+        return curr_ind, start_ind, end_ind + 1
+
+    def get_chunks(self, view, starts, ends):
+        """Returns the same as get_chunks(view, starts, ends) for a RecordingView of the indexed list,
+        or None if the chunks cannot be found by binary search
+        """
+        datalen = len(view)
+        if not self.is_sorted:
+            return None
+        first = view.start
+        timestamps = self.timestamps[first:first + datalen]
+        starts = np.asarray(starts)
+        ends = np.asarray(ends)
+        curr_inds = np.searchsorted(timestamps, starts, 'left')
+        wrapped = []  # the chunks found by get_chunk (see TimeIndex.get_chunk)
+        if isinstance(view[0], Fixation):
+            if self.ends is None:
+                return None
+            fixation_ends = self.ends[first:first + datalen]
+            midpoints = self.midpoints[first:first + datalen]
+            if params.INCLUDE_HALF_FIXATIONS:
+                wrapped = np.flatnonzero(curr_inds == 0)
+                mostly_in = (curr_inds > 0) & (midpoints[np.maximum(curr_inds - 1, 0)] > starts)
+                curr_inds = curr_inds - mostly_in
+            start_inds = curr_inds
+            curr_inds = np.maximum(curr_inds, np.searchsorted(fixation_ends, ends, 'right'))
+            mostly_out = (curr_inds > start_inds) & (midpoints[np.maximum(curr_inds - 1, 0)] > ends)
+            end_inds = curr_inds - mostly_out
+        else:
+            start_inds = curr_inds
+            end_inds = np.maximum(curr_inds, np.searchsorted(timestamps, ends, 'right'))
+        chunks = zip(start_inds.tolist(), end_inds.tolist())
+        for i in wrapped:
+            chunks[i] = get_chunk(view, 0, starts[i], ends[i])[1:]
+        return chunks
+
+
+def index_by_time(data):
+    """Returns a RecordingView of a whole list of "Fixation"s, "Saccade"s or "Event"s with its TimeIndex, so that
+    get_chunk searches the views of the list by binary search (None if data is None)
+    """
+    if data is None:
+        return None
+    return RecordingView(data, time_index=TimeIndex(data))
+
+
+def _is_sorted(values):
+    return bool(np.all(values[1:] >= values[:-1]))
+
+
+def adjust_pupil_sizes(pupilsizes, rest_pupil_size):
+    """Returns the pupil sizes adjusted with the rest pupil size, as set by params.PUPIL_ADJUSTMENT
+
+    Args:
+        pupilsizes: a numpy array of valid pupil sizes
+        rest_pupil_size: rest pupil size used for the adjustment
+
+    returns:
+        a list of the adjusted pupil sizes
+    """
+    return adjust_pupil_size_array(pupilsizes, rest_pupil_size).tolist()
+
+
+def adjust_pupil_size_array(pupilsizes, rest_pupil_size):
+    """Same as adjust_pupil_sizes, but returns a numpy array
+    """
+    if params.PUPIL_ADJUSTMENT == "rpscenter":
+        return pupilsizes - rest_pupil_size
+    elif params.PUPIL_ADJUSTMENT == "PCPS":
+        return (pupilsizes - rest_pupil_size) / (1.0 * rest_pupil_size)
+    else:
+        return pupilsizes
+
+
+class Moments():
+    """The summary statistics of a series of numbers, from which the sum, mean, standard deviation, minimum, maximum,
+    first and last value of the series are derived. The Moments of consecutive series can be merged into the Moments
+    of their concatenation without going through the values again.
+
+    Attributes:
+        count: the number of values
+        sum: the sum of the values
+        mean: the mean of the values (0 if there are no values)
+        m2: the sum of the squared deviations of the values from their mean
+        min: the smallest value (None if there are no values)
+        max: the largest value (None if there are no values)
+        first: the first value (None if there are no values)
+        last: the last value (None if there are no values)
+    """
+
+    def __init__(self, count=0, sum=0, mean=0, m2=0.0, min=None, max=None, first=None, last=None):
+        """Inits Moments class (the default is the summary of an empty series)
+        """
+        self.count = count
+        self.sum = sum
+        self.mean = mean
+        self.m2 = m2
+        self.min = min
+        self.max = max
+        self.first = first
+        self.last = last
+
+    @classmethod
+    def from_array(cls, values):
+        """Returns the Moments of a numpy array of numbers
+
+        The sums are taken in the order of the values, so that the mean and the standard deviation are the
+        same as the ones returned by mean and stddev for the list of the values.
+        """
+        values_list = values.tolist()
+        count = len(values_list)
+        if count == 0:
+            return cls()
+        total = sum(values_list)
+        m = total / float(count)
+        deviations = values - m
+        return cls(count, total, m, sum((deviations * deviations).tolist()), min(values_list), max(values_list),
+                   values_list[0], values_list[-1])
+
+    @classmethod
+    def from_mask(cls, mask):
+        """Returns the Moments of a numpy boolean array, as a series of 1 (True) and 0 (False) values, computed
+        from the number of True values
+        """
+        count = len(mask)
+        if count == 0:
+            return cls()
+        total = int(np.count_nonzero(mask))
+        m = total / float(count)
+        m2 = total * (1 - m) ** 2 + (count - total) * m ** 2
+        return cls(count, total, m, m2, 0 if total < count else 1, 1 if total > 0 else 0, int(mask[0]), int(mask[-1]))
+
+    @classmethod
+    def merge(cls, moments_list):
+        """Returns the Moments of the concatenation of the series summarized by a list of Moments
+
+        The sums of squared deviations are combined with the pairwise formula of Chan et al.,
+        M2 = sum(M2_i + count_i * (mean_i - mean)**2).
+
+        Args:
+            moments_list: a list of Moments, in the order of their series
+        """
+        moments_list = [moments for moments in moments_list if moments.count > 0]
+        if not moments_list:
+            return cls()
+        count = sum(moments.count for moments in moments_list)
+        total = sum(moments.sum for moments in moments_list)
+        m = total / float(count)
+        m2 = sum(moments.m2 + moments.count * (moments.mean - m) ** 2 for moments in moments_list)
+        return cls(count, total, m, m2, min(moments.min for moments in moments_list),
+                   max(moments.max for moments in moments_list), moments_list[0].first, moments_list[-1].last)
+
+    def get_stddev(self):
+        """Returns the standard deviation of the values, or NAN if it is undefined (as stddev)
+        """
+        if self.count < 2:
+            return float('nan')
+        return math.sqrt(self.m2 / float(self.count - 1))
+
+
 def stddev(data):
     """Returns the standard deviation of a list of numbers
 
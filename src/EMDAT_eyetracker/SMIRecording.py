@@ -8,127 +8,274 @@ Authors: Sebastien Lalle (creator), Mike Wu.
 Institution: The University of British Columbia.
 """
 
-from EMDAT_core.Recording import Recording
-from EMDAT_core.data_structures import Datapoint, Fixation, Saccade, Event
-import EMDAT_core.utils
+from EMDAT_core.Recording import Recording, get_pupil_size, get_pupil_velocity, get_distance
+from EMDAT_core.data_structures import GazeSampleTable, GazeSampleTableBuilder, Fixation, Saccade, Event
+from EMDAT_core.export_parsing import RowParser, get_column_indices, iter_csv_rows, read_header, read_rows, iter_rows
+from EMDAT_core.compressed_input import open_data_file
+from EMDAT_core.utils import cast_int, cast_float
 import csv
+import os
 import params
 
 
 class SMIRecording(Recording):
+    def __init__(self, *args, **kwargs):
+        # streams read in advance from an Events file, by (file, kind), until read_events_file returns them
+        self.pending_event_streams = {}
+        Recording.__init__(self, *args, **kwargs)
+        self.pending_event_streams = {}  # the streams read in advance but then found in the parsed data cache
+
     def read_all_data(self, all_file):
-        all_data = []
-        with open(all_file, 'r') as f:
-            for i in xrange(params.RAW_HEADER_LINE):
-                if i is (params.RAW_HEADER_LINE - 1):  # read the row of the table header for fixations
-                    data_header = next(f).strip().split(',')
-                else:
-                    next(f)
-
-            reader = csv.DictReader(f, fieldnames=data_header)
-            last_pupil_left = -1
-            last_pupil_right = -1
-            last_time = -1
-
-            for row in reader:
-                if row["L Event Info"] != "Fixation":  # ignore data points other than fixations (gaze points)
-                    continue
-                pupil_left = EMDAT_core.utils.cast_float(row["L Pupil Diameter [mm]"])
-                pupil_right = EMDAT_core.utils.cast_float(row["R Pupil Diameter [mm]"])
-                distance_left = EMDAT_core.utils.cast_float(row["L EPOS Z"], -1)
-                distance_right = EMDAT_core.utils.cast_float(row["R EPOS Z"], -1)
-                timestamp = EMDAT_core.utils.cast_int(row["Time"])
-                data = {"timestamp": timestamp,
-                        "pupilsize": EMDAT_core.Recording.get_pupil_size(pupil_left, pupil_right),
-                        "pupilvelocity": EMDAT_core.Recording.get_pupil_velocity(last_pupil_left, last_pupil_right, pupil_left, pupil_right, (timestamp-last_time) ),
-                        "distance": EMDAT_core.Recording.get_distance(distance_left, distance_right),
-                        "is_valid": (EMDAT_core.utils.cast_float(row["L POR X [px]"], -1) > 0 and EMDAT_core.utils.cast_float(row["L POR Y [px]"], -1) > 0 )
-                                              or (EMDAT_core.utils.cast_float(row["R POR X [px]"], -1) > 0 and EMDAT_core.utils.cast_float(row["R POR Y [px]"], -1) > 0),
-                        "stimuliname": "Screen",  # temporarily set to the same stimuli
-                        "is_valid_blink": not ("Blink" in row['L Event Info'] or "Blink" in row['R Event Info']),
-                        "fixationindex": EMDAT_core.utils.cast_int(row["Time"]),
-                        "gazepointxleft": EMDAT_core.utils.cast_float(row["L POR X [px]"]),
-                        "gazepointxlright": EMDAT_core.utils.cast_float(row["R POR X [px]"])}
-                all_data.append(Datapoint(data))
-                last_pupil_left = pupil_left
-                last_pupil_right = pupil_right
-                last_time = timestamp
-
-        return all_data
+        fieldnames, data_start = read_all_data_header(all_file)
+        return read_rows(all_file, [AllDataParser(self.read_plan.get_skipped_sample_columns())], fieldnames, data_start, ',')[0]
+
+    def iter_all_data(self, all_file):
+        fieldnames, data_start = read_all_data_header(all_file)
+        return iter_rows(all_file, AllDataParser(self.read_plan.get_skipped_sample_columns()), fieldnames, data_start, ',')
 
     def read_fixation_data(self, fixation_file):
-        all_fixation = []
-        with open(fixation_file, 'r') as f:
-            for i in xrange(params.EVENTS_FIRST_DATA_LINE - 1):
-                if i is (params.FIXATION_HEADER_LINE - 1):  # read the row of the table header for fixations
-                    fixation_headers = next(f).strip().split(',')
-                else:
-                    next(f)
-            reader = csv.DictReader(f, fieldnames=fixation_headers)
-            for row in reader:
-                if not row["Event Type"].startswith("Fixation "+params.MONOCULAR_EYE):
-                    continue
-                data = {"fixationindex": EMDAT_core.utils.cast_int(row["Number"]),
-                        "timestamp": EMDAT_core.utils.cast_int(row["Start"]),
-                        "fixationduration": EMDAT_core.utils.cast_int(row["Duration"]),
-                        "fixationpointx": EMDAT_core.utils.cast_float(row["Location X"]),
-                        "fixationpointy": EMDAT_core.utils.cast_float(row["Location Y"])}
-                all_fixation.append(Fixation(data, self.media_offset))
-
-        return all_fixation
+        return self.read_events_file(fixation_file, 'fixation')
+
+    def iter_fixations(self, fixation_file):
+        return (item for _, item in iter_events_file(fixation_file, {'fixation': FixationParser(self.media_offset)}))
 
     def read_saccade_data(self, saccade_file):
-        all_saccades = []
-        with open(saccade_file, 'r') as f:
-            for i in xrange(params.EVENTS_FIRST_DATA_LINE - 1):
-                if i is (params.SACCADE_HEADER_LINE - 1):  # read the row of the table header for saccades
-                    saccade_headers = next(f).strip().split(',')
-                else:
-                    next(f)
-            reader = csv.DictReader(f, fieldnames=saccade_headers)
-            for row in reader:
-                if not row["Event Type"].startswith("Saccade "+params.MONOCULAR_EYE):
-                    continue
-                data = {"saccadeindex": EMDAT_core.utils.cast_int(row["Number"]),
-                        "timestamp": EMDAT_core.utils.cast_int(row["Start"]),
-                        "saccadeduration": EMDAT_core.utils.cast_int(row["Duration"]),
-                        "saccadestartpointx": EMDAT_core.utils.cast_float(row["Start Loc.X"]),
-                        "saccadestartpointy": EMDAT_core.utils.cast_float(row["Start Loc.Y"]),
-                        "saccadeendpointx": EMDAT_core.utils.cast_float(row["End Loc.X"]),
-                        "saccadeendpointy": EMDAT_core.utils.cast_float(row["End Loc.Y"]),
-                        "saccadedistance": EMDAT_core.utils.cast_float(row["Average Speed"])*EMDAT_core.utils.cast_float(row["Duration"]),
-                        "saccadespeed": EMDAT_core.utils.cast_float(row["Average Speed"]),
-                        "saccadeacceleration": EMDAT_core.utils.cast_float(row["Average Accel."])
-                        }
-                all_saccades.append(Saccade(data, self.media_offset))
-
-        return all_saccades
+        return self.read_events_file(saccade_file, 'saccade')
+
+    def iter_saccades(self, saccade_file):
+        return (item for _, item in iter_events_file(saccade_file, {'saccade': SaccadeParser(self.media_offset)}))
 
     def read_event_data(self, event_file):
-        all_event = []
-        with open(event_file, 'r') as f:
-            for i in xrange(params.EVENTS_FIRST_DATA_LINE - 1):
-                if i is (params.USER_EVENT_HEADER_LINE - 1):  # read the row of the table header for user events
-                    event_headers = next(f).strip().split(',')
-                else:
-                    next(f)
-            reader = csv.DictReader(f, fieldnames=event_headers)
-            for row in reader:
-                if row["Event Type"] != "UserEvent":
-                    continue
-                data = {"timestamp": EMDAT_core.utils.cast_int(row["Start"]),
-                        "description": row["Description"]}
-                descriptions = row["Description"].split(" ")
-                event_type = descriptions[2]
-                if event_type == "UE-mouseclick":
-                    if descriptions[3] == "left":
-                        data.update({"event": "LeftMouseClick"})
-                    else:
-                        data.update({"event": "RightMouseClick"})
-                    data.update({"x_coord": EMDAT_core.utils.cast_int(descriptions[4].split("=")[1]),
-                                 "y_coord": EMDAT_core.utils.cast_int(descriptions[5].split("=")[1])})
-                elif event_type == "UE-keypress":
-                    data.update({"event": "KeyPress", "key_name": descriptions[3]})
-                all_event.append(Event(data, self.media_offset))
-
-        return all_event
+        return self.read_events_file(event_file, 'event')
+
+    def iter_events(self, event_file):
+        return (item for _, item in iter_events_file(event_file, {'event': UserEventParser(self.media_offset)}))
+
+    def read_events_file(self, events_file, kind):
+        """Returns the "Fixation"s, "Saccade"s or "Event"s read from an Events file exported by BeGaze.
+
+        The fixations, saccades and user events are usually exported in the same file: the file is then scanned
+        once, and the streams read from the same file afterwards by the recording (in the order fixations,
+        saccades, user events) are kept until they are requested.
+
+        Args:
+            events_file: A string containing the name of the Events file
+            kind: the kind of events read ('fixation', 'saccade' or 'event')
+
+        Returns:
+            a list of "Fixation"s, "Saccade"s or "Event"s
+        """
+        if (events_file, kind) not in self.pending_event_streams:
+            order = ['fixation', 'saccade', 'event']
+            files = {'fixation': self.fixation_file, 'saccade': self.saccade_file, 'event': self.event_file}
+            kinds = [kind] + [other for other in order[order.index(kind) + 1:] if files[other] == events_file]
+            parsers = {'fixation': FixationParser, 'saccade': SaccadeParser, 'event': UserEventParser}
+            streams = dict((k, []) for k in kinds)
+            for k, item in iter_events_file(events_file, dict((k, parsers[k](self.media_offset)) for k in kinds)):
+                streams[k].append(item)
+            for k in kinds:
+                self.pending_event_streams[(events_file, k)] = streams[k]
+        return self.pending_event_streams.pop((events_file, kind))
+
+
+def read_all_data_header(all_file):
+    """Returns the names of the columns of a samples file exported by BeGaze and the position of its first row
+    """
+    header, data_start = read_header(all_file, params.RAW_HEADER_LINE)  # the row of the table header for samples
+    return header.strip().split(','), data_start
+
+
+# headers of the Events files already read, by file (see read_events_header)
+_events_headers = {}
+
+
+def read_events_header(events_file):
+    """Returns the names of the columns of the fixations, saccades and user events in an Events file exported
+    by BeGaze, and the position of its first data row. The header lines of a file are only parsed once (until
+    the file or the header parameters in params.py change).
+
+    Returns:
+        a dictionary with the names of the columns of each kind of events ('fixation', 'saccade' and 'event'),
+        and the position in bytes of the first data row
+    """
+    header_lines = (('fixation', params.FIXATION_HEADER_LINE), ('saccade', params.SACCADE_HEADER_LINE),
+                    ('event', params.USER_EVENT_HEADER_LINE))
+    stat = os.stat(events_file)
+    key = (os.path.abspath(events_file), stat.st_size, stat.st_mtime, params.EVENTS_FIRST_DATA_LINE, header_lines)
+    if key not in _events_headers:
+        with open_data_file(events_file) as f:
+            lines = [f.readline() for _ in xrange(params.EVENTS_FIRST_DATA_LINE - 1)]
+            data_start = f.tell()
+        headers = dict((kind, lines[line - 1].strip().split(',')) for kind, line in header_lines)
+        _events_headers[key] = (headers, data_start)
+    return _events_headers[key]
+
+
+def get_event_kind(event_type):
+    """Returns the kind of events of a row of an Events file ('fixation', 'saccade' or 'event') given its
+    Event Type, or None for the other rows (e.g., blinks, or events of the other eye)
+    """
+    if event_type.startswith("Fixation " + params.MONOCULAR_EYE):
+        return 'fixation'
+    if event_type.startswith("Saccade " + params.MONOCULAR_EYE):
+        return 'saccade'
+    if event_type == "UserEvent":
+        return 'event'
+    return None
+
+
+def iter_events_file(events_file, parsers):
+    """Reads the rows of an Events file exported by BeGaze once, and parses each row with the parser of its
+    kind of events (see get_event_kind)
+
+    Args:
+        events_file: A string containing the name of the Events file
+        parsers: a dictionary with the row parser of each kind of events to read (e.g., {'fixation': FixationParser(...)})
+
+    Yields:
+        tuples (kind, item) with the kind of events and the item parsed from each row (e.g., a "Fixation")
+    """
+    headers, data_start = read_events_header(events_file)
+    for kind, parser in parsers.items():
+        parser.compile(headers[kind])
+    event_type = get_column_indices(headers['fixation'], ("Event Type",))[0]
+    row_length = max(len(headers[kind]) for kind in parsers)
+    kinds = {}  # kind of events of each Event Type already seen
+    with open_data_file(events_file) as f:
+        f.seek(data_start)
+        for row in iter_csv_rows(csv.reader(f), [None] * row_length):
+            kind = kinds.get(row[event_type])
+            if kind is None:
+                kind = kinds[row[event_type]] = get_event_kind(row[event_type])
+            if kind in parsers:
+                yield kind, parsers[kind].parse(row)
+
+
+class AllDataParser(RowParser):
+    """Builds the GazeSampleTable of "Datapoint"s from the rows of a samples file exported by BeGaze
+    """
+
+    def __init__(self, skipped_columns=()):
+        """
+        Args:
+            skipped_columns: the names of the optional columns of the samples which are not read (see ReadPlan)
+        """
+        self.skipped_columns = tuple(skipped_columns)
+        RowParser.__init__(self)
+        self.read_pupil = 'pupilsize' not in self.skipped_columns or 'pupilvelocity' not in self.skipped_columns
+        self.read_distance = 'distance' not in self.skipped_columns
+        self.last_pupil_left = -1
+        self.last_pupil_right = -1
+        self.last_time = -1
+
+    def compile(self, fieldnames):
+        (self.left_event_info, self.right_event_info, self.pupil_left, self.pupil_right, self.distance_left,
+         self.distance_right, self.timestamp, self.left_x, self.left_y, self.right_x, self.right_y) = get_column_indices(fieldnames, (
+            "L Event Info", "R Event Info", "L Pupil Diameter [mm]", "R Pupil Diameter [mm]", "L EPOS Z", "R EPOS Z",
+            "Time", "L POR X [px]", "L POR Y [px]", "R POR X [px]", "R POR Y [px]"))
+
+    def parse(self, row):
+        left_event_info = row[self.left_event_info]
+        if left_event_info != "Fixation":  # ignore data points other than fixations (gaze points)
+            return
+        timestamp = cast_int(row[self.timestamp])
+        left_x = cast_float(row[self.left_x])
+        right_x = cast_float(row[self.right_x])
+        data = {"timestamp": timestamp,
+                # -1 and missing coordinates are both invalid
+                "is_valid": (left_x > 0 and cast_float(row[self.left_y]) > 0) or (right_x > 0 and cast_float(row[self.right_y]) > 0),
+                "stimuliname": "Screen",  # temporarily set to the same stimuli
+                "is_valid_blink": not ("Blink" in left_event_info or "Blink" in row[self.right_event_info]),
+                "fixationindex": timestamp,
+                "gazepointxleft": left_x,
+                "gazepointxlright": right_x}
+        if self.read_pupil:
+            pupil_left = cast_float(row[self.pupil_left])
+            pupil_right = cast_float(row[self.pupil_right])
+            data["pupilsize"] = get_pupil_size(pupil_left, pupil_right)
+            data["pupilvelocity"] = get_pupil_velocity(self.last_pupil_left, self.last_pupil_right, pupil_left, pupil_right, (timestamp-self.last_time) )
+            self.last_pupil_left = pupil_left
+            self.last_pupil_right = pupil_right
+            self.last_time = timestamp
+        if self.read_distance:
+            data["distance"] = get_distance(cast_float(row[self.distance_left], -1), cast_float(row[self.distance_right], -1))
+        self.synchronized = True  # the pupil velocity only depends on the previous sample
+        return data
+
+    def new_data(self):
+        return GazeSampleTableBuilder(self.skipped_columns)
+
+    def get_data(self):
+        return self.data.build()
+
+    def join_data(self, parts):
+        return GazeSampleTable.concatenate(parts)
+
+
+class FixationParser(RowParser):
+    """Reads the "Fixation"s from the rows of an Events file exported by BeGaze
+    """
+
+    def __init__(self, media_offset):
+        RowParser.__init__(self)
+        self.media_offset = media_offset
+
+    def compile(self, fieldnames):
+        self.number, self.start, self.duration, self.location_x, self.location_y = get_column_indices(fieldnames, (
+            "Number", "Start", "Duration", "Location X", "Location Y"))
+
+    def parse(self, row):
+        return Fixation.from_values(cast_int(row[self.number]), cast_int(row[self.start]), cast_int(row[self.duration]),
+                                    cast_float(row[self.location_x]), cast_float(row[self.location_y]), self.media_offset)
+
+
+class SaccadeParser(RowParser):
+    """Reads the "Saccade"s from the rows of an Events file exported by BeGaze
+    """
+
+    def __init__(self, media_offset):
+        RowParser.__init__(self)
+        self.media_offset = media_offset
+
+    def compile(self, fieldnames):
+        (self.number, self.start, self.duration, self.start_x, self.start_y, self.end_x, self.end_y,
+         self.average_speed, self.average_acceleration) = get_column_indices(fieldnames, (
+            "Number", "Start", "Duration", "Start Loc.X", "Start Loc.Y", "End Loc.X", "End Loc.Y", "Average Speed",
+            "Average Accel."))
+
+    def parse(self, row):
+        speed = cast_float(row[self.average_speed])
+        return Saccade.from_values(cast_int(row[self.number]), cast_int(row[self.start]), cast_int(row[self.duration]),
+                                   speed*cast_float(row[self.duration]), speed,
+                                   cast_float(row[self.average_acceleration]),
+                                   cast_float(row[self.start_x]), cast_float(row[self.start_y]),
+                                   cast_float(row[self.end_x]), cast_float(row[self.end_y]),
+                                   media_offset=self.media_offset)
+
+
+class UserEventParser(RowParser):
+    """Reads the "Event"s from the rows of the user events of an Events file exported by BeGaze
+    """
+
+    def __init__(self, media_offset):
+        RowParser.__init__(self)
+        self.media_offset = media_offset
+
+    def compile(self, fieldnames):
+        self.start, self.description = get_column_indices(fieldnames, ("Start", "Description"))
+
+    def parse(self, row):
+        data = {"timestamp": cast_int(row[self.start]),
+                "description": row[self.description]}
+        descriptions = row[self.description].split(" ")
+        event_type = descriptions[2]
+        if event_type == "UE-mouseclick":
+            if descriptions[3] == "left":
+                data.update({"event": "LeftMouseClick"})
+            else:
+                data.update({"event": "RightMouseClick"})
+            data.update({"x_coord": cast_int(descriptions[4].split("=")[1]),
+                         "y_coord": cast_int(descriptions[5].split("=")[1])})
+        elif event_type == "UE-keypress":
+            data.update({"event": "KeyPress", "key_name": descriptions[3]})
+        return Event(data, self.media_offset)
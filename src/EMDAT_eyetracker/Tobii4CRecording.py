@@ -9,59 +9,76 @@ Institution: The University of British Columbia.
 """
 
 from EMDAT_core.Recording import Recording
-from EMDAT_core.data_structures import Datapoint, Fixation, Saccade, Event
+from EMDAT_core.data_structures import GazeSampleTableBuilder, Fixation, Saccade, Event
+from EMDAT_core.export_parsing import get_column_indices, iter_csv_rows
+from EMDAT_core.compressed_input import open_data_file
 import EMDAT_core.utils
 import csv
 import params
 import numpy as np
+from warnings import warn
 
 
 class Tobii4CRecording(Recording):
     def read_all_data(self, all_file):
-        """Returns a list of "Datapoint"s read from an data file.
+        """Returns a GazeSampleTable with the "Datapoint"s read from an data file.
 
         Args:
             all_file:A string containing the name of the data file output by the Tobii software.
 
         Returns:
-            a list of "Datapoint"s
+            a GazeSampleTable
         """
-        all_data = []
-        with open(all_file, 'r') as f:
-            reader = csv.DictReader(f, delimiter=";")
+        all_data = GazeSampleTableBuilder(self.read_plan.get_skipped_sample_columns())
+        for data in self.iter_all_data(all_file):
+            all_data.append(data)
+        return all_data.build()
+
+    def iter_all_data(self, all_file):
+        """Iterates over the samples of a data file, without keeping them in memory.
+
+        Args:
+            all_file:A string containing the name of the data file output by the Tobii software.
+
+        Yields:
+            a dictionary with the attributes of each sample, as accepted by GazeSampleTableBuilder.append
+        """
+        with open_data_file(all_file) as f:
+            reader = csv.reader(f, delimiter=";")
+            fieldnames = next(reader)
+            (left_validity, right_validity, left_gaze_point, right_gaze_point, left_pupil_diameter, right_pupil_diameter,
+             system_time_stamp) = get_column_indices(fieldnames, (
+                "left_gaze_origin_validity", "right_gaze_origin_validity", "left_gaze_point_on_display_area",
+                "right_gaze_point_on_display_area", "left_pupil_diameter", "right_pupil_diameter", "system_time_stamp"))
+            skipped_columns = self.read_plan.get_skipped_sample_columns()
+            read_pupil = 'pupilsize' not in skipped_columns or 'pupilvelocity' not in skipped_columns
+            read_gaze = 'gazepointx' not in skipped_columns or 'gazepointy' not in skipped_columns
             last_pupil_left = -1
             last_pupil_right = -1
             last_time = -1
             currentfix = 0
-            for row in reader:
-                if not row["left_gaze_origin_validity"] or not row["right_gaze_origin_validity"]: #ignore data point with no validity information
+            for row in iter_csv_rows(reader, fieldnames):
+                if not row[left_validity] or not row[right_validity]: #ignore data point with no validity information
                     continue
-                right_gaze = list(map(lambda point: EMDAT_core.utils.cast_float(point, -1),
-                                      row["right_gaze_point_on_display_area"].strip("()").split(",")))
-                left_gaze = list(map(lambda point: EMDAT_core.utils.cast_float(point, -1),
-                                     row["left_gaze_point_on_display_area"].strip("()").split(",")))
-                gaze_point_x = EMDAT_core.utils.cast_float((left_gaze[0] + right_gaze[0])/2, -1)
-                gaze_point_y = EMDAT_core.utils.cast_float((left_gaze[1] + right_gaze[1])/2, -1)
-                pupil_left = EMDAT_core.utils.cast_float(row["left_pupil_diameter"], -1)
-                pupil_right = EMDAT_core.utils.cast_float(row["right_pupil_diameter"], -1)
-                timestamp = EMDAT_core.utils.cast_int(EMDAT_core.utils.cast_float(row["system_time_stamp"]))
+                timestamp = EMDAT_core.utils.cast_int(EMDAT_core.utils.cast_float(row[system_time_stamp]))
                 data = {"timestamp": timestamp,
-                        "pupilsize": EMDAT_core.Recording.get_pupil_size(pupil_left, pupil_right),
-                        "pupilvelocity": EMDAT_core.Recording.get_pupil_velocity(last_pupil_left, last_pupil_right, pupil_left, pupil_right, (timestamp-last_time) ),
                         "distance": -1,
-                        "is_valid": EMDAT_core.utils.cast_int(row["right_gaze_origin_validity"]) == 1 or EMDAT_core.utils.cast_int(row["left_gaze_origin_validity"]) == 1,
-                        "is_valid_blink": EMDAT_core.utils.cast_int(row["right_gaze_origin_validity"]) == 1 and EMDAT_core.utils.cast_int(row["left_gaze_origin_validity"]) == 1,
-                        "fixationindex": currentfix,
-                        "gazepointx": gaze_point_x,
-                        "gazepointy": gaze_point_y}
-                all_data.append(Datapoint(data))
-                last_pupil_left = pupil_left
-                last_pupil_right = pupil_right
-                last_time = timestamp
+                        "is_valid": EMDAT_core.utils.cast_int(row[right_validity]) == 1 or EMDAT_core.utils.cast_int(row[left_validity]) == 1,
+                        "is_valid_blink": EMDAT_core.utils.cast_int(row[right_validity]) == 1 and EMDAT_core.utils.cast_int(row[left_validity]) == 1,
+                        "fixationindex": currentfix}
+                if read_pupil:
+                    pupil_left = EMDAT_core.utils.cast_float(row[left_pupil_diameter], -1)
+                    pupil_right = EMDAT_core.utils.cast_float(row[right_pupil_diameter], -1)
+                    data["pupilsize"] = EMDAT_core.Recording.get_pupil_size(pupil_left, pupil_right)
+                    data["pupilvelocity"] = EMDAT_core.Recording.get_pupil_velocity(last_pupil_left, last_pupil_right, pupil_left, pupil_right, (timestamp-last_time) )
+                    last_pupil_left = pupil_left
+                    last_pupil_right = pupil_right
+                    last_time = timestamp
+                if read_gaze:
+                    data["gazepointx"], data["gazepointy"] = get_gaze_point(row[left_gaze_point], row[right_gaze_point])
+                yield data
                 currentfix += 1
 
-        return all_data
-
     def read_fixation_data(self, fixation_file):
         """Returns a list of "Fixation"s read from the data file file.
 
@@ -71,91 +88,155 @@ class Tobii4CRecording(Recording):
         Returns:
             a list of "Fixation"s
         """
+        return list(self.iter_fixations(fixation_file))
 
-        all_fixation = []
-        with open(fixation_file, 'r') as f:
+    def iter_fixations(self, fixation_file):
+        """Iterates over the "Fixation"s of a data file, without keeping them in memory.
+
+        Args:
+            fixation_file: A string containing the name of the data file output by the Tobii software.
+
+        Yields:
+            "Fixation"s
+        """
+        with open_data_file(fixation_file) as f:
             currentfix = 0
-            reader = csv.DictReader(f, delimiter=',')
-            for row in reader:
-                if row["label"] != "fixation": #if not a fixation or the current fixation
+            reader = csv.reader(f, delimiter=',')
+            fieldnames = next(reader)
+            label, start, duration, x, y = get_column_indices(fieldnames, ("label", "start", "duration", "x", "y"))
+            for row in iter_csv_rows(reader, fieldnames):
+                if row[label] != "fixation": #if not a fixation or the current fixation
                     continue
                 data = {"fixationindex": currentfix,
-                        "timestamp": EMDAT_core.utils.cast_int(EMDAT_core.utils.cast_float(row["start"])),
-                        "fixationduration": EMDAT_core.utils.cast_int(EMDAT_core.utils.cast_float(row["duration"])),
-                        "fixationpointx": EMDAT_core.utils.cast_float(row["x"]),
-                        "fixationpointy": EMDAT_core.utils.cast_float(row["y"])}
-                all_fixation.append(Fixation(data, self.media_offset))
+                        "timestamp": EMDAT_core.utils.cast_int(EMDAT_core.utils.cast_float(row[start])),
+                        "fixationduration": EMDAT_core.utils.cast_int(EMDAT_core.utils.cast_float(row[duration])),
+                        "fixationpointx": EMDAT_core.utils.cast_float(row[x]),
+                        "fixationpointy": EMDAT_core.utils.cast_float(row[y])}
+                yield Fixation(data, self.media_offset)
                 currentfix += 1
 
-        return all_fixation
-
     def read_saccade_data(self, saccade_file, all_file):
         """Returns a list of "Saccade"s read from the data file file.
 
         Args:
             saccade_file: A string containing the name of the data file output by the Tobii software.
+            all_file: A string containing the name of the raw gaze data file, used to find the gaze samples of each saccade
 
         Returns:
             a list of "Saccade"s
         """
 
+        timestamps, gaze_x, gaze_y, is_valid = read_gaze_samples(all_file)
+
+        saccade_rows = []
+        with open_data_file(saccade_file) as f:
+            reader = csv.reader(f, delimiter=',')
+            fieldnames = next(reader)
+            label, start, end, duration = get_column_indices(fieldnames, ("label", "start", "end", "duration"))
+            for row in iter_csv_rows(reader, fieldnames):
+                if row[label] == "saccade":
+                    saccade_rows.append(row)
+        if len(saccade_rows) == 0:
+            return []
+
+        # gaze samples of each saccade: samples_start[k] <= sample index < samples_end[k]
+        starts = np.array([EMDAT_core.utils.cast_float(row[start]) for row in saccade_rows])
+        ends = np.array([EMDAT_core.utils.cast_float(row[end]) for row in saccade_rows])
+        samples_start = np.searchsorted(timestamps, starts, side='left')
+        samples_end = np.searchsorted(timestamps, ends, side='right')
+        nb_samples = samples_end - samples_start
+
+        # distance travelled by the gaze during each saccade, as a sum of the distances between consecutive samples
+        steps = np.zeros(len(timestamps))
+        steps[:-1] = np.sqrt(np.diff(gaze_x) ** 2 + np.diff(gaze_y) ** 2)
+        bounds = np.empty(2 * len(saccade_rows), dtype=np.intp)
+        bounds[0::2] = np.minimum(samples_start, len(steps) - 1)
+        bounds[1::2] = np.minimum(np.maximum(samples_end - 1, 0), len(steps) - 1)
+        distances = np.where(nb_samples > 1, np.add.reduceat(steps, bounds)[0::2], 0.0)
+
+        valid_cumsum = np.concatenate(([0], np.cumsum(is_valid)))
+        nb_valid_samples = valid_cumsum[samples_end] - valid_cumsum[samples_start]
+
         all_saccade = []
-        with open(all_file, 'r') as all_data:
-            all_reader = list(csv.DictReader(all_data, delimiter=';'))
-
-            with open(saccade_file, 'r') as f:
-                reader = list(csv.DictReader(f, delimiter=','))
-                current_index = 0
-
-                for row in reader:
-                    if row["label"] == "saccade":
-                        start = EMDAT_core.utils.cast_float(row["start"])
-                        end = EMDAT_core.utils.cast_float(row["end"])
-                        # search for start
-                        saccade_vect = []
-                        is_valid_sample = 0
-
-                        # iterate through all_reader with loop
-                        i = np.searchsorted(list(map(lambda all_data_row: EMDAT_core.utils.cast_float(all_data_row["system_time_stamp"]), all_reader)), start)
-                        i_start = i
-                        while EMDAT_core.utils.cast_float(all_reader[i]["system_time_stamp"]) <= end:
-                            right_gaze = list(map(lambda point: EMDAT_core.utils.cast_float(point, -1),
-                                                  all_reader[i]["right_gaze_point_on_display_area"].strip("()").split(",")))
-                            left_gaze = list(map(lambda point: EMDAT_core.utils.cast_float(point, -1),
-                                                 all_reader[i]["left_gaze_point_on_display_area"].strip("()").split(",")))
-                            gaze_point_x = EMDAT_core.utils.cast_float((left_gaze[0] + right_gaze[0])/2, -1)
-                            gaze_point_y = EMDAT_core.utils.cast_float((left_gaze[1] + right_gaze[1])/2, -1)
-                            saccade_vect.append([EMDAT_core.utils.cast_float(all_reader[i]["system_time_stamp"]),
-                                                 gaze_point_x, gaze_point_y])
-
-                            if EMDAT_core.utils.cast_int(all_reader[i]["right_gaze_origin_validity"]) == 1 or \
-                                    EMDAT_core.utils.cast_int(all_reader[i]["left_gaze_origin_validity"]) == 1:
-                                is_valid_sample += 1
-                            i += 1
-
-                        rate_valid_sample = is_valid_sample/(i - i_start)
-                        saccade_duration = EMDAT_core.utils.cast_int(EMDAT_core.utils.cast_float(row["duration"]))
-                        dist = EMDAT_core.Recording.get_saccade_distance(saccade_vect)
-                        accel = -1#Recording.get_saccade_acceleration(saccade_vect)
-                        speed = float(dist) / EMDAT_core.utils.cast_int(saccade_duration)
-                        data = {"saccadeindex": EMDAT_core.utils.cast_int(current_index),
-                                "timestamp": start,
-                                "saccadeduration": EMDAT_core.utils.cast_int(saccade_duration),
-                                "saccadestartpointx": saccade_vect[0][1],
-                                "saccadestartpointy": saccade_vect[0][2],
-                                "saccadeendpointx": saccade_vect[-1][1],
-                                "saccadeendpointy": saccade_vect[-1][2],
-                                "saccadedistance": dist,
-                                "saccadespeed": speed,
-                                "saccadeacceleration": accel,
-                                "saccadequality": rate_valid_sample
-                                }
-                        all_saccade.append(Saccade(data, self.media_offset))
-                        current_index += 1
+        current_index = 0
+        for k, row in enumerate(saccade_rows):
+            if nb_samples[k] <= 0:
+                warn("A saccade with no gaze sample. Start=" + str(starts[k]))
+                continue
+            first, last = samples_start[k], samples_end[k] - 1
+            rate_valid_sample = float(nb_valid_samples[k]) / nb_samples[k]
+            saccade_duration = EMDAT_core.utils.cast_int(EMDAT_core.utils.cast_float(row[duration]))
+            dist = float(distances[k])
+            accel = -1#Recording.get_saccade_acceleration(saccade_vect)
+            speed = dist / EMDAT_core.utils.cast_int(saccade_duration)
+            data = {"saccadeindex": EMDAT_core.utils.cast_int(current_index),
+                    "timestamp": starts[k].item(),
+                    "saccadeduration": EMDAT_core.utils.cast_int(saccade_duration),
+                    "saccadestartpointx": gaze_x[first].item(),
+                    "saccadestartpointy": gaze_y[first].item(),
+                    "saccadeendpointx": gaze_x[last].item(),
+                    "saccadeendpointy": gaze_y[last].item(),
+                    "saccadedistance": dist,
+                    "saccadespeed": speed,
+                    "saccadeacceleration": accel,
+                    "saccadequality": rate_valid_sample
+                    }
+            all_saccade.append(Saccade(data, self.media_offset))
+            current_index += 1
 
         return all_saccade
 
 
+def read_gaze_samples(all_file):
+    """Reads the timestamp, gaze coordinates and validity of all the samples of a raw data file output by the Tobii software.
+
+    Args:
+        all_file: A string containing the name of the raw gaze data file
+
+    Returns:
+        four numpy arrays with, for each sample, the timestamp, the x and y gaze coordinates
+        (average of both eyes) and whether at least one eye is valid
+    """
+    timestamps = []
+    gaze_x = []
+    gaze_y = []
+    is_valid = []
+    with open_data_file(all_file) as f:
+        reader = csv.reader(f, delimiter=';')
+        fieldnames = next(reader)
+        left_gaze_point, right_gaze_point, system_time_stamp, left_validity, right_validity = get_column_indices(fieldnames, (
+            "left_gaze_point_on_display_area", "right_gaze_point_on_display_area", "system_time_stamp",
+            "left_gaze_origin_validity", "right_gaze_origin_validity"))
+        for row in iter_csv_rows(reader, fieldnames):
+            if not row[left_gaze_point] or not row[right_gaze_point]: #ignore incomplete rows
+                continue
+            gaze_point_x, gaze_point_y = get_gaze_point(row[left_gaze_point], row[right_gaze_point])
+            timestamps.append(EMDAT_core.utils.cast_float(row[system_time_stamp]))
+            gaze_x.append(gaze_point_x)
+            gaze_y.append(gaze_point_y)
+            is_valid.append(EMDAT_core.utils.cast_int(row[right_validity]) == 1 or
+                            EMDAT_core.utils.cast_int(row[left_validity]) == 1)
+
+    return (np.array(timestamps, dtype=np.float64), np.array(gaze_x, dtype=np.float64),
+            np.array(gaze_y, dtype=np.float64), np.array(is_valid, dtype=np.bool_))
+
+
+def get_gaze_point(left_gaze_point, right_gaze_point):
+    """Returns the gaze point on the display (average of both eyes) of a row of raw gaze data
+
+    Args:
+        left_gaze_point: the "left_gaze_point_on_display_area" value of the row, e.g. "(0.5, 0.5)"
+        right_gaze_point: the "right_gaze_point_on_display_area" value of the row
+    """
+    right_gaze = list(map(lambda point: EMDAT_core.utils.cast_float(point, -1),
+                          right_gaze_point.strip("()").split(",")))
+    left_gaze = list(map(lambda point: EMDAT_core.utils.cast_float(point, -1),
+                         left_gaze_point.strip("()").split(",")))
+    gaze_point_x = EMDAT_core.utils.cast_float((left_gaze[0] + right_gaze[0])/2, -1)
+    gaze_point_y = EMDAT_core.utils.cast_float((left_gaze[1] + right_gaze[1])/2, -1)
+    return gaze_point_x, gaze_point_y
+
+
 # for testing purposes:
 if __name__ == "__main__":
 
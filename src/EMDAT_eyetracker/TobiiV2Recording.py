@@ -9,7 +9,9 @@ Institution: The University of British Columbia.
 """
 
 from EMDAT_core.Recording import *
-from EMDAT_core.data_structures import Datapoint, Fixation, Saccade, Event
+from EMDAT_core.data_structures import GazeSampleTableBuilder, Fixation, Saccade, Event
+from EMDAT_core.export_parsing import get_column_indices, iter_csv_rows
+from EMDAT_core.compressed_input import open_data_file
 from EMDAT_core.utils import *
 import csv
 import params
@@ -17,46 +19,67 @@ import params
 
 class TobiiV2Recording(Recording):
     def read_all_data(self, all_file):
-        """Returns a list of "Datapoint"s read from an "All-Data" file.
+        """Returns a GazeSampleTable with the "Datapoint"s read from an "All-Data" file.
 
         Args:
             all_file:A string containing the name of the 'All-Data.tsv' file output by the Tobii software.
 
         Returns:
-            a list of "Datapoint"s
+            a GazeSampleTable
         """
-        all_data = []
-        with open(all_file, 'r') as f:
+        all_data = GazeSampleTableBuilder(self.read_plan.get_skipped_sample_columns())
+        for data in self.iter_all_data(all_file):
+            all_data.append(data)
+        return all_data.build()
+
+    def iter_all_data(self, all_file):
+        """Iterates over the samples of an "All-Data" file, without keeping them in memory.
+
+        Args:
+            all_file:A string containing the name of the 'All-Data.tsv' file output by the Tobii software.
+
+        Yields:
+            a dictionary with the attributes of each sample, as accepted by GazeSampleTableBuilder.append
+        """
+        with open_data_file(all_file) as f:
             for _ in xrange(params.ALLDATAHEADERLINES + params.NUMBEROFEXTRAHEADERLINES - 1):
                 next(f)
-            reader = csv.DictReader(f, delimiter="\t")
+            reader = csv.reader(f, delimiter="\t")
+            fieldnames = next(reader)
+            (number, pupil_left_column, pupil_right_column, distance_left_column, distance_right_column, timestamp_column,
+             validity_left, validity_right, stimuli_name, fixation_index, gaze_x_left) = get_column_indices(fieldnames, (
+                "Number", "PupilLeft", "PupilRight", "DistanceLeft", "DistanceRight", "Timestamp",
+                "ValidityLeft", "ValidityRight", "StimuliName", "FixationIndex", "GazePointXLeft"))
+            skipped_columns = self.read_plan.get_skipped_sample_columns()
+            read_pupil = 'pupilsize' not in skipped_columns or 'pupilvelocity' not in skipped_columns
+            read_distance = 'distance' not in skipped_columns
             last_pupil_left = -1
             last_pupil_right = -1
             last_time = -1
 
-            for row in reader:
-                if not row["Number"]:  # ignore invalid data point
+            for row in iter_csv_rows(reader, fieldnames):
+                if not row[number]:  # ignore invalid data point
                     continue
-                pupil_left = cast_float(row["PupilLeft"], -1)
-                pupil_right = cast_float(row["PupilRight"], -1)
-                distance_left = cast_float(row["DistanceLeft"], -1)
-                distance_right = cast_float(row["DistanceRight"], -1)
-                timestamp = cast_int(row["Timestamp"])
+                timestamp = cast_int(row[timestamp_column])
+                validity_left_value = cast_int(row[validity_left])
+                validity_right_value = cast_int(row[validity_right])
                 data = {"timestamp": timestamp,
-                        "pupilsize": get_pupil_size(pupil_left, pupil_right),
-                        "pupilvelocity": get_pupil_velocity(last_pupil_left, last_pupil_right, pupil_left, pupil_right, (timestamp-last_time) ),
-                        "distance": get_distance(distance_left, distance_right),
-                        "is_valid": cast_int(row["ValidityRight"]) < 2 or cast_int(row["ValidityLeft"]) < 2,
-                        "is_valid_blink": cast_int(row["ValidityRight"]) < 2 and cast_int(row["ValidityLeft"]) < 2,
-                        "stimuliname": row["StimuliName"],
-                        "fixationindex": cast_int(row["FixationIndex"]),
-                        "gazepointxleft": cast_float(row["GazePointXLeft"])}
-                all_data.append(Datapoint(data))
-                last_pupil_left = pupil_left
-                last_pupil_right = pupil_right
-                last_time = timestamp
-
-        return all_data
+                        "is_valid": validity_right_value < 2 or validity_left_value < 2,
+                        "is_valid_blink": validity_right_value < 2 and validity_left_value < 2,
+                        "stimuliname": row[stimuli_name],
+                        "fixationindex": cast_int(row[fixation_index]),
+                        "gazepointxleft": cast_float(row[gaze_x_left])}
+                if read_pupil:
+                    pupil_left = cast_float(row[pupil_left_column], -1)
+                    pupil_right = cast_float(row[pupil_right_column], -1)
+                    data["pupilsize"] = get_pupil_size(pupil_left, pupil_right)
+                    data["pupilvelocity"] = get_pupil_velocity(last_pupil_left, last_pupil_right, pupil_left, pupil_right, (timestamp-last_time) )
+                    last_pupil_left = pupil_left
+                    last_pupil_right = pupil_right
+                    last_time = timestamp
+                if read_distance:
+                    data["distance"] = get_distance(cast_float(row[distance_left_column], -1), cast_float(row[distance_right_column], -1))
+                yield data
 
     def read_fixation_data(self, fixation_file):
         """Returns a list of "Fixation"s read from an "Fixation-Data" file.
@@ -67,21 +90,31 @@ class TobiiV2Recording(Recording):
         Returns:
             a list of "Fixation"s
         """
+        return list(self.iter_fixations(fixation_file))
+
+    def iter_fixations(self, fixation_file):
+        """Iterates over the "Fixation"s of an "Fixation-Data" file, without keeping them in memory.
+
+        Args:
+            fixation_file: A string containing the name of the 'Fixation-Data.tsv' file output by the Tobii software.
 
-        all_fixation = []
-        with open(fixation_file, 'r') as f:
+        Yields:
+            "Fixation"s
+        """
+        with open_data_file(fixation_file) as f:
             for _ in xrange(params.FIXATIONHEADERLINES - 1):
                 next(f)
-            reader = csv.DictReader(f, delimiter='\t')
-            for row in reader:
-                data = {"fixationindex": cast_int(row["FixationIndex"]),
-                        "timestamp": cast_int(row["Timestamp"]),
-                        "fixationduration": cast_int(row["FixationDuration"]),
-                        "fixationpointx": cast_int(row["MappedFixationPointX"]),
-                        "fixationpointy": cast_int(row["MappedFixationPointY"])}
-                all_fixation.append(Fixation(data, self.media_offset))
-
-        return all_fixation
+            reader = csv.reader(f, delimiter='\t')
+            fieldnames = next(reader)
+            fixation_index, timestamp, duration, fixation_x, fixation_y = get_column_indices(fieldnames, (
+                "FixationIndex", "Timestamp", "FixationDuration", "MappedFixationPointX", "MappedFixationPointY"))
+            for row in iter_csv_rows(reader, fieldnames):
+                data = {"fixationindex": cast_int(row[fixation_index]),
+                        "timestamp": cast_int(row[timestamp]),
+                        "fixationduration": cast_int(row[duration]),
+                        "fixationpointx": cast_int(row[fixation_x]),
+                        "fixationpointy": cast_int(row[fixation_y])}
+                yield Fixation(data, self.media_offset)
 
     def read_event_data(self, event_file):
         """Returns a list of "Event"s read from an "Event-Data" file.
@@ -92,25 +125,35 @@ class TobiiV2Recording(Recording):
         Returns:
             a list of "Event"s
         """
+        return list(self.iter_events(event_file))
 
-        all_event = []
-        with open(event_file, 'r') as f:
+    def iter_events(self, event_file):
+        """Iterates over the "Event"s of an "Event-Data" file, without keeping them in memory.
+
+        Args:
+            event_file: A string containing the name of the 'Event-Data.tsv' file output by the Tobii software.
+
+        Yields:
+            "Event"s
+        """
+        with open_data_file(event_file) as f:
             for _ in xrange(params.EVENTSHEADERLINES - 1):
                 next(f)
-            reader = csv.DictReader(f, delimiter='\t')
-            for row in reader:
-                data = {"timestamp": cast_int(row["Timestamp"]),
-                        "event": row["Event"],
-                        "event_key": cast_int(row["EventKey"])}
+            reader = csv.reader(f, delimiter='\t')
+            fieldnames = next(reader)
+            timestamp, event, event_key, data1, data2, descriptor = get_column_indices(fieldnames, (
+                "Timestamp", "Event", "EventKey", "Data1", "Data2", "Descriptor"))
+            for row in iter_csv_rows(reader, fieldnames):
+                data = {"timestamp": cast_int(row[timestamp]),
+                        "event": row[event],
+                        "event_key": cast_int(row[event_key])}
                 if data["event"] == "LeftMouseClick" or data["event"] == "RightMouseClick":
-                    data.update({"x_coord": cast_int(row["Data1"]), "y_coord": cast_int(row["Data2"])})
+                    data.update({"x_coord": cast_int(row[data1]), "y_coord": cast_int(row[data2])})
                 elif data["event"] == "KeyPress":
-                    data.update({"key_code": cast_int(row["Data1"]), "key_name": row["Descriptor"]})
+                    data.update({"key_code": cast_int(row[data1]), "key_name": row[descriptor]})
                 elif data["event"] == "LogData":
-                    data.update({"description": row["Data1"]})
-                all_event.append(Event(data, self.media_offset))
-
-        return all_event
+                    data.update({"description": row[data1]})
+                yield Event(data, self.media_offset)
 
     def read_saccade_data(self, saccade_file):
         """ no saccade in data exported from Tobii Studio V1-V2
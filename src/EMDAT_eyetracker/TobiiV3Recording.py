@@ -8,60 +8,29 @@ Authors: Mike Wu (creator), Sebastien Lalle.
 Institution: The University of British Columbia.
 """
 
-from EMDAT_core.Recording import Recording
-from EMDAT_core.data_structures import Datapoint, Fixation, Saccade, Event
-import EMDAT_core.utils
+from EMDAT_core.Recording import Recording, get_pupil_size, get_pupil_velocity, get_distance, get_saccade_distance
+from EMDAT_core.data_structures import GazeSampleTable, GazeSampleTableBuilder, Fixation, Saccade, Event
+from EMDAT_core.export_parsing import RowParser, get_column_indices, read_header, read_rows, iter_rows
+from EMDAT_core.utils import cast_int, cast_float
 import csv
 import params
 
 
 class TobiiV3Recording(Recording):
+
+    # Tobii Studio V3 exports gaze samples, fixations, saccades and events in the same file
+    single_pass_export = True
+
     def read_all_data(self, all_file):
-        """Returns a list of "Datapoint"s read from an data file.
+        """Returns a GazeSampleTable with the "Datapoint"s read from an data file.
 
         Args:
             all_file:A string containing the name of the data file output by the Tobii software.
 
         Returns:
-            a list of "Datapoint"s
+            a GazeSampleTable
         """
-        all_data = []
-        with open(all_file, 'r') as f:
-            reader = csv.DictReader(f, delimiter="\t")
-            last_pupil_left = -1
-            last_pupil_right = -1
-            last_time = -1
-
-            for row in reader:
-                if row["MediaName"] != 'ScreenRec':
-#                if row["MediaName"] != 'Screen Recordings (1)':  # ignore non-recording data point
-                    continue
-                if not row["ValidityLeft"] or not row["ValidityRight"]: #ignore data point with no validity information
-                    continue
-                gaze_point_x = EMDAT_core.utils.cast_float(row["GazePointX (MCSpx)"], -1)
-                gaze_point_y = EMDAT_core.utils.cast_float(row["GazePointY (MCSpx)"], -1)
-                pupil_left = EMDAT_core.utils.cast_float(row["PupilLeft"], -1)
-                pupil_right = EMDAT_core.utils.cast_float(row["PupilRight"], -1)
-                distance_left = EMDAT_core.utils.cast_float(row["DistanceLeft"], -1)
-                distance_right = EMDAT_core.utils.cast_float(row["DistanceRight"], -1)
-                timestamp = EMDAT_core.utils.cast_int(row["RecordingTimestamp"])
-                data = {'participant_name': row["ParticipantName"],
-                        "timestamp": timestamp,
-                        "pupilsize": EMDAT_core.Recording.get_pupil_size(pupil_left, pupil_right),
-                        "pupilvelocity": EMDAT_core.Recording.get_pupil_velocity(last_pupil_left, last_pupil_right, pupil_left, pupil_right, (timestamp-last_time) ),
-                        "distance": EMDAT_core.Recording.get_distance(distance_left, distance_right),
-                        "is_valid": EMDAT_core.utils.cast_int(row["ValidityRight"]) < 2 or EMDAT_core.utils.cast_int(row["ValidityLeft"]) < 2,
-                        "is_valid_blink": EMDAT_core.utils.cast_int(row["ValidityRight"]) < 2 and EMDAT_core.utils.cast_int(row["ValidityLeft"]) < 2,
-                        "stimuliname": row["MediaName"],
-                        "fixationindex": EMDAT_core.utils.cast_int(row["FixationIndex"]),
-                        "gazepointx": gaze_point_x,
-                        "gazepointy": gaze_point_y}
-                all_data.append(Datapoint(data))
-                last_pupil_left = pupil_left
-                last_pupil_right = pupil_right
-                last_time = timestamp
-
-        return all_data
+        return read_export(all_file, AllDataParser(self.read_plan.get_skipped_sample_columns()))[0]
 
     def read_fixation_data(self, fixation_file):
         """Returns a list of "Fixation"s read from the data file file.
@@ -72,28 +41,7 @@ class TobiiV3Recording(Recording):
         Returns:
             a list of "Fixation"s
         """
-
-        all_fixation = []
-        with open(fixation_file, 'r') as f:
-            currentfix = 0
-            reader = csv.DictReader(f, delimiter='\t')
-            for row in reader:
-                if row["MediaName"] != 'ScreenRec':
-#                if row["MediaName"] != 'Screen Recordings (1)':  # ignore non-recording data point
-                    continue
-                if not row["ValidityLeft"] or not row["ValidityRight"] or not row["FixationPointX (MCSpx)"] or not row["FixationPointY (MCSpx)"]: #ignore data point with no information
-                    continue
-                if row["GazeEventType"] != "Fixation" or currentfix == row["FixationIndex"]: #if not a fixation or the current fixation
-                    continue
-                data = {"fixationindex": EMDAT_core.utils.cast_int(row["FixationIndex"]),
-                        "timestamp": EMDAT_core.utils.cast_int(row["RecordingTimestamp"]),
-                        "fixationduration": EMDAT_core.utils.cast_int(row["GazeEventDuration"]),
-                        "fixationpointx": EMDAT_core.utils.cast_int(row["FixationPointX (MCSpx)"]),
-                        "fixationpointy": EMDAT_core.utils.cast_int(row["FixationPointY (MCSpx)"])}
-                all_fixation.append(Fixation(data, self.media_offset))
-                currentfix = row["FixationIndex"]
-
-        return all_fixation
+        return read_export(fixation_file, FixationParser(self.media_offset))[0]
 
     def read_saccade_data(self, saccade_file):
         """Returns a list of "Saccade"s read from the data file file.
@@ -104,107 +52,7 @@ class TobiiV3Recording(Recording):
         Returns:
             a list of "Saccade"s
         """
-
-        all_saccade = []
-        with open(saccade_file, 'r') as f:
-            reader = csv.DictReader(f, delimiter='\t')
-            in_saccade = False
-            in_fixation = False
-            last_gaze_coord = (0, 0, 0) #timestamp X Y
-            saccade_vect = []
-            saccade_duration = 0
-            current_index = 0
-
-            nb_invalid_temp = 0
-            nb_valid_sample = 0
-            nb_sample = 0
-
-            for row in reader:
-                if row["MediaName"] != 'ScreenRec' or not row["EyeTrackerTimestamp"]:
-#                if row["MediaName"] != 'Screen Recordings (1)' or not row["EyeTrackerTimestamp"]:  # ignore non-recording data point
-                    continue
-
-                if in_fixation:
-                    if row["GazeEventType"] == "Fixation":
-                        nb_invalid_temp = 0
-                    elif row["GazeEventType"] == "Saccade": #new saccade
-                        in_fixation = False
-                        in_saccade = True
-                        current_index = row["SaccadeIndex"]
-                        saccade_vect = [last_gaze_coord]
-                        nb_valid_sample = 0
-
-                        #add current sample
-                        if (EMDAT_core.utils.cast_int(row["ValidityLeft"])<2 or EMDAT_core.utils.cast_int(row["ValidityRight"])<2) and row["GazePointX (ADCSpx)"] and row["GazePointY (ADCSpx)"]: #ignore data point with no valid data
-                            saccade_vect.append( [EMDAT_core.utils.cast_int(row["RecordingTimestamp"]), EMDAT_core.utils.cast_int(row["GazePointX (ADCSpx)"]), EMDAT_core.utils.cast_int(row["GazePointY (ADCSpx)"])] )
-                            nb_valid_sample += 1
-
-                        if last_valid:
-                            nb_valid_sample += 1
-
-                        nb_sample = 2 + nb_invalid_temp #current gaze sample + last gaze sample of the previous fixation + eventually all unclasified gaze samples in between
-                        nb_invalid_temp = 0
-                    else: #unclassified gaze samples
-                        nb_invalid_temp += 1
-
-                elif in_saccade:
-                    if row["GazeEventType"] == "Fixation":
-                        in_fixation = True
-                        in_saccade = False
-
-                        #end of last saccade
-                        if (EMDAT_core.utils.cast_int(row["ValidityLeft"])<2 or EMDAT_core.utils.cast_int(row["ValidityRight"])<2) and row["GazePointX (ADCSpx)"] and row["GazePointY (ADCSpx)"]: #valid last datapoint
-                            saccade_vect.append( [EMDAT_core.utils.cast_int(row["RecordingTimestamp"]), EMDAT_core.utils.cast_int(row["GazePointX (ADCSpx)"]), EMDAT_core.utils.cast_int(row["GazePointY (ADCSpx)"])] )
-                            nb_valid_sample += 1
-                        elif (row["FixationPointX (MCSpx)"] and row["FixationPointY (MCSpx)"]): #if gaze sample not valid, try to use fixation data instead
-                            saccade_vect.append( [EMDAT_core.utils.cast_int(row["RecordingTimestamp"]), EMDAT_core.utils.cast_int(row["FixationPointX (MCSpx)"]), EMDAT_core.utils.cast_int(row["FixationPointY (MCSpx)"])] )
-                            nb_valid_sample += 1
-                        nb_sample += 1
-
-                        rate_valid_sample = float(nb_valid_sample) / nb_sample
-                        if rate_valid_sample >= params.VALID_SAMPLES_PROP_SACCADE: #if saccade quality is above the threshold
-                            saccade_duration = EMDAT_core.utils.cast_int(row["RecordingTimestamp"]) - saccade_vect[0][0]
-                            dist = EMDAT_core.Recording.get_saccade_distance(saccade_vect)
-                            accel = -1#Recording.get_saccade_acceleration(saccade_vect)
-                            speed = float(dist) / EMDAT_core.utils.cast_int(saccade_duration)
-                            data = {"saccadeindex": EMDAT_core.utils.cast_int(current_index),
-                                    "timestamp": saccade_vect[0][0],
-                                    "saccadeduration": EMDAT_core.utils.cast_int(saccade_duration),
-                                    "saccadestartpointx": saccade_vect[0][1],
-                                    "saccadestartpointy": saccade_vect[0][2],
-                                    "saccadeendpointx": saccade_vect[-1][1],
-                                    "saccadeendpointy": saccade_vect[-1][2],
-                                    "saccadedistance": dist,
-                                    "saccadespeed": speed,
-                                    "saccadeacceleration": accel,
-									"saccadequality": rate_valid_sample
-                                    }
-                            all_saccade.append(Saccade(data, self.media_offset))
-                            nb_valid_sample = 0
-                            nb_sample = 0
-
-                    elif row["GazeEventType"] == "Saccade":
-                        if (EMDAT_core.utils.cast_int(row["ValidityLeft"])<2 or EMDAT_core.utils.cast_int(row["ValidityRight"])<2) and row["GazePointX (ADCSpx)"] and row["GazePointY (ADCSpx)"]: #ignore data point with no valid data
-                            saccade_vect.append( [EMDAT_core.utils.cast_int(row["RecordingTimestamp"]), EMDAT_core.utils.cast_int(row["GazePointX (ADCSpx)"]), EMDAT_core.utils.cast_int(row["GazePointY (ADCSpx)"])] )
-                            nb_valid_sample += 1
-                        nb_sample += 1
-                    else: #unclassified gaze samples
-                        nb_sample += 1
-                    nb_invalid_temp = 0
-
-                else: #wait for the first fixation
-                    if row["GazeEventType"] == "Fixation":
-                        in_fixation = True
-
-                if row["GazePointX (ADCSpx)"] and row["GazePointY (ADCSpx)"]:
-                    last_gaze_coord = (EMDAT_core.utils.cast_int(row["RecordingTimestamp"]), EMDAT_core.utils.cast_int(row["GazePointX (ADCSpx)"]), EMDAT_core.utils.cast_int(row["GazePointY (ADCSpx)"]))
-                    last_valid = (EMDAT_core.utils.cast_int(row["ValidityLeft"])<2 or EMDAT_core.utils.cast_int(row["ValidityRight"])<2)
-                elif row["GazeEventType"] == "Fixation" and row["FixationPointX (MCSpx)"] and row["FixationPointY (MCSpx)"]: #if last sample not valid, at least check if valid data about the fixation
-                    last_gaze_coord = (EMDAT_core.utils.cast_int(row["RecordingTimestamp"]), EMDAT_core.utils.cast_int(row["FixationPointX (MCSpx)"]), EMDAT_core.utils.cast_int(row["FixationPointY (MCSpx)"]))
-                    last_valid = True
-
-        return all_saccade
-
+        return read_export(saccade_file, SaccadeParser(self.media_offset))[0]
 
     def read_event_data(self, event_file):
         """Returns a list of "Event"s read from an data file.
@@ -215,26 +63,369 @@ class TobiiV3Recording(Recording):
         Returns:
             a list of "Event"s
         """
+        return read_export(event_file, EventParser(self.media_offset))[0]
+
+    def iter_all_data(self, all_file):
+        """Iterates over the samples of a data file, without keeping them in memory.
+
+        Args:
+            all_file:A string containing the name of the data file output by the Tobii software.
+
+        Yields:
+            a dictionary with the attributes of each sample, as accepted by GazeSampleTableBuilder.append
+        """
+        return iter_export(all_file, AllDataParser(self.read_plan.get_skipped_sample_columns()))
+
+    def iter_fixations(self, fixation_file):
+        """Iterates over the "Fixation"s of a data file, without keeping them in memory.
+
+        Args:
+            fixation_file: A string containing the name of the data file output by the Tobii software.
+
+        Yields:
+            "Fixation"s
+        """
+        return iter_export(fixation_file, FixationParser(self.media_offset))
+
+    def iter_saccades(self, saccade_file):
+        """Iterates over the "Saccade"s of a data file, without keeping them in memory.
+
+        Args:
+            saccade_file: A string containing the name of the data file output by the Tobii software.
+
+        Yields:
+            "Saccade"s
+        """
+        return iter_export(saccade_file, SaccadeParser(self.media_offset))
+
+    def iter_events(self, event_file):
+        """Iterates over the "Event"s of a data file, without keeping them in memory.
+
+        Args:
+            event_file: A string containing the name of the data file output by the Tobii software.
 
-        all_event = []
-        with open(event_file, 'r') as f:
-            reader = csv.DictReader(f, delimiter='\t')
-            for row in reader:
-                if row["MediaName"] != 'ScreenRec':
-                #if row["MediaName"] != 'Screen Recordings (1)':  # ignore non-recording data point
-                    continue
-                if row["MouseEventIndex"] : #mouse event
-                    data = {"timestamp": EMDAT_core.utils.cast_int(row["RecordingTimestamp"]),
-                        "event": row["MouseEvent"]+"MouseClick",
-                        "x_coord": EMDAT_core.utils.cast_int(row["MouseEventX (MCSpx)"]),
-                        "y_coord": EMDAT_core.utils.cast_int(row["MouseEventY (MCSpx)"])
-                        }
-                    all_event.append(Event(data, self.media_offset))
-                elif row["KeyPressEventIndex"] : #keyboard event
-                    data = {"timestamp": EMDAT_core.utils.cast_int(row["RecordingTimestamp"]),
-                        "event": "KeyPress",
-                        "key_name": row["KeyPressEvent"]
-                        }
-                    all_event.append(Event(data, self.media_offset))
-
-        return all_event
+        Yields:
+            "Event"s
+        """
+        return iter_export(event_file, EventParser(self.media_offset))
+
+    def read_combined_data(self, data_file, read_saccades=True, read_events=True):
+        """Reads "Datapoint"s, "Fixation"s, "Saccade"s and "Event"s from a data file in a single pass.
+
+        Args:
+            data_file: A string containing the name of the data file output by the Tobii software.
+            read_saccades: True if the "Saccade"s should be read
+            read_events: True if the "Event"s should be read
+
+        Returns:
+            a GazeSampleTable, a list of "Fixation"s, a list of "Saccade"s (None if not read)
+            and a list of "Event"s (None if not read)
+        """
+        parsers = [AllDataParser(self.read_plan.get_skipped_sample_columns()), FixationParser(self.media_offset)]
+        if read_saccades:
+            parsers.append(SaccadeParser(self.media_offset))
+        if read_events:
+            parsers.append(EventParser(self.media_offset))
+        streams = read_export(data_file, *parsers)
+
+        all_data, fix_data = streams[0], streams[1]
+        sac_data = streams[2] if read_saccades else None
+        event_data = streams[-1] if read_events else None
+        return all_data, fix_data, sac_data, event_data
+
+
+def read_export(data_file, *parsers):
+    """Reads a data file exported by Tobii Studio V3 once and feeds each row to all the given parsers.
+    Large files are parsed in parallel (see EMDAT_core.export_parsing.read_rows).
+
+    Args:
+        data_file: A string containing the name of the data file output by the Tobii software.
+        parsers: one or more row parsers (e.g., AllDataParser, FixationParser)
+
+    Returns:
+        a list with the data read by each parser, in the same order as the parsers
+    """
+    fieldnames, data_start = read_export_header(data_file)
+    return read_rows(data_file, list(parsers), fieldnames, data_start, '\t')
+
+
+def iter_export(data_file, parser):
+    """Reads a data file exported by Tobii Studio V3 row by row and yields the items parsed from each row.
+
+    Args:
+        data_file: A string containing the name of the data file output by the Tobii software.
+        parser: a row parser (e.g., AllDataParser, FixationParser)
+
+    Returns:
+        a generator of the items returned by the parser (e.g., a dictionary for each sample, "Fixation"s)
+    """
+    fieldnames, data_start = read_export_header(data_file)
+    return iter_rows(data_file, parser, fieldnames, data_start, '\t')
+
+
+def read_export_header(data_file):
+    """Returns the names of the columns of a data file exported by Tobii Studio V3 (first line of the file)
+    and the position of its first row
+    """
+    header, data_start = read_header(data_file)
+    return next(csv.reader([header], delimiter='\t')), data_start
+
+
+class AllDataParser(RowParser):
+    """Builds the GazeSampleTable of "Datapoint"s from the rows of a Tobii Studio V3 export
+
+    Like the other parsers, parse(row) returns what was read from the row (None if nothing), which
+    read_export collects in self.data and iter_export yields.
+    """
+
+    def __init__(self, skipped_columns=()):
+        """
+        Args:
+            skipped_columns: the names of the optional columns of the samples which are not read (see ReadPlan)
+        """
+        self.skipped_columns = tuple(skipped_columns)
+        RowParser.__init__(self)
+        self.read_pupil = 'pupilsize' not in self.skipped_columns or 'pupilvelocity' not in self.skipped_columns
+        self.read_distance = 'distance' not in self.skipped_columns
+        self.read_gaze_x = 'gazepointx' not in self.skipped_columns
+        self.read_gaze_y = 'gazepointy' not in self.skipped_columns
+        self.last_pupil_left = -1
+        self.last_pupil_right = -1
+        self.last_time = -1
+
+    def compile(self, fieldnames):
+        (self.media_name, self.validity_left, self.validity_right, self.gaze_x, self.gaze_y, self.pupil_left,
+         self.pupil_right, self.distance_left, self.distance_right, self.timestamp, self.participant_name,
+         self.fixation_index) = get_column_indices(fieldnames, (
+            "MediaName", "ValidityLeft", "ValidityRight", "GazePointX (MCSpx)", "GazePointY (MCSpx)", "PupilLeft",
+            "PupilRight", "DistanceLeft", "DistanceRight", "RecordingTimestamp", "ParticipantName", "FixationIndex"))
+
+    def parse(self, row):
+        media_name = row[self.media_name]
+        if media_name != 'ScreenRec':
+#        if media_name != 'Screen Recordings (1)':  # ignore non-recording data point
+            return
+        validity_left = row[self.validity_left]
+        validity_right = row[self.validity_right]
+        if not validity_left or not validity_right: #ignore data point with no validity information
+            return
+        validity_left = cast_int(validity_left)
+        validity_right = cast_int(validity_right)
+        timestamp = cast_int(row[self.timestamp])
+        data = {'participant_name': row[self.participant_name],
+                "timestamp": timestamp,
+                "is_valid": validity_right < 2 or validity_left < 2,
+                "is_valid_blink": validity_right < 2 and validity_left < 2,
+                "stimuliname": media_name,
+                "fixationindex": cast_int(row[self.fixation_index])}
+        if self.read_pupil:
+            pupil_left = cast_float(row[self.pupil_left], -1)
+            pupil_right = cast_float(row[self.pupil_right], -1)
+            data["pupilsize"] = get_pupil_size(pupil_left, pupil_right)
+            data["pupilvelocity"] = get_pupil_velocity(self.last_pupil_left, self.last_pupil_right, pupil_left, pupil_right, (timestamp-self.last_time) )
+            self.last_pupil_left = pupil_left
+            self.last_pupil_right = pupil_right
+            self.last_time = timestamp
+        if self.read_distance:
+            data["distance"] = get_distance(cast_float(row[self.distance_left], -1), cast_float(row[self.distance_right], -1))
+        if self.read_gaze_x:
+            data["gazepointx"] = cast_float(row[self.gaze_x], -1)
+        if self.read_gaze_y:
+            data["gazepointy"] = cast_float(row[self.gaze_y], -1)
+        self.synchronized = True  # the pupil velocity only depends on the previous sample
+        return data
+
+    def new_data(self):
+        return GazeSampleTableBuilder(self.skipped_columns)
+
+    def get_data(self):
+        return self.data.build()
+
+    def join_data(self, parts):
+        return GazeSampleTable.concatenate(parts)
+
+
+class FixationParser(RowParser):
+    """Builds the list of "Fixation"s from the rows of a Tobii Studio V3 export
+    """
+
+    def __init__(self, media_offset=(0, 0)):
+        RowParser.__init__(self)
+        self.media_offset = media_offset
+        self.currentfix = 0
+
+    def compile(self, fieldnames):
+        (self.media_name, self.validity_left, self.validity_right, self.fixation_x, self.fixation_y,
+         self.gaze_event_type, self.fixation_index, self.timestamp, self.gaze_event_duration) = get_column_indices(fieldnames, (
+            "MediaName", "ValidityLeft", "ValidityRight", "FixationPointX (MCSpx)", "FixationPointY (MCSpx)",
+            "GazeEventType", "FixationIndex", "RecordingTimestamp", "GazeEventDuration"))
+
+    def parse(self, row):
+        if row[self.media_name] != 'ScreenRec':
+#        if row[self.media_name] != 'Screen Recordings (1)':  # ignore non-recording data point
+            return
+        fixation_x = row[self.fixation_x]
+        fixation_y = row[self.fixation_y]
+        if not row[self.validity_left] or not row[self.validity_right] or not fixation_x or not fixation_y: #ignore data point with no information
+            return
+        fixation_index = row[self.fixation_index]
+        if row[self.gaze_event_type] != "Fixation" or self.currentfix == fixation_index: #if not a fixation or the current fixation
+            return
+        self.currentfix = fixation_index
+        self.synchronized = True
+        return Fixation.from_values(cast_int(fixation_index), cast_int(row[self.timestamp]),
+                                    cast_int(row[self.gaze_event_duration]), cast_int(fixation_x), cast_int(fixation_y),
+                                    self.media_offset)
+
+
+class SaccadeParser(RowParser):
+    """Builds the list of "Saccade"s from the rows of a Tobii Studio V3 export
+
+    Saccades are reconstructed from the gaze samples between two fixations, so this parser
+    keeps the state of the fixation/saccade state machine between calls. The state machine is
+    synchronized on a fixation sample with a gaze or fixation point: after such a sample, the parser
+    is in a fixation with no pending unclassified samples whatever the previous samples were, and the
+    counters of the next saccade are reset when it starts.
+    """
+
+    def __init__(self, media_offset=(0, 0)):
+        RowParser.__init__(self)
+        self.media_offset = media_offset
+        self.in_saccade = False
+        self.in_fixation = False
+        self.last_gaze_coord = (0, 0, 0) #timestamp X Y
+        self.last_valid = False
+        self.saccade_vect = []
+        self.current_index = 0
+
+        self.nb_invalid_temp = 0
+        self.nb_valid_sample = 0
+        self.nb_sample = 0
+
+    def compile(self, fieldnames):
+        (self.media_name, self.eyetracker_timestamp, self.gaze_event_type, self.saccade_index, self.validity_left,
+         self.validity_right, self.gaze_x, self.gaze_y, self.fixation_x, self.fixation_y,
+         self.timestamp) = get_column_indices(fieldnames, (
+            "MediaName", "EyeTrackerTimestamp", "GazeEventType", "SaccadeIndex", "ValidityLeft", "ValidityRight",
+            "GazePointX (ADCSpx)", "GazePointY (ADCSpx)", "FixationPointX (MCSpx)", "FixationPointY (MCSpx)",
+            "RecordingTimestamp"))
+
+    def parse(self, row):
+        if row[self.media_name] != 'ScreenRec' or not row[self.eyetracker_timestamp]:
+#        if row[self.media_name] != 'Screen Recordings (1)' or not row[self.eyetracker_timestamp]:  # ignore non-recording data point
+            return
+        saccade = None
+        event_type = row[self.gaze_event_type]
+        gaze_x = row[self.gaze_x]
+        gaze_y = row[self.gaze_y]
+        timestamp = cast_int(row[self.timestamp])
+
+        if self.in_fixation:
+            if event_type == "Fixation":
+                self.nb_invalid_temp = 0
+            elif event_type == "Saccade": #new saccade
+                self.in_fixation = False
+                self.in_saccade = True
+                self.current_index = row[self.saccade_index]
+                self.saccade_vect = [self.last_gaze_coord]
+                self.nb_valid_sample = 0
+
+                #add current sample
+                if gaze_x and gaze_y and (cast_int(row[self.validity_left])<2 or cast_int(row[self.validity_right])<2): #ignore data point with no valid data
+                    self.saccade_vect.append( [timestamp, cast_int(gaze_x), cast_int(gaze_y)] )
+                    self.nb_valid_sample += 1
+
+                if self.last_valid:
+                    self.nb_valid_sample += 1
+
+                self.nb_sample = 2 + self.nb_invalid_temp #current gaze sample + last gaze sample of the previous fixation + eventually all unclasified gaze samples in between
+                self.nb_invalid_temp = 0
+            else: #unclassified gaze samples
+                self.nb_invalid_temp += 1
+
+        elif self.in_saccade:
+            if event_type == "Fixation":
+                self.in_fixation = True
+                self.in_saccade = False
+
+                #end of last saccade
+                if gaze_x and gaze_y and (cast_int(row[self.validity_left])<2 or cast_int(row[self.validity_right])<2): #valid last datapoint
+                    self.saccade_vect.append( [timestamp, cast_int(gaze_x), cast_int(gaze_y)] )
+                    self.nb_valid_sample += 1
+                elif (row[self.fixation_x] and row[self.fixation_y]): #if gaze sample not valid, try to use fixation data instead
+                    self.saccade_vect.append( [timestamp, cast_int(row[self.fixation_x]), cast_int(row[self.fixation_y])] )
+                    self.nb_valid_sample += 1
+                self.nb_sample += 1
+
+                rate_valid_sample = float(self.nb_valid_sample) / self.nb_sample
+                if rate_valid_sample >= params.VALID_SAMPLES_PROP_SACCADE: #if saccade quality is above the threshold
+                    saccade_vect = self.saccade_vect
+                    saccade_duration = timestamp - saccade_vect[0][0]
+                    dist = get_saccade_distance(saccade_vect)
+                    accel = -1#Recording.get_saccade_acceleration(saccade_vect)
+                    speed = float(dist) / cast_int(saccade_duration)
+                    saccade = Saccade.from_values(cast_int(self.current_index), saccade_vect[0][0],
+                                                  cast_int(saccade_duration), dist, speed, accel,
+                                                  saccade_vect[0][1], saccade_vect[0][2],
+                                                  saccade_vect[-1][1], saccade_vect[-1][2], rate_valid_sample,
+                                                  self.media_offset)
+                    self.nb_valid_sample = 0
+                    self.nb_sample = 0
+
+            elif event_type == "Saccade":
+                if gaze_x and gaze_y and (cast_int(row[self.validity_left])<2 or cast_int(row[self.validity_right])<2): #ignore data point with no valid data
+                    self.saccade_vect.append( [timestamp, cast_int(gaze_x), cast_int(gaze_y)] )
+                    self.nb_valid_sample += 1
+                self.nb_sample += 1
+            else: #unclassified gaze samples
+                self.nb_sample += 1
+            self.nb_invalid_temp = 0
+
+        else: #wait for the first fixation
+            if event_type == "Fixation":
+                self.in_fixation = True
+
+        if gaze_x and gaze_y:
+            self.last_gaze_coord = (timestamp, cast_int(gaze_x), cast_int(gaze_y))
+            self.last_valid = (cast_int(row[self.validity_left])<2 or cast_int(row[self.validity_right])<2)
+            if event_type == "Fixation":
+                self.synchronized = True
+        elif event_type == "Fixation" and row[self.fixation_x] and row[self.fixation_y]: #if last sample not valid, at least check if valid data about the fixation
+            self.last_gaze_coord = (timestamp, cast_int(row[self.fixation_x]), cast_int(row[self.fixation_y]))
+            self.last_valid = True
+            self.synchronized = True
+        return saccade
+
+
+class EventParser(RowParser):
+    """Builds the list of "Event"s from the rows of a Tobii Studio V3 export
+    """
+
+    def __init__(self, media_offset=(0, 0)):
+        RowParser.__init__(self)
+        self.media_offset = media_offset
+        self.synchronized = True  # no state between rows
+
+    def compile(self, fieldnames):
+        (self.media_name, self.mouse_event_index, self.mouse_event, self.mouse_x, self.mouse_y,
+         self.key_press_event_index, self.key_press_event, self.timestamp) = get_column_indices(fieldnames, (
+            "MediaName", "MouseEventIndex", "MouseEvent", "MouseEventX (MCSpx)", "MouseEventY (MCSpx)",
+            "KeyPressEventIndex", "KeyPressEvent", "RecordingTimestamp"))
+
+    def parse(self, row):
+        if row[self.media_name] != 'ScreenRec':
+        #if row[self.media_name] != 'Screen Recordings (1)':  # ignore non-recording data point
+            return
+        if row[self.mouse_event_index] : #mouse event
+            data = {"timestamp": cast_int(row[self.timestamp]),
+                "event": row[self.mouse_event]+"MouseClick",
+                "x_coord": cast_int(row[self.mouse_x]),
+                "y_coord": cast_int(row[self.mouse_y])
+                }
+            return Event(data, self.media_offset)
+        elif row[self.key_press_event_index] : #keyboard event
+            data = {"timestamp": cast_int(row[self.timestamp]),
+                "event": "KeyPress",
+                "key_name": row[self.key_press_event]
+                }
+            return Event(data, self.media_offset)
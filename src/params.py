@@ -21,6 +21,32 @@ EXTERNALLOGDATAFOLDER = "./sampledata/external logs"
 EYETRACKERTYPE = "TobiiV3" #Tobii Studio version 3x
 #EYETRACKERTYPE = "SMI" # SMI/BeGaze
 
+# the folder where the data parsed from the eye tracker exports is cached, so that each export is only parsed once
+# (None to disable the cache, e.g., "./cache" to enable it)
+PARSEDDATACACHEFOLDER = None
+
+# the maximum size of the cache folder in bytes. The least recently used data is removed beyond that size.
+PARSEDDATACACHEMAXSIZE = 2 * 1024 ** 3
+
+# True to read the eye tracker exports segment by segment (see Recording.process_rec_streaming) instead of loading
+# each recording in memory first. This reduces the memory used by long recordings, but bypasses the cache above.
+STREAMING = False
+
+# the number of processes used to parse one large export file (None to use all the CPUs, 1 to parse in a single process).
+# Parsing in several processes starts new processes, so the script running EMDAT needs an if __name__ == '__main__' guard
+PARSINGPROCESSES = 1
+
+# the size in bytes from which an export file is parsed in several processes (see PARSINGPROCESSES)
+PARALLELPARSINGMINSIZE = 64 * 1024 ** 2
+
+# the maximum size in bytes of the decompressed data waiting to be parsed when reading a compressed export
+# (.gz, .xz or .zst), which is decompressed in a background thread
+DECOMPRESSIONBUFFERSIZE = 16 * 1024 ** 2
+
+# the maximum size in bytes of the label bitmap in which the "AOI"s whose shape never changes are rasterized, so that
+# the samples, fixations and clics are looked up in it instead of being tested against the polygons (0 to disable)
+AOIRASTERMAXSIZE = 64 * 1024 ** 2
+
 
 # ####################### Eye tracker specific parameters ##############################################################
 
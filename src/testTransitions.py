@@ -0,0 +1,39 @@
+"""
+UBC Eye Movement Data Analysis Toolkit (EMDAT), Version 3
+
+Regression test of the transitions between "AOI"s counted for a Segment (see FixationAOIs.get_transition_counts).
+Run with: python -m unittest testTransitions
+
+Institution: The University of British Columbia.
+"""
+
+import unittest
+from EMDAT_core.AOI import AOI, FixationAOIs
+from EMDAT_core.data_structures import Fixation
+
+
+class TestTransitionCounts(unittest.TestCase):
+
+    def setUp(self):
+        # a global AOI and a dynamic AOI, side by side
+        self.a = AOI('a', [[(0, 0), (100, 0), (100, 100), (0, 100)]], [[]], [[]])
+        self.b = AOI('b', [[(200, 0), (300, 0), (300, 100), (200, 100)]], [[]], [[(100, 500), (620, 1000)]])
+        points = {'a': 50, 'b': 250}
+        # the fixation at 300 in 'a' starts in the first active interval of 'b' but ends after it
+        fixations = [(0, 100, 'a'), (150, 100, 'b'), (300, 300, 'a'), (650, 100, 'b'), (800, 100, 'a'), (950, 40, 'b')]
+        self.fixations = [Fixation.from_values(i, timestamp, duration, points[aid], 50)
+                          for i, (timestamp, duration, aid) in enumerate(fixations)]
+
+    def test_dynamic_aoi(self):
+        """The fixations straddling the end of an active interval of an AOI are not in the transitions to the AOI
+        """
+        counts = FixationAOIs(self.fixations, [self.a, self.b]).get_transition_counts(0, 1000)
+        self.assertEqual(counts[:, 1].tolist(), [1, 1])
+
+    def test_global_aoi(self):
+        counts = FixationAOIs(self.fixations, [self.a, self.b]).get_transition_counts(0, 1000)
+        self.assertEqual(counts[:, 0].tolist(), [0, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()